@@ -12,6 +12,7 @@ import useFonts from './src/hooks/useFonts';
 
 import { ThemeProvider } from './src/context/ThemeContext';
 import useAppSettings from './src/store/useAppSettings';
+import { installSessionInterceptors } from './src/store/session';
 
 // Components
 import Header from './src/components/Header';
@@ -25,6 +26,9 @@ import TrainingScreen from './src/screens/TrainingScreen';
 import NutritionScreen from './src/screens/NutritionScreen';
 import ProfileScreen from './src/screens/ProfileScreen';
 
+// Token handling for every API request (refresh before expiry, logout on 401)
+installSessionInterceptors();
+
 const { width } = Dimensions.get('window');
 const screenComponents = [HomeScreen, BotScreen, ThreadsScreen, HealthScreen, TrainingScreen, NutritionScreen, ProfileScreen];
 
@@ -1,56 +1,145 @@
 # app.py:
-from flask import Flask, request, jsonify, send_from_directory, send_file
+# Application factory (create_app) and the API routes. `flask --app app run` finds the factory.
+from flask import Blueprint, Flask, Request, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import os
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from itsdangerous import URLSafeTimedSerializer as Serializer
-from datetime import datetime, timedelta
+import io
 import json
 import base64
-import requests
-from modules.models import db, User, UserThreads, UserProfile
+import asyncio
+import time
+import threading
+from modules.models import db, User, UserThreads, UserProfile, get_cached_user, get_cached_profile, invalidate_cached_user, invalidate_cached_profile
 
 # Modules:
-from modules.bot_default import get_initial_message, continue_thread, get_thread_messages
+from modules.bot_default import get_initial_message, continue_thread, get_thread_messages, open_run_stream
+from modules import openai_service, message_store, tts_cache
+from modules.tts_stream import stream_speech
+from modules.image_pipeline import prepare_image
+from modules import image_cache
+from modules.voice_memo import compact_audio, COMPACT_BY_DEFAULT
+from modules import jobs
+from modules.titles import generate_title, save_thread_title, thread_language
+from modules import auth
+from modules import migrations
+from modules import database
+from modules import thread_listing
+from modules import batch
+from modules import responses
+from modules import metrics
+from modules import submissions
+from modules import admission
+from modules import audio_storage
+from modules.assistant_registry import sync_assistants
 
-from pathlib import Path
-import uuid
 import openai
-client = openai.OpenAI(
-  api_key = os.environ.get("OPENAI_API_KEY_HEALTHAPP")
-)
 
-app = Flask(__name__)
-cors_origin = os.environ.get("CORS_ORIGIN", "exp://192.168.20.122:8081")
-#CORS(app, origins=[cors_origin])
-CORS(app) # for development only
-
-# Database configuration (DigitalOcean hosting)
-postgres_user = os.environ.get("POSTGRES_USER_HEALTHAPP")
-postgres_pw = os.environ.get("POSTGRES_PW_HEALTHAPP")
-postgres_host = os.environ.get("POSTGRES_HOST_HEALTHAPP")
-postgres_port = os.environ.get("POSTGRES_PORT_HEALTHAPP")
-postgres_db = os.environ.get("POSTGRES_DB_HEALTHAPP")
-
-app.config['SQLALCHEMY_DATABASE_URI'] = f'postgresql://{postgres_user}:{postgres_pw}@{postgres_host}:{postgres_port}/{postgres_db}?sslmode=require'
-
-app.config['SECRET_KEY'] = os.environ.get("SECRET_TOKEN_KEY_HEALTHAPP")
-
-# Initialize SQLAlchemy with the app
-db.init_app(app)
-
-with app.app_context():
-    #db.drop_all() # For dev to delete all tables and create them from scratch
-    db.create_all()
+class InMemoryRequest(Request):
+    # Keep uploads (images, voice memos) in memory instead of spooling them to temp files on disk
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
+bp = Blueprint('api', __name__)
+
+# Connection pool gauges of the app serving /metrics
+metrics.register_collector(lambda: database.pool_metric_families(db.engines))
+
+MIGRATE_ON_START = os.environ.get("MIGRATE_ON_START_HEALTHAPP") == "1"  # Development convenience only
+SYNC_ASSISTANTS_ON_START = os.environ.get("SYNC_ASSISTANTS_ON_START_HEALTHAPP", "1") == "1"
+
+def create_app(config=None):
+    # Builds the app without touching the network: the DB engine connects on first use, the OpenAI
+    # client and its event loop are created on first call, schema changes are a deploy step
+    # (python -m modules.migrations upgrade), and background threads start with the first request.
+    # Serve with a preloading server (e.g. gunicorn --preload 'app:create_app()') so workers fork
+    # from an already imported app and come up in milliseconds.
+    started = time.perf_counter()
+    app = Flask(__name__)
+    app.request_class = InMemoryRequest
+    app.config['MAX_CONTENT_LENGTH'] = 25 * 1024 * 1024  # Whisper's upload limit; bounds in-memory uploads
+    cors_origin = os.environ.get("CORS_ORIGIN", "exp://192.168.20.122:8081")
+    #CORS(app, origins=[cors_origin])
+    CORS(app) # for development only
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = database.database_uri()
+    app.config['SQLALCHEMY_BINDS'] = database.replica_binds()  # Read replicas, see modules/database.py
+
+    app.config['SECRET_KEY'] = os.environ.get("SECRET_TOKEN_KEY_HEALTHAPP")
+    app.config.update(config or {})
+
+    # Initialize SQLAlchemy with the app (engines are created here, connections only when first used)
+    db.init_app(app)
+    # Read-your-writes across worker processes: the client carries the time of its last write
+    database.init_app(app)
+
+    # Background threads start with the first request (registered first, so a request rejected by
+    # auth or the rate limits still starts them)
+    app.before_request(lambda: start_background(app))
+
+    # Latency metrics and per-request timing logs, exported at /metrics (registered before auth so
+    # rejected requests are counted too)
+    metrics.init_app(app)
+
+    # Require a valid token on every non-public route
+    auth.init_app(app)
+
+    # Per-user rate limits on the OpenAI-backed routes; shed OpenAI calls are answered with a 503
+    admission.init_app(app)
+
+    # Fast JSON encoding and gzip/brotli compression of responses
+    responses.init_app(app)
+
+    # Sharded audio store settings (the GC sweeper starts with the background work below)
+    audio_storage.init_app(app)
+
+    app.register_blueprint(bp)
+
+    @app.cli.command('sync-assistants')
+    def sync_assistants_command():
+        # Pushes changed assistant_configs to OpenAI (also done in the background after startup)
+        openai_service.run_sync(sync_assistants())
+
+    if MIGRATE_ON_START:
+        # Schema changes are versioned migrations in backend/migrations (see modules/migrations.py)
+        with app.app_context():
+            migrations.upgrade(db.engine)
+            db.engine.dispose()  # No connections may outlive a preloading server's fork
+
+    metrics.log_event("app_created", duration_ms=round((time.perf_counter() - started) * 1000, 1))
+    return app
+
+_background_started = False
+_background_lock = threading.Lock()
+
+def start_background(app):
+    # Job workers (title generation, TTS pre-rendering, transcription), the audio GC sweeper and the
+    # assistant sync, started once per process by its first request, i.e. after any fork
+    global _background_started
+    if _background_started:
+        return
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    if jobs.WORKER_COUNT:
+        jobs.start_workers(app)
+    audio_storage.start_sweeper()
+    if SYNC_ASSISTANTS_ON_START:
+        threading.Thread(target=_sync_assistants, args=(app,), name="assistant-sync", daemon=True).start()
+
+def _sync_assistants(app):
+    # Until it finishes, requests resolve assistants from the last synced rows (see assistant_registry)
+    with app.app_context():
+        openai_service.run_sync(sync_assistants())
 
 
 ### General and Header.js ###
 
-@app.route('/create_user', methods=['POST'])
+@bp.route('/create_user', methods=['POST'])
 def create_user():
     data = request.json
-    print("Received data:", data)
     hashed_password = generate_password_hash(data['password']) # Hash the password
     new_user = User(
         name=data['name'],
@@ -61,72 +150,83 @@ def create_user():
     db.session.add(new_user)
     try:
         db.session.commit()
-        print(f"User created successfully: {new_user.name} {new_user.surname}")
+        metrics.log_event("user_created", user_id=new_user.id)
         return jsonify({"message": "User created successfully"}), 201
     except Exception as e:
         db.session.rollback()
-        print(f"Error creating user: {e}")  # Log any error
+        metrics.log_event("user_create_failed", error=type(e).__name__)
         return jsonify({"error": str(e)}), 500
 
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
 def login():
     data = request.json
     user = User.query.filter_by(email=data['email']).first()
     if user and check_password_hash(user.password, data['password']):
-        # Correct password
-        expiration_time = datetime.utcnow() + timedelta(hours=1)  # Expires 1 hour from now
-        s = Serializer(app.config['SECRET_KEY'])
-        token = s.dumps({'user_id': user.id, 'exp': expiration_time.timestamp()})
-        return jsonify({"token": token, "user": user.name, "user_id": user.id}), 200
+        # Correct password; the token expires 1 hour from now
+        return jsonify({**auth.token_response(user), "user": user.name, "user_id": user.id}), 200
     else:
         # Incorrect password
         return jsonify({"error": "Invalid username or password"}), 401
 
-@app.route('/verify_token', methods=['POST'])
+def token_claims(claims):
+    return {
+        "user": claims['name'],
+        "user_id": claims['user_id'],
+        "user_version": claims['user_version']
+    }
+
+@bp.route('/refresh_token', methods=['POST'])
+def refresh_token():
+    # A valid token is exchanged for a new one, so an active session outlives TOKEN_LIFETIME
+    with database.primary_reads():
+        user = User.query.get(g.user_id)
+    if not user:
+        return jsonify({"error": "Invalid token"}), 401
+    return jsonify(auth.token_response(user)), 200
+
+@bp.route('/verify_token', methods=['POST'])
 def verify_token():
-    token = request.json.get('token')
-    s = Serializer(app.config['SECRET_KEY'])
-    try:
-        data = s.loads(token)
-        # Check if token is expired
-        if datetime.utcnow().timestamp() > data['exp']:
-            return jsonify({"error": "Token expired"}), 401
-        user = User.query.get(data['user_id'])
-        if user:
-            return jsonify({
-                "user": user.name, 
-                "user_id": user.id, 
-                "user_version": user.user_version
-            }), 200
-        else:
-            return jsonify({"user": user.name, "user_id": user.id}), 200
-    except:
+    data = request.get_json(silent=True)
+    token = data.get('token') if isinstance(data, dict) else None
+    # Signature and expiry are checked against the token's own claims (cached), not the database
+    claims = auth.verify(token)
+    if not claims:
         return jsonify({"error": "Invalid token"}), 401
+    return jsonify(token_claims(claims)), 200
+
+@batch.operation('verify_token')
+def batch_verify_token(user_id, user, args):
+    # The batch request's Bearer token has already been verified by auth
+    return token_claims(g.claims), 200
 
-@app.route('/update_language', methods=['POST'])
+@bp.route('/update_language', methods=['POST'])
 def update_language():
     data = request.json
     user_id = data['user_id']
     language = data['language']
-    print("user_id:", user_id)
-    print("language_id:", language)
 
     user = User.query.get(user_id)
     if user:
         user.language = language
         db.session.commit()
-        return jsonify({"message": "Language updated successfully"}), 200
+        invalidate_cached_user(user.id)
+        auth.invalidate_user(user.id)
+        return jsonify({"message": "Language updated successfully", **auth.token_response(user)}), 200
     return jsonify({"error": "User not found"}), 404
 
-@app.route('/get_language', methods=['POST'])
+@batch.operation('get_language')
+def user_language(user_id, user, args):
+    if user:
+        return {"language": user["language"]}, 200
+    return {"error": "User not found"}, 404
+
+@bp.route('/get_language', methods=['POST'])
 def get_language():
     user_id = request.json.get('user_id')
-    user = User.query.get(user_id)
-    if user:
-        return jsonify({"language": user.language}), 200
-    return jsonify({"error": "User not found"}), 404
+    body, status = user_language(user_id, get_cached_user(user_id), {})
+    return jsonify(body), status
 
-@app.route('/update_user_version', methods=['POST'])
+@bp.route('/update_user_version', methods=['POST'])
 def update_user_version():
     if not request.is_json:
         return jsonify({"error": "Invalid request"}), 400
@@ -139,39 +239,35 @@ def update_user_version():
     if user:
         user.user_version = user_version
         db.session.commit()
-        return jsonify({"message": "User version updated successfully"}), 200
+        invalidate_cached_user(user.id)
+        auth.invalidate_user(user.id)
+        return jsonify({"message": "User version updated successfully", **auth.token_response(user)}), 200
     return jsonify({"error": "User not found"}), 404
 
 
 ### Profile.js ###
 
-@app.route('/get_user_profile', methods=['POST'])
+@batch.operation('get_user_profile')
+def user_profile(user_id, user, args):
+    if not user_id:
+        return {"error": "User ID is required"}, 400
+
+    # Formatted profile with goals already parsed, from the cache when possible
+    profile_data = get_cached_profile(user_id)
+    if profile_data:
+        return profile_data, 200
+    return {"error": "Profile not found"}, 404
+
+@bp.route('/get_user_profile', methods=['POST'])
 def get_user_profile():
     try:
-        user_id = request.json.get('user_id')
-        if not user_id:
-            return jsonify({"error": "User ID is required"}), 400
-
-        user_profile = UserProfile.query.filter_by(user_id=user_id).first()
-        if user_profile:
-            # Directly format the profile data for response
-            profile_data = {
-                "age": user_profile.age,
-                "height": user_profile.height,
-                "fitness_level": user_profile.fitness_level,
-                "dietary_restrictions": user_profile.dietary_restrictions or "None",
-                "health_conditions": user_profile.health_conditions or "None",
-                "goals": json.loads(user_profile.goals) if user_profile.goals else {},
-                "height_unit": user_profile.height_unit,
-            }
-            return jsonify(profile_data), 200
-        else:
-            return jsonify({"error": "Profile not found"}), 404
+        body, status = user_profile(request.json.get('user_id'), None, {})
+        return jsonify(body), status
     except Exception as e:
-        print(f"Exception occurred: {e}")
+        metrics.log_event("route_failed", route="get_user_profile", error=type(e).__name__)
         return jsonify({"error": "An error occurred processing your request"}), 500
 
-@app.route('/update_user_profile', methods=['POST'])
+@bp.route('/update_user_profile', methods=['POST'])
 def update_user_profile():
     data = request.json
     user_id = data['user_id']
@@ -194,12 +290,13 @@ def update_user_profile():
 
     db.session.add(user_profile)
     db.session.commit()
+    invalidate_cached_profile(user_id)
     return jsonify({"message": "Profile updated successfully"}), 200
 
 
 ### Settings.js ###
 
-@app.route('/update_user_settings', methods=['POST'])
+@bp.route('/update_user_settings', methods=['POST'])
 def update_user_settings():
     data = request.json
     user_id = data['user_id']
@@ -211,67 +308,87 @@ def update_user_settings():
         user.voice_speed_setting = data['voice_speed_setting']
         user.autoplaybackaudio_setting = data['autoplaybackaudio_setting']
         db.session.commit()
-        return jsonify({"message": "Settings updated successfully"}), 200
+        invalidate_cached_user(user.id)
+        auth.invalidate_user(user.id)
+        return jsonify({"message": "Settings updated successfully", **auth.token_response(user)}), 200
     return jsonify({"error": "User not found"}), 404
 
-@app.route('/get_user_settings', methods=['POST'])
-def get_user_settings():
-    user_id = request.json.get('user_id')
-    user = User.query.get(user_id)
+@batch.operation('get_user_settings')
+def user_settings(user_id, user, args):
     if user:
         settings = {
-            "language": user.language,
-            "display_setting": user.display_setting,
-            "voice_setting": user.voice_setting,
-            "voice_speed_setting": user.voice_speed_setting,
-            "autoplaybackaudio_setting": user.autoplaybackaudio_setting
+            "language": user["language"],
+            "display_setting": user["display_setting"],
+            "voice_setting": user["voice_setting"],
+            "voice_speed_setting": user["voice_speed_setting"],
+            "autoplaybackaudio_setting": user["autoplaybackaudio_setting"]
         }
-        return jsonify(settings), 200
-    return jsonify({"error": "User not found"}), 404
+        return settings, 200
+    return {"error": "User not found"}, 404
+
+@bp.route('/get_user_settings', methods=['POST'])
+def get_user_settings():
+    user_id = request.json.get('user_id')
+    body, status = user_settings(user_id, get_cached_user(user_id), {})
+    return jsonify(body), status
 
 
 ### Threads.js ###
 
 # Route for getting the user's threads #
-@app.route('/get_user_threads', methods=['POST'])
-def get_user_threads():
-    user_id = request.json['user_id']
-    sessions = UserThreads.query.filter_by(user_id=user_id).all()
-    print(f"Fetched threads for user {user_id}: {sessions}")
+@batch.operation('get_user_threads')
+def user_threads(user_id, user, args):
+    _, cursor, limit = thread_listing.listing_params(args)
+    try:
+        sessions, next_cursor = thread_listing.page_user_threads(user_id, cursor, limit)
+    except thread_listing.InvalidCursor as e:
+        return {"error": str(e)}, 400
     session_list = [{
         "thread_id": session.thread_id,
         "date": session.date_created.strftime("%Y-%m-%d"),
         "title": session.title or "Untitled Thread"
     } for session in sessions]
-    return jsonify({"threads": session_list}), 200
+    return {"threads": session_list, "next_cursor": next_cursor}, 200
 
-@app.route('/cleanup_empty_threads', methods=['POST'])
+@bp.route('/get_user_threads', methods=['GET', 'POST'])
+def get_user_threads():
+    # Newest first, one page at a time; pass next_cursor back as "cursor" for the following page
+    user_id, cursor, limit = thread_listing.listing_params()
+    body, status = user_threads(user_id, None, {"cursor": cursor, "limit": limit})
+    if status != 200:
+        return jsonify(body), status
+    return thread_listing.conditional_json(body)
+
+@bp.route('/cleanup_empty_threads', methods=['POST'])
 def cleanup_empty_threads():
     user_id = request.json.get('user_id')
 
     # Find and delete threads where the title is None (null)
-    UserThreads.query.filter_by(user_id=user_id, title=None).delete()
+    empty_threads = UserThreads.query.filter_by(user_id=user_id, title=None)
+    message_store.delete_messages([thread.thread_id for thread in empty_threads])
+    empty_threads.delete()
     
     db.session.commit()
     return jsonify({"message": "Empty threads cleaned up"}), 200
 
-@app.route('/update_thread_title', methods=['POST'])
+@bp.route('/update_thread_title', methods=['POST'])
 def update_thread_title():
     data = request.json
     thread_id = data['thread_id']
     new_title = data['title']
-    thread = UserThreads.query.filter_by(thread_id=thread_id).first()
+    thread = auth.owned_thread(thread_id, primary=True)
     if thread:
         thread.title = new_title
         db.session.commit()
         return jsonify({"message": "Thread title updated successfully"}), 200
     return jsonify({"error": "Thread not found"}), 404
 
-@app.route('/delete_thread', methods=['POST'])
+@bp.route('/delete_thread', methods=['POST'])
 def delete_thread():
     thread_id = request.json['thread_id']
-    thread = UserThreads.query.filter_by(thread_id=thread_id).first()
+    thread = auth.owned_thread(thread_id, primary=True)
     if thread:
+        message_store.delete_messages([thread_id])
         db.session.delete(thread)
         db.session.commit()
         return jsonify({"message": "Thread deleted successfully"}), 200
@@ -281,45 +398,35 @@ def delete_thread():
 ### BotScreen.js ###
 
 # Route for creating a new thread #
-@app.route('/create_new_thread', methods=['POST'])
-def create_new_thread():
+@bp.route('/create_new_thread', methods=['POST'])
+async def create_new_thread():
     user_id = request.json['user_id']
-    new_thread = client.beta.threads.create()  # Assuming this creates a new thread in OpenAI
+    new_thread = await openai_service.create_thread()
     new_session = UserThreads(user_id=user_id, thread_id=new_thread.id)
     db.session.add(new_session)
     db.session.commit()
+    message_store.start_thread(new_thread.id)
     return jsonify({"thread_id": new_thread.id}), 201
 
 # Route for generating a thread title #
-@app.route('/generate_thread_title', methods=['POST'])
-def generate_thread_title():
+@bp.route('/generate_thread_title', methods=['POST'])
+async def generate_thread_title():
     data = request.json
     thread_id = data['thread_id']
     user_input = data['user_input']
+    if not auth.owned_thread(thread_id, primary=True):
+        return jsonify({"error": "Thread not found"}), 404
 
-    prompt = f"Generate a very short/concise thread title (for out Health AI chatbot app) based on the following user input: {user_input}"
+    # Optionally generate the title off the request path; poll /job_status for the result
+    if data.get('background'):
+        job_id = jobs.enqueue('generate_thread_title', {"thread_id": thread_id, "user_input": user_input}, user_id=g.user_id)
+        return jsonify({"job_id": job_id}), 202
 
-    # Call OpenAI API to generate a title based on user input
     try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=150,
-            temperature=0.7
-        )
-        title = response.choices[0].message.content.strip()
-        title = title.strip('"')
-
-        # Truncate the title if it exceeds 255 characters
-        truncated_title = title[:255]
-
-        print("Generated Title:", truncated_title)
+        title = await generate_title(user_input, thread_language(thread_id))
 
         # Save the title to the UserThreads table
-        user_thread = UserThreads.query.filter_by(thread_id=thread_id).first()
-        if user_thread:
-            user_thread.title = title
-            db.session.commit()
+        if save_thread_title(thread_id, title):
             return jsonify({"message": "Thread title updated successfully", "title": title}), 200
         else:
             return jsonify({"error": "Thread not found"}), 404
@@ -327,103 +434,162 @@ def generate_thread_title():
         return jsonify({"error": str(e)}), 500
 
 # Route for getting the messages of a thread #
-@app.route('/get_thread_messages', methods=['POST'])
-def handle_get_thread_messages():
+@bp.route('/get_thread_messages', methods=['POST'])
+async def handle_get_thread_messages():
     data = request.json
     thread_id = data['thread_id']
-    messages_list = get_thread_messages(thread_id)
-    return jsonify({"messages": messages_list})
+    if not auth.owned_thread(thread_id):
+        return jsonify({"error": "Thread not found"}), 404
+    messages_list = await get_thread_messages(thread_id)
+    return responses.json_list_response("messages", messages_list)
 
 # Route for starting a thread #
-@app.route('/thread_initial', methods=['GET'])
-def handle_initial():
+@bp.route('/thread_initial', methods=['GET'])
+async def handle_initial():
     thread_id = request.args.get('thread_id')
     user_id = request.args.get('user_id')
-    print(f"User ID received in handle_initial: {user_id}, Thread ID: {thread_id}")
-    return get_initial_message(thread_id, user_id)
+    if not auth.owned_thread(thread_id, primary=True):
+        return jsonify({"error": "Thread not found"}), 404
+    return await get_initial_message(thread_id, user_id)
 
 # Route for continuing a thread #
-@app.route('/thread_continue', methods=['POST'])
-def handle_continue():
+@bp.route('/thread_continue', methods=['POST'])
+async def handle_continue():
     data = request.json
     thread_id = data.get('thread_id')
     user_input = data.get('user_input')
-    response = continue_thread(thread_id, user_input)
-    return response
+    if not auth.owned_thread(thread_id, primary=True):
+        return jsonify({"error": "Thread not found"}), 404
+    # One message per thread at a time; a retried message (same Idempotency-Key) gets the first reply
+    return await submissions.run_once(thread_id, submissions.request_key(), lambda: continue_thread(thread_id, user_input))
+
+# Route for continuing a thread with the reply streamed as Server-Sent Events #
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@bp.route('/thread_continue_stream', methods=['POST'])
+def handle_continue_stream():
+    data = request.json
+    thread_id = data.get('thread_id')
+    user_input = data.get('user_input')
+    key = submissions.request_key()
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if not auth.owned_thread(thread_id, primary=True):
+        return jsonify({"error": "Thread not found"}), 404
+
+    if key and not submissions.claim(thread_id, key):
+        # Retried message: replay the reply of the first attempt instead of starting another run
+        entry = openai_service.run_sync(submissions.wait_for(thread_id, key))
+        if entry is not None:
+            admission.refund()
+            reply = json.loads(entry.response_body)
+            replay = format_sse("delta", {"text": reply["message"]}) + format_sse("done", reply)
+            return Response(replay, mimetype='text/event-stream', headers=headers)
+        if not submissions.claim(thread_id, key):  # Abandoned or stale entries can be claimed again
+            admission.refund()
+            return jsonify({"error": "A request with this idempotency key is still in progress"}), 409
+
+    # One message per thread at a time; the lock is held until the run stream ends
+    lock = submissions.ThreadLock(thread_id)
+    if not openai_service.run_sync(lock.acquire()):
+        admission.refund()
+        if key:
+            submissions.abandon(thread_id, key)
+        return jsonify({"error": "Another message is still being processed for this thread"}), 409
+    try:
+        events, error = openai_service.run_sync(open_run_stream(thread_id, user_input))
+    except Exception:
+        lock.release()
+        if key:
+            submissions.abandon(thread_id, key)
+        raise
+    if error:
+        lock.release()
+        if key:
+            submissions.abandon(thread_id, key)
+        return jsonify({"error": error[0]}), error[1]
+
+    def generate():
+        reply = None
+        try:
+            for event, payload in openai_service.iterate(events):
+                if event == "delta":
+                    yield format_sse("delta", {"text": payload})
+                elif event == "done":
+                    reply = {"message": payload, "thread_id": thread_id}
+                    yield format_sse("done", reply)
+                else:
+                    yield format_sse("error", {"error": "Run did not complete. Please try again later.", "thread_id": thread_id})
+        except admission.Overloaded:
+            # The run start was shed after the response had begun; report it as a stream error
+            yield format_sse("error", {"error": "The service is busy, please try again shortly", "thread_id": thread_id})
+        finally:
+            lock.release()
+            if key:
+                # Stored in the /thread_continue format, so a retry can go to either route
+                if reply is not None:
+                    submissions.complete(thread_id, key, json.dumps(reply), 200)
+                else:
+                    submissions.abandon(thread_id, key)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
 
 # Route for continuing a thread with image attachment #
-# Helper function to encode image to base64
-def encode_image_to_base64(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-    
-@app.route('/thread_continue_with_image', methods=['POST'])
-def handle_continue_with_image():
+@bp.route('/thread_continue_with_image', methods=['POST'])
+async def handle_continue_with_image():
     thread_id = request.form.get('thread_id')
     user_input = request.form.get('user_input')
     image = request.files.get('image')
+    if not auth.owned_thread(thread_id, primary=True):
+        return jsonify({"error": "Thread not found"}), 404
+    # Image processing is inside the thread lock too, so a retry also skips the vision call
+    return await submissions.run_once(thread_id, submissions.request_key(), lambda: _continue_with_image(thread_id, user_input, image))
 
+async def _continue_with_image(thread_id, user_input, image):
     image_description = ""
     if image:
-        # Save the image temporarily
-        image_path = os.path.join('uploads', secure_filename(image.filename))
-        image.save(image_path)
-
-        # Encode the image to base64
-        base64_image = encode_image_to_base64(image_path)
-
-        # Send request to OpenAI API for image analysis
-        payload = {
-            "model": "gpt-4-vision-preview",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Describe this image very briefly."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 300
-        }
+        # Decode, downscale and re-encode the image in memory
+        try:
+            prepared = prepare_image(image.read())
+        except Exception as e:
+            metrics.log_event("image_invalid", thread_id=thread_id, error=type(e).__name__)
+            return jsonify({"error": "Invalid image"}), 400
 
+        # Reuse the description of an identical or near-identical image, otherwise ask the vision model
         try:
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY_HEALTHAPP')}"
-            }
-            response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-            if response.status_code == 200:
-                image_description = response.json().get('choices')[0].get('message').get('content')
-            else:
-                print("Failed to analyze image:", response.text)
+            image_description = image_cache.lookup(prepared, g.user_id)
+            prepared.report["cache_hit"] = image_description is not None
+            if image_description is None:
+                started = time.perf_counter()
+                image_description = await openai_service.describe_image(prepared.base64_data, mime_type=prepared.mime_type)
+                prepared.report["vision_ms"] = round((time.perf_counter() - started) * 1000, 2)
+                if image_description:
+                    image_cache.store(prepared, image_description, g.user_id)
+        except openai.APIStatusError as e:
+            metrics.log_event("image_description_failed", thread_id=thread_id, status=e.status_code)
+        except admission.Overloaded:
+            raise
         except Exception as e:
-            print("Error in analyzing image:", e)
+            metrics.log_event("image_description_failed", thread_id=thread_id, error=type(e).__name__)
             return jsonify({"error": str(e)}), 500
-        finally:
-            # Remove temporary image file
-            os.remove(image_path)
+        metrics.log_event("image_pipeline", thread_id=thread_id, **prepared.report)
 
-    response = continue_thread(thread_id, user_input, image_description)
+    response = await continue_thread(thread_id, user_input, image_description)
     return response
 
 
 
 # Route for getting the user's thread sessions #
-@app.route('/get_user_thead_sessions', methods=['POST'])
+@bp.route('/get_user_thead_sessions', methods=['GET', 'POST'])
 def get_user_thread_sessions():
-    user_id = request.json.get('user_id')
-    sessions = UserThreads.query.filter_by(user_id=user_id).all()
+    # Same paging as /get_user_threads; the body stays a plain list, the next cursor is in a header
+    user_id, cursor, limit = thread_listing.listing_params()
+    try:
+        sessions, next_cursor = thread_listing.page_user_threads(user_id, cursor, limit)
+    except thread_listing.InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
     sessions_data = [{'thread_id': session.thread_id} for session in sessions]
-    return jsonify(sessions_data)
+    return thread_listing.conditional_json(sessions_data, headers={'X-Next-Cursor': next_cursor})
 
 # Route for converting text to speech #
 VOICE_SETTING_MAP = {
@@ -434,39 +600,98 @@ VOICE_SETTING_MAP = {
     5: 'nova',
     6: 'shimmer',
 }
-@app.route('/text_to_speech', methods=['POST'])
-def text_to_speech():
+@bp.route('/text_to_speech', methods=['POST'])
+async def text_to_speech():
     data = request.json
     text = data.get('text')
     user_id = data.get('user_id')
 
     # Fetch user's voice_speed_setting
-    user = User.query.get(user_id)
+    user = get_cached_user(user_id)
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    voice_speed = user.voice_speed_setting  # Fetch voice speed setting
-    voice_setting = VOICE_SETTING_MAP.get(user.voice_setting, 'Echo')  # Default to 'Echo' if not found
-    
-    try:
-        response = client.audio.speech.create(
-            model="tts-1",
-            voice=voice_setting,
-            input=text,
-            speed=voice_speed
+    voice_speed = user["voice_speed_setting"]  # Fetch voice speed setting
+    voice_setting = VOICE_SETTING_MAP.get(user["voice_setting"], 'Echo')  # Default to 'Echo' if not found
+
+    # Optionally pre-render in the background; poll /job_status for the audio_url
+    if data.get('background'):
+        job_id = jobs.enqueue(
+            'tts_prerender',
+            {"text": text, "voice": voice_setting, "speed": voice_speed, "audio_base_url": audio_storage.base_url()},
+            user_id=g.user_id,
+            priority=jobs.PRIORITY_LOW
         )
-        speech_file_path = Path('audio') / f"speech_{uuid.uuid4()}.mp3"
-        response.stream_to_file(str(speech_file_path))
-        audio_url = f"http://enormous-mallard-noted.ngrok-free.app/audio/{speech_file_path.name}"
-        return jsonify({"audio_url": audio_url}), 200
+        return jsonify({"job_id": job_id}), 202
+
+    try:
+        # Same text, voice, speed and model always produce the same audio, so serve it from the cache if we have it
+        filename = await tts_cache.get_or_synthesize(text, voice_setting, voice_speed)
+        return jsonify({"audio_url": tts_cache.audio_url(filename)}), 200
+    except admission.Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Route for streaming text to speech sentence by sentence (playback starts after the first sentence) #
+@bp.route('/text_to_speech_stream', methods=['POST'])
+def text_to_speech_stream():
+    data = request.json
+    text = data.get('text')
+    user_id = data.get('user_id')
+    if not text:
+        return jsonify({"error": "Text is required"}), 400
+
+    user = get_cached_user(user_id)
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+
+    voice_speed = user["voice_speed_setting"]
+    voice_setting = VOICE_SETTING_MAP.get(user["voice_setting"], 'Echo')
+
+    # Synthesize the first sentence before answering, so a shed or failed call is still a 503 or an
+    # error JSON instead of a cut-off 200 audio stream
+    chunks = openai_service.iterate(stream_speech(text, voice_setting, voice_speed))
+    try:
+        first = next(chunks, b"")
+    except admission.Overloaded:
+        raise
     except Exception as e:
+        metrics.log_event("tts_stream_failed", stage="first_sentence", error=type(e).__name__)
         return jsonify({"error": str(e)}), 500
 
-@app.route('/audio/<filename>')
+    def generate():
+        yield first
+        try:
+            yield from chunks
+        except Exception as e:
+            # The audio so far has been sent; the client gets a shorter stream
+            metrics.log_event("tts_stream_failed", stage="stream", error=type(e).__name__)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='audio/mpeg',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Generated speech: ETag, Range and long-lived caching, or handed to the proxy (see modules/audio_storage.py)
+@bp.route('/audio/<filename>')
 def uploaded_file(filename):
-    return send_from_directory('audio', filename)
+    return audio_storage.serve(filename)
+
+UPLOAD_DIR = os.path.realpath('uploads')  # Voice memos of the two-step upload/transcribe flow
 
-@app.route('/upload_voice_memo', methods=['POST'])
+def upload_path(file_url):
+    # The resolved path of a file in UPLOAD_DIR, or None for anything outside it (../, absolute
+    # paths, symlinks out of the directory)
+    if not isinstance(file_url, str) or not file_url:
+        return None
+    path = os.path.realpath(file_url)
+    if os.path.dirname(path) != UPLOAD_DIR:
+        return None
+    return path
+
+@bp.route('/upload_voice_memo', methods=['POST'])
 def upload_voice_memo():
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
@@ -479,24 +704,100 @@ def upload_voice_memo():
         file.save(file_path)
         return jsonify({"file_url": file_path}), 200
 
-@app.route('/transcribe_voice_memo', methods=['POST'])
-def transcribe_voice_memo():
-    file_url = request.json.get('file_url')
+@bp.route('/transcribe_voice_memo', methods=['POST'])
+async def transcribe_voice_memo():
+    data = request.get_json(silent=True)
+    # Only files saved by /upload_voice_memo may be read (and deleted)
+    path = upload_path(data.get('file_url') if isinstance(data, dict) else None)
+    if path is None:
+        return jsonify({"error": "Invalid file_url"}), 400
     try:
-        with open(file_url, 'rb') as audio_file:
-            transcript = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file
-            )
-            text = transcript.text  # Directly access the text attribute
-            return jsonify({"transcript": text}), 200
+        with open(path, 'rb') as audio_file:
+            text = await openai_service.transcribe(audio_file)
+        os.remove(path)
+        return jsonify({"transcript": text}), 200
+    except FileNotFoundError:
+        return jsonify({"error": "File not found"}), 404
     except openai.BadRequestError as e:
-        print("Error transcribing audio:", e)
+        metrics.log_event("transcription_failed", status=e.status_code)
         return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print("An error occurred:", e)
+        metrics.log_event("transcription_failed", error=type(e).__name__)
         return jsonify({"error": "Failed to transcribe audio"}), 500
 
 
+# Route for uploading and transcribing a voice memo in one request, without touching disk #
+@bp.route('/voice_memo', methods=['POST'])
+async def voice_memo():
+    if 'file' in request.files:
+        file = request.files['file']
+        data = file.read()
+        filename = secure_filename(file.filename) or 'voice-memo.mp3'
+    elif request.mimetype.startswith('audio/'):
+        # Raw audio body
+        data = request.get_data()
+        filename = f"voice-memo.{request.mimetype.split('/')[1]}"
+    else:
+        return jsonify({"error": "No file part"}), 400
+    if not data:
+        return jsonify({"error": "Empty voice memo"}), 400
+
+    compact = request.args.get('compact', '1' if COMPACT_BY_DEFAULT else '0') == '1'
+    report = {"bytes_in": len(data), "compacted": False}
+    if compact:
+        data, filename, report = await asyncio.to_thread(compact_audio, data, filename)
+
+    # Optionally transcribe in the background; poll /job_status for the transcript
+    if request.args.get('background') == '1':
+        job_id = jobs.enqueue(
+            'transcribe',
+            {"filename": filename, "audio": base64.b64encode(data).decode('utf-8')},
+            user_id=g.user_id,
+            priority=jobs.PRIORITY_HIGH
+        )
+        return jsonify({"job_id": job_id}), 202
+
+    try:
+        started = time.perf_counter()
+        text = await openai_service.transcribe((filename, data))
+        report["transcribe_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        metrics.log_event("voice_memo", **report)
+        return jsonify({"transcript": text}), 200
+    except openai.BadRequestError as e:
+        metrics.log_event("transcription_failed", status=e.status_code)
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        metrics.log_event("transcription_failed", error=type(e).__name__)
+        return jsonify({"error": "Failed to transcribe audio"}), 500
+
+
+# Route for polling a background job #
+@bp.route('/job_status', methods=['POST'])
+def job_status():
+    job_id = request.json.get('job_id')
+    status = jobs.get_status(job_id, g.user_id)
+    if not status:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(status), 200
+
+# Route for fetching several resources in one round trip (see modules/batch.py) #
+@bp.route('/batch', methods=['POST'])
+def run_batch():
+    # {"user_id": 1, "operations": ["verify_token", "get_user_settings", {"op": "get_user_threads", "args": {"limit": 20}}]}
+    data = request.get_json(silent=True)
+    try:
+        operations = batch.parse(data.get('operations') if isinstance(data, dict) else None)
+    except batch.BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    user_id = g.user_id  # From the verified token; auth has checked any user_id in the body against it
+    results = batch.run(user_id, get_cached_user(user_id), operations)
+    return jsonify({"results": results}), 200
+
+@bp.route('/db_pool_stats', methods=['GET'])
+def db_pool_stats():
+    # Connection pool usage per engine (primary and replicas) and how reads were routed
+    return jsonify({"pools": database.pool_stats(db.engines), "routing": database.routing_stats()}), 200
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
@@ -0,0 +1,164 @@
+# bench_async_concurrency.py:
+# Compares how many OpenAI calls one process can keep in flight with the old blocking client
+# (one worker thread per call) versus the async service layer (one event loop, pooled transport).
+# Upstream latency is simulated with an in-process mock transport, so no API credit is used.
+# The adaptive limiter (modules/admission.py) is opened up to --calls, so the benchmark measures the
+# transport rather than the limiter's queue; --with-limiter keeps the app's limiter settings.
+#
+# The service-layer figures are the ceiling for one process, not what the routes reach: Flask runs
+# an async view inside the WSGI request thread, so every open request still holds a server thread
+# and the route-level concurrency is the server's thread count. flask run --with-threads starts a
+# thread per connection; gunicorn -k gthread allows workers x --threads; the sync worker allows one
+# request per worker. What the async layer saves is the extra thread per OpenAI call, concurrent
+# calls within one request, and a shared connection pool. --http measures the routes: it runs
+# /text_to_speech (through benchmarks/load_test.py and its fake OpenAI API) with --concurrency
+# virtual users and reports the requests in flight on average (throughput x mean latency). --target
+# points it at an already running server, e.g. gunicorn -k gthread --threads 8 'app:create_app()'.
+# An open request also keeps its database connection while it awaits OpenAI, so the started app
+# gets a connection pool of --concurrency as well (DB_POOL_SIZE_HEALTHAPP).
+#
+# Usage (from backend/): python -m benchmarks.bench_async_concurrency --calls 500 --latency 0.5 --workers 8
+#   python -m benchmarks.bench_async_concurrency --http --calls 500 --concurrency 200 [--target URL]
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import openai
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules import openai_service, admission
+
+COMPLETION = {
+    "id": "chatcmpl-bench",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-4",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+}
+
+class InFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+
+    def enter(self):
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def exit(self):
+        with self.lock:
+            self.current -= 1
+
+def bench_sync(calls, latency, workers):
+    in_flight = InFlight()
+
+    def handler(request):
+        in_flight.enter()
+        time.sleep(latency)
+        in_flight.exit()
+        return httpx.Response(200, content=json.dumps(COMPLETION), headers={"content-type": "application/json"})
+
+    client = openai.OpenAI(api_key="bench", http_client=httpx.Client(transport=httpx.MockTransport(handler)))
+
+    def one_call(_):
+        client.chat.completions.create(model="gpt-4", messages=[{"role": "user", "content": "hi"}])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(one_call, range(calls)))
+    return time.perf_counter() - start, in_flight.peak, 0
+
+def bench_async(calls, latency, with_limiter=False):
+    in_flight = InFlight()
+
+    async def handler(request):
+        in_flight.enter()
+        await asyncio.sleep(latency)
+        in_flight.exit()
+        return httpx.Response(200, content=json.dumps(COMPLETION), headers={"content-type": "application/json"})
+
+    openai_service._client = openai.AsyncOpenAI(
+        api_key="bench",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    if not with_limiter:
+        admission._limiters["chat.completions"] = admission.AdaptiveLimiter(
+            "chat.completions", initial=calls, maximum=calls, max_queue=calls)
+
+    async def all_calls():
+        return await asyncio.gather(*[
+            openai_service.complete_chat(messages=[{"role": "user", "content": "hi"}])
+            for _ in range(calls)
+        ], return_exceptions=True)
+
+    start = time.perf_counter()
+    results = openai_service.run_sync(all_calls())
+    elapsed = time.perf_counter() - start
+    for result in results:
+        if isinstance(result, Exception) and not isinstance(result, admission.Overloaded):
+            raise result
+    return elapsed, in_flight.peak, sum(isinstance(result, admission.Overloaded) for result in results)
+
+def bench_http(args):
+    from benchmarks import load_test
+    settings = argparse.Namespace(
+        upstream_latency=args.latency, first_token=0.5, run_duration=2.0, run_fail_rate=0.0,
+        database_url=None, scenarios=["tts"], requests=args.calls, concurrency=args.concurrency, timeout=120,
+    )
+    # Inherited by the started app
+    os.environ.setdefault("DB_POOL_SIZE_HEALTHAPP", str(args.concurrency))
+    if not args.with_limiter:
+        os.environ.update(OPENAI_INITIAL_CONCURRENCY_HEALTHAPP=str(args.concurrency),
+                          OPENAI_MAX_CONCURRENCY_HEALTHAPP=str(args.concurrency),
+                          OPENAI_MAX_QUEUE_HEALTHAPP=str(args.concurrency))
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="healthapp-concurrency-")
+    try:
+        base_url = args.target
+        if not base_url:
+            fake, openai_base_url = load_test.start_fake_openai(settings, workdir)
+            processes.append(fake)
+            app, base_url = load_test.start_app(settings, workdir, openai_base_url)
+            processes.append(app)
+        result = asyncio.run(load_test.run(settings, base_url))["tts"]
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+    in_flight = result["throughput"] * result["mean_ms"] / 1000  # Little's law
+    print(f"\n{'HTTP /text_to_speech':<28} {args.calls} requests at concurrency {args.concurrency}: "
+          f"{result['throughput']:.1f} req/s, mean {result['mean_ms']:.0f}ms, {in_flight:.1f} in flight on average, "
+          f"errors {result['error_rate']:.1%}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Blocking vs async OpenAI client concurrency")
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.5, help="Simulated upstream latency in seconds")
+    parser.add_argument("--workers", type=int, default=8, help="Worker threads for the blocking client")
+    parser.add_argument("--with-limiter", action="store_true", help="Keep the app's adaptive limiter settings")
+    parser.add_argument("--http", action="store_true", help="Measure the HTTP routes instead of the service layer")
+    parser.add_argument("--concurrency", type=int, default=200, help="Virtual users for --http")
+    parser.add_argument("--target", help="Base URL of a running app for --http (default: start flask run)")
+    args = parser.parse_args()
+
+    if args.http:
+        bench_http(args)
+        return
+
+    for name, (elapsed, peak, shed) in (
+        (f"blocking ({args.workers} workers)", bench_sync(args.calls, args.latency, args.workers)),
+        ("async service (1 loop)", bench_async(args.calls, args.latency, args.with_limiter)),
+    ):
+        print(f"{name:<28} {args.calls} calls in {elapsed:7.2f}s  "
+              f"{args.calls / elapsed:8.1f} calls/s  peak in-flight {peak}  shed {shed}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# bench_db_pool.py:
+# Mixed read/write load against a primary and optional replicas through the app's pool and
+# routing session, for checking pool sizing and replica routing against local Postgres instances
+# (e.g. a primary on :5432 and a streaming replica on :5433). Reports throughput, how reads were
+# routed, and pool checkouts and wait times.
+#
+# Usage (from backend/): python -m benchmarks.bench_db_pool --primary URL [--replica URL ...]
+#   [--threads N] [--requests N] [--write-ratio F] [--pool-size N] [--max-overflow N] [--pgbouncer]
+# --seed-replicas migrates and seeds each replica too (for standalone instances, not real replicas).
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+USERS = 200
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Connection pool and read-replica routing under load")
+    parser.add_argument("--primary", default="sqlite:////tmp/bench_db_primary.db")
+    parser.add_argument("--replica", action="append", default=[], help="Replica URL (repeatable)")
+    parser.add_argument("--seed-replicas", action="store_true")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    parser.add_argument("--pool-size", type=int, default=5)
+    parser.add_argument("--max-overflow", type=int, default=10)
+    parser.add_argument("--pgbouncer", action="store_true")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    # The pool settings are read when the modules are imported
+    os.environ["DB_POOL_SIZE_HEALTHAPP"] = str(args.pool_size)
+    os.environ["DB_MAX_OVERFLOW_HEALTHAPP"] = str(args.max_overflow)
+    os.environ["DB_PGBOUNCER_HEALTHAPP"] = "1" if args.pgbouncer else "0"
+    os.environ["DB_REPLICA_URLS_HEALTHAPP"] = ",".join(args.replica)
+
+    from flask import Flask, g
+    from modules import database, migrations
+    from modules.models import db, User, UserThreads
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.primary
+    app.config['SQLALCHEMY_BINDS'] = database.replica_binds()
+    db.init_app(app)
+
+    with app.app_context():
+        targets = [None] + (list(database.replica_binds()) if args.seed_replicas else [])
+        for key in targets:
+            engine = db.engines[key]
+            migrations.downgrade(engine, 0)
+            migrations.upgrade(engine)
+            with engine.begin() as conn:
+                conn.execute(User.__table__.insert(), [
+                    {"id": n, "name": "Bench", "surname": "User", "email": f"bench{n}@example.com",
+                     "password": "x", "voice_setting": 1} for n in range(1, USERS + 1)
+                ])
+
+    counter = iter(range(args.requests))
+    counter_lock = threading.Lock()
+    errors = []
+
+    def worker():
+        while True:
+            with counter_lock:
+                if next(counter, None) is None:
+                    return
+            user_id = random.randint(1, USERS)
+            try:
+                with app.test_request_context():
+                    g.user_id = user_id
+                    if random.random() < args.write_ratio:
+                        user = db.session.get(User, user_id)
+                        user.voice_setting = random.randint(1, 6)
+                        db.session.commit()
+                    else:
+                        db.session.get(User, user_id)
+                        UserThreads.query.filter_by(user_id=user_id).order_by(UserThreads.date_created.desc()).limit(50).all()
+            except Exception as e:
+                errors.append(e)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(f"{args.requests} requests on {args.threads} threads in {elapsed:.2f}s "
+          f"({args.requests / elapsed:.0f} req/s), {len(errors)} errors")
+    if errors:
+        print(f"  first error: {errors[0]!r}")
+    print(f"routing: {database.routing_stats()}")
+    with app.app_context():
+        for name, stats in database.pool_stats(db.engines).items():
+            mean_wait = stats["wait_seconds_total"] / stats["checkouts"] * 1000 if stats["checkouts"] else 0.0
+            print(f"pool {name}: checkouts {stats['checkouts']}  mean wait {mean_wait:.3f}ms  "
+                  f"max wait {stats['wait_seconds_max'] * 1000:.3f}ms  size {stats.get('size')}")
+
+if __name__ == '__main__':
+    main()
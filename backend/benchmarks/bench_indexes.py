@@ -0,0 +1,121 @@
+# bench_indexes.py:
+# Query plans and latencies of the hot lookups before and after migration 0002. The database is
+# migrated to the baseline schema, seeded with synthetic users, threads and profiles, measured,
+# then migrated to 0002, analyzed and measured again.
+#
+# Usage (from backend/): python -m benchmarks.bench_indexes [--url URL] [--users N] [--threads-per-user N]
+# Defaults to a throwaway SQLite file; pass a Postgres URL for numbers that match production.
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules import migrations
+
+QUERIES = {
+    "thread by thread_id": (
+        "SELECT id, title FROM user_threads WHERE thread_id = :thread_id",
+        lambda args: {"thread_id": f"thread_{random.randrange(args.users * args.threads_per_user)}"},
+    ),
+    "user threads newest first": (
+        "SELECT thread_id, title, date_created FROM user_threads WHERE user_id = :user_id ORDER BY date_created DESC",
+        lambda args: {"user_id": random.randrange(1, args.users + 1)},
+    ),
+    "profile by user_id": (
+        "SELECT * FROM user_profile WHERE user_id = :user_id",
+        lambda args: {"user_id": random.randrange(1, args.users + 1)},
+    ),
+}
+
+def seed(engine, args):
+    with engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text(
+                "INSERT INTO \"user\" (id, name, surname, email, password) "
+                "SELECT n, 'Bench', 'User', 'bench' || n || '@example.com', 'x' FROM generate_series(1, :users) n"
+            ), {"users": args.users})
+            conn.execute(text(
+                "INSERT INTO user_threads (user_id, thread_id, title, date_created) "
+                "SELECT 1 + n % :users, 'thread_' || n, 'Title', now() - (n || ' seconds')::interval "
+                "FROM generate_series(0, :threads - 1) n"
+            ), {"users": args.users, "threads": args.users * args.threads_per_user})
+            conn.execute(text(
+                "INSERT INTO user_profile (user_id, age) SELECT n, 30 FROM generate_series(1, :users) n"
+            ), {"users": args.users})
+            return
+        conn.execute(
+            text("INSERT INTO user (id, name, surname, email, password) VALUES (:id, 'Bench', 'User', :email, 'x')"),
+            [{"id": n, "email": f"bench{n}@example.com"} for n in range(1, args.users + 1)]
+        )
+        threads = args.users * args.threads_per_user
+        for start in range(0, threads, 50000):
+            conn.execute(
+                text("INSERT INTO user_threads (user_id, thread_id, title, date_created) "
+                     "VALUES (:user_id, :thread_id, 'Title', datetime('now', :age))"),
+                [{"user_id": 1 + n % args.users, "thread_id": f"thread_{n}", "age": f"-{n} seconds"}
+                 for n in range(start, min(start + 50000, threads))]
+            )
+        conn.execute(
+            text("INSERT INTO user_profile (user_id, age) VALUES (:user_id, 30)"),
+            [{"user_id": n} for n in range(1, args.users + 1)]
+        )
+
+def explain(conn, sql, params):
+    if conn.dialect.name == 'postgresql':
+        rows = conn.execute(text(f"EXPLAIN {sql}"), params)
+        return [row[0] for row in rows]
+    rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params)
+    return [row[-1] for row in rows]
+
+def measure(engine, args, label):
+    print(f"\n== {label}")
+    with engine.connect() as conn:
+        for name, (sql, make_params) in QUERIES.items():
+            for line in explain(conn, sql, make_params(args)):
+                print(f"  plan [{name}]: {line}")
+            latencies = []
+            for _ in range(args.repeats):
+                params = make_params(args)
+                started = time.perf_counter()
+                conn.execute(text(sql), params).fetchall()
+                latencies.append((time.perf_counter() - started) * 1000)
+            latencies.sort()
+            print(f"  {name:<28} median {statistics.median(latencies):8.3f}ms  "
+                  f"p99 {latencies[int(0.99 * (len(latencies) - 1))]:8.3f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot lookup latency before and after the index migration")
+    parser.add_argument("--url", default="sqlite:////tmp/bench_indexes.db", help="Database URL (the tables are dropped)")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--threads-per-user", type=int, default=25)
+    parser.add_argument("--repeats", type=int, default=200, help="Timed executions per query")
+    args = parser.parse_args()
+
+    if args.url.startswith("sqlite:///") and os.path.exists(args.url[len("sqlite:///"):]):
+        os.remove(args.url[len("sqlite:///"):])
+    engine = create_engine(args.url)
+    migrations.downgrade(engine, 0)
+    migrations.upgrade(engine, 1)
+
+    started = time.perf_counter()
+    seed(engine, args)
+    print(f"Seeded {args.users} users and {args.users * args.threads_per_user} threads "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+    measure(engine, args, "baseline (0001)")
+
+    started = time.perf_counter()
+    migrations.upgrade(engine, 2)
+    print(f"\nMigration 0002 took {time.perf_counter() - started:.1f}s")
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+    measure(engine, args, "indexed (0002)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# bench_responses.py:
+# Bytes on the wire and time per response for representative payloads, with Flask's default JSON
+# encoding and no compression (before) versus the response layer in modules/responses.py (after).
+#
+# Usage (from backend/): python -m benchmarks.bench_responses [--repeats N]
+# orjson and brotli are used when installed; without them the "after" numbers show the stdlib
+# encoder and gzip only.
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from datetime import datetime, timedelta
+from flask import Flask, jsonify
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules import responses
+from modules.assistant_config import assistant_configs
+
+SENTENCE = ("Aim for seven to nine hours of sleep, keep a consistent bedtime, and avoid caffeine in the "
+            "eight hours before bed. A short walk after dinner also helps blood sugar. ")
+
+def thread_messages(count):
+    return [{
+        "role": "assistant" if i % 2 else "user",
+        "content": SENTENCE * (3 if i % 2 else 1),
+        "message_id": f"msg_{i:024d}",
+        "created_at": 1700000000 + i,
+    } for i in range(count)]
+
+def threads_page(count):
+    start = datetime(2024, 1, 1)
+    return {"threads": [{
+        "thread_id": f"thread_{i:024d}",
+        "date": (start + timedelta(days=i)).strftime("%Y-%m-%d"),
+        "title": "Sleep quality after night shifts",
+    } for i in range(count)], "next_cursor": "WyIyMDI0LTAxLTAzVDAwOjAwOjAwIiw1XQ"}
+
+PAYLOADS = {
+    "get_thread_messages (50)": lambda: ("messages", thread_messages(50)),
+    "get_thread_messages (1000)": lambda: ("messages", thread_messages(1000)),
+    "get_user_threads (page of 50)": lambda: (None, threads_page(50)),
+    "assistant_configs": lambda: (None, {str(k): v for k, v in assistant_configs.items()}),
+    "get_user_settings": lambda: (None, {"language": "en", "display_setting": "dark", "voice_setting": 1,
+                                         "voice_speed_setting": 1.0, "autoplaybackaudio_setting": False}),
+}
+
+def make_app(layer):
+    app = Flask(__name__)
+    if layer:
+        responses.init_app(app)
+    for i, (name, build) in enumerate(PAYLOADS.items()):
+        key, payload = build()
+
+        def view(key=key, payload=payload):
+            if layer and key:
+                return responses.json_list_response(key, payload)
+            return jsonify({key: payload} if key else payload)
+        app.add_url_rule(f"/payload/{i}", f"payload_{i}", view)
+    return app
+
+def measure(app, index, accept_encoding, repeats):
+    client = app.test_client()
+    headers = {"Accept-Encoding": accept_encoding} if accept_encoding else {}
+    latencies = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        response = client.get(f"/payload/{index}", headers=headers)
+        body = response.get_data()
+        latencies.append((time.perf_counter() - started) * 1e6)
+    return len(body), response.headers.get("Content-Encoding", "identity"), statistics.median(latencies)
+
+def serialization_time(payload, dumps, repeats):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        dumps(payload)
+    return (time.perf_counter() - started) / repeats * 1e6
+
+def stdlib_dumps(payload):
+    # What Flask's default provider does for jsonify outside debug mode
+    return json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON encoding and compression before/after")
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    before, after = make_app(False), make_app(True)
+    print(f"orjson: {'yes' if responses.orjson else 'no'}  brotli: {'yes' if responses.brotli else 'no'}\n")
+    print(f"{'payload':<32} {'before':>22} {'after (gzip)':>22} {'after (br, gzip)':>22}")
+    for index, name in enumerate(PAYLOADS):
+        cells = []
+        for app, accept in ((before, "gzip, br"), (after, "gzip"), (after, "br, gzip")):
+            size, encoding, median_us = measure(app, index, accept, args.repeats)
+            cells.append(f"{size:>8}B {encoding[:4]:>4} {median_us:>6.0f}us")
+        print(f"{name:<32} " + " ".join(f"{cell:>22}" for cell in cells))
+
+    print(f"\n{'serialization only':<32} {'stdlib json':>14} {'responses':>14}")
+    for name, build in PAYLOADS.items():
+        key, payload = build()
+        payload = {key: payload} if key else payload
+        print(f"{name:<32} {serialization_time(payload, stdlib_dumps, args.repeats):>12.1f}us "
+              f"{serialization_time(payload, responses.dumps_bytes, args.repeats):>12.1f}us")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# bench_startup.py:
+# Worker startup cost: time to import app.py, to build the app with create_app(), and to serve the
+# first request (a login lookup, so the DB engine makes its first connection), each measured in a
+# fresh interpreter. The "forked" figures are what a preloading server (gunicorn --preload) pays
+# per worker: the parent imports and builds the app once, and each forked child only serves.
+# OpenAI points at a closed port, so any network call during startup would show up as an error.
+#
+# Usage (from backend/): python -m benchmarks.bench_startup [--runs N] [--database-url URL] [--importtime N]
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+PROBE = r'''
+import os, sys, json, time
+started = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+app = app_module.create_app()
+created = time.perf_counter()
+
+def first_request():
+    started = time.perf_counter()
+    response = app.test_client().post('/login', json={"email": "nobody@example.com", "password": "x"})
+    assert response.status_code == 401, response.status_code
+    return (time.perf_counter() - started) * 1000
+
+result = {
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+}
+if sys.argv[1] == "fork":
+    read_end, write_end = os.pipe()
+    forked = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        first_request()
+        os.write(write_end, json.dumps({"forked_first_request_ms": (time.perf_counter() - forked) * 1000}).encode())
+        os._exit(0)
+    os.waitpid(pid, 0)
+    result.update(json.loads(os.read(read_end, 1024)))
+else:
+    result["first_request_ms"] = first_request()
+print(json.dumps(result))
+'''
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import, app creation and first request times")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--database-url", help="Migrated database (default: scratch SQLite)")
+    parser.add_argument("--importtime", type=int, default=15, help="Show the N slowest imports (0 to skip)")
+    return parser.parse_args()
+
+def environment(database_url):
+    return {
+        **os.environ,
+        "PYTHONPATH": BACKEND_DIR,
+        "DATABASE_URL_HEALTHAPP": database_url,
+        "OPENAI_BASE_URL_HEALTHAPP": "http://127.0.0.1:9/v1",
+        "OPENAI_API_KEY_HEALTHAPP": "bench",
+        "SECRET_TOKEN_KEY_HEALTHAPP": "bench",
+        "JOB_WORKERS_HEALTHAPP": "0",
+        "SYNC_ASSISTANTS_ON_START_HEALTHAPP": "0",
+        "METRICS_LOG_REQUESTS_HEALTHAPP": "0",
+    }
+
+def probe(env, mode, workdir):
+    output = subprocess.run([sys.executable, "-c", PROBE, mode], env=env, cwd=workdir, capture_output=True, text=True, check=True)
+    # The app logs JSON events too; the probe's result is the last line
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def slowest_imports(env, workdir, count):
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], env=env, cwd=workdir,
+                            capture_output=True, text=True, check=True)
+    imports = []
+    for line in output.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            name = parts[2].rstrip()
+            depth = (len(name) - len(name.lstrip())) // 2
+            if depth <= 1:  # app itself and what it imports directly
+                imports.append((int(parts[1]) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="healthapp-startup-") as workdir:
+        database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'startup.db')}"
+        env = environment(database_url)
+        if not args.database_url:
+            subprocess.run([sys.executable, "-m", "modules.migrations", "upgrade"], env=env, cwd=workdir,
+                           capture_output=True, check=True)
+
+        results = [probe(env, "fresh", workdir) for _ in range(args.runs)]
+        if hasattr(os, "fork"):
+            results += [probe(env, "fork", workdir) for _ in range(args.runs)]
+
+        print(f"{args.runs} runs, medians:")
+        for key in ("import_ms", "create_app_ms", "first_request_ms", "forked_first_request_ms"):
+            values = [result[key] for result in results if key in result]
+            if values:
+                print(f"  {key:<26} {statistics.median(values):8.1f} ms")
+
+        if args.importtime:
+            print("\nSlowest imports (cumulative):")
+            for ms, name in slowest_imports(env, workdir, args.importtime):
+                print(f"  {ms:8.1f} ms  {name}")
+
+if __name__ == '__main__':
+    main()
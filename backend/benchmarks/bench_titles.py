@@ -0,0 +1,101 @@
+# bench_titles.py:
+# Offline comparison of the local title engine with the GPT-4 title prompt on a corpus of sample
+# first messages. Quality is measured as word-overlap F1 against a hand-written reference title,
+# plus the share of messages the local engine would hand to the LLM fallback.
+#
+# Usage (from backend/): python -m benchmarks.bench_titles [--llm]
+# --llm also times the GPT-4 titles (needs OPENAI_API_KEY_HEALTHAPP and costs API credit).
+import os
+import re
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules import titles, openai_service
+
+# (language, first message, reference title)
+CORPUS = [
+    ("en", "How can I improve my sleep quality after night shifts?", "Sleep quality after night shifts"),
+    ("en", "What should I eat before a morning workout to build muscle?", "Pre-workout meal for muscle"),
+    ("en", "Is intermittent fasting good for longevity?", "Intermittent fasting and longevity"),
+    ("en", "I have type 2 diabetes, what carbs are ok?", "Carbs with type 2 diabetes"),
+    ("en", "How much protein do I need per day if I lift weights?", "Protein needs for lifting"),
+    ("en", "My lower back hurts after deadlifts, what can I do?", "Lower back pain after deadlifts"),
+    ("en", "Can you give me a beginner running plan for a 5k?", "Beginner 5k running plan"),
+    ("en", "What are the benefits of cold showers and sauna?", "Cold showers and sauna benefits"),
+    ("en", "How do I lower my cholesterol naturally?", "Lowering cholesterol naturally"),
+    ("en", "Is creatine safe to take every day?", "Daily creatine safety"),
+    ("en", "I feel stressed all the time at work. Any tips for stress management?", "Work stress management"),
+    ("en", "Which vitamins should I take on a vegan diet?", "Vitamins on a vegan diet"),
+    ("en", "What is a good resting heart rate for my age?", "Resting heart rate by age"),
+    ("en", "How many hours of sleep does a teenager need?", "Teenager sleep needs"),
+    ("en", "Hi", "Greeting"),
+    ("en", "thanks!", "Thanks"),
+    ("dk", "Hvordan kan jeg sove bedre om natten?", "Bedre søvn om natten"),
+    ("dk", "Jeg har ondt i knæet efter løbetræning, hvad kan jeg gøre?", "Knæsmerter efter løbetræning"),
+    ("dk", "Hvor meget protein skal jeg spise for at tage på i muskelmasse?", "Protein til muskelmasse"),
+    ("dk", "Er periodisk faste sundt for kvinder?", "Periodisk faste for kvinder"),
+    ("dk", "Hvilke kosttilskud anbefaler du til ældre?", "Kosttilskud til ældre"),
+    ("dk", "Hvordan sænker jeg mit blodtryk uden medicin?", "Sænke blodtryk uden medicin"),
+    ("dk", "Kan du lave et træningsprogram til begyndere?", "Træningsprogram for begyndere"),
+    ("dk", "Hej", "Hilsen"),
+]
+
+_TOKEN = re.compile(r"[^\W_]+", re.UNICODE)
+
+def overlap_f1(title, reference):
+    got = {token.lower() for token in _TOKEN.findall(title)}
+    want = {token.lower() for token in _TOKEN.findall(reference)}
+    common = len(got & want)
+    if not common:
+        return 0.0
+    precision, recall = common / len(got), common / len(want)
+    return 2 * precision * recall / (precision + recall)
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def bench_local(repeats):
+    latencies, scores, fallbacks = [], [], 0
+    for language, message, reference in CORPUS:
+        for _ in range(repeats):
+            started = time.perf_counter()
+            title, quality = titles.local_title(message, language)
+            latencies.append((time.perf_counter() - started) * 1e6)
+        if quality < titles.MIN_QUALITY:
+            fallbacks += 1
+        else:
+            scores.append(overlap_f1(title, reference))
+        print(f"  [{language}] {message[:55]:<55} -> {title or '-':<35} q={quality:.2f}")
+    return latencies, scores, fallbacks
+
+def bench_llm():
+    latencies, scores = [], []
+    for language, message, reference in CORPUS:
+        started = time.perf_counter()
+        title = openai_service.run_sync(titles.generate_llm_title(message))
+        latencies.append((time.perf_counter() - started) * 1e6)
+        scores.append(overlap_f1(title, reference))
+    return latencies, scores
+
+def main():
+    parser = argparse.ArgumentParser(description="Local vs LLM thread title generation")
+    parser.add_argument("--repeats", type=int, default=1000, help="Timing repetitions per message for the local engine")
+    parser.add_argument("--llm", action="store_true", help="Also time GPT-4 titles (uses API credit)")
+    args = parser.parse_args()
+
+    latencies, scores, fallbacks = bench_local(args.repeats)
+    print(f"\nlocal: mean {statistics.mean(latencies):.1f}us  p99 {percentile(latencies, 0.99):.1f}us  "
+          f"F1 {statistics.mean(scores):.2f} on {len(scores)} titles  "
+          f"LLM fallback {fallbacks}/{len(CORPUS)}")
+
+    if args.llm:
+        latencies, scores = bench_llm()
+        print(f"llm:   mean {statistics.mean(latencies) / 1000:.0f}ms  p99 {percentile(latencies, 0.99) / 1000:.0f}ms  "
+              f"F1 {statistics.mean(scores):.2f} on {len(scores)} titles")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+# fake_openai.py:
+# Local stand-in for the parts of the OpenAI API the backend uses: threads, messages, runs
+# (streamed, with configurable latency, token pacing and failure rate), assistants, chat
+# completions, TTS and Whisper. State is kept in memory. Point the backend at it with
+# OPENAI_BASE_URL_HEALTHAPP=http://127.0.0.1:PORT/v1 to load-test without API credit.
+#
+# Usage (from backend/): python -m benchmarks.fake_openai [--port 8765] [--latency 0.05]
+#   [--first-token 0.5] [--run-duration 2.0] [--run-fail-rate 0.0] [--tts-latency 0.4]
+#   [--whisper-latency 0.6] [--chat-latency 0.8]
+import os
+import time
+import json
+import uuid
+import random
+import logging
+import argparse
+import threading
+from flask import Flask, Response, request, jsonify
+from werkzeug.serving import make_server
+
+REPLY_WORDS = ("Getting seven to nine hours of sleep, staying hydrated and moving a little every day "
+               "will do more for your energy than any supplement. ").split()
+
+class FakeOpenAI:
+    def __init__(self, latency=0.05, first_token=0.5, run_duration=2.0, run_fail_rate=0.0,
+                 tts_latency=0.4, whisper_latency=0.6, chat_latency=0.8, reply_tokens=60):
+        self.latency = latency
+        self.first_token = first_token
+        self.run_duration = run_duration
+        self.run_fail_rate = run_fail_rate
+        self.tts_latency = tts_latency
+        self.whisper_latency = whisper_latency
+        self.chat_latency = chat_latency
+        self.reply_tokens = reply_tokens
+        self.lock = threading.Lock()
+        self.threads = {}  # thread_id -> [message, ...] oldest first
+        self.runs = {}  # thread_id -> [run, ...]
+        self.assistants = {}
+        self.calls = {}
+
+    def count(self, operation):
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+
+def _id(prefix):
+    return f"{prefix}_{uuid.uuid4().hex[:24]}"
+
+def _message(thread_id, role, text, run_id=None, assistant_id=None):
+    return {
+        "id": _id("msg"), "object": "thread.message", "created_at": int(time.time()),
+        "thread_id": thread_id, "role": role, "status": "completed",
+        "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+        "assistant_id": assistant_id, "run_id": run_id, "attachments": [], "metadata": {},
+    }
+
+def _run(thread_id, assistant_id, status):
+    return {
+        "id": _id("run"), "object": "thread.run", "created_at": int(time.time()),
+        "thread_id": thread_id, "assistant_id": assistant_id, "status": status,
+        "model": "gpt-4", "instructions": "", "tools": [], "metadata": {},
+        "parallel_tool_calls": True,
+    }
+
+def _assistant(assistant_id, body):
+    return {
+        "id": assistant_id, "object": "assistant", "created_at": int(time.time()),
+        "model": body.get("model", "gpt-4"), "name": body.get("name"), "instructions": body.get("instructions"),
+        "tools": body.get("tools", []), "tool_resources": body.get("tool_resources"), "metadata": {},
+    }
+
+def _page(items):
+    return {
+        "object": "list", "data": items, "has_more": False,
+        "first_id": items[0]["id"] if items else None, "last_id": items[-1]["id"] if items else None,
+    }
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def create_app(fake):
+    app = Flask(__name__)
+
+    @app.before_request
+    def upstream_latency():
+        fake.count(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+        time.sleep(fake.latency)
+
+    @app.route('/v1/threads', methods=['POST'])
+    def create_thread():
+        thread_id = _id("thread")
+        with fake.lock:
+            fake.threads[thread_id] = []
+            fake.runs[thread_id] = []
+        return jsonify({"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}})
+
+    @app.route('/v1/threads/<thread_id>/messages', methods=['POST'])
+    def create_message(thread_id):
+        body = request.get_json()
+        content = body.get("content")
+        text = content if isinstance(content, str) else json.dumps(content)
+        message = _message(thread_id, body.get("role", "user"), text)
+        with fake.lock:
+            fake.threads.setdefault(thread_id, []).append(message)
+        return jsonify(message)
+
+    @app.route('/v1/threads/<thread_id>/messages', methods=['GET'])
+    def list_messages(thread_id):
+        with fake.lock:
+            messages = list(fake.threads.get(thread_id, []))
+        if request.args.get("order", "desc") == "desc":
+            messages.reverse()
+        after = request.args.get("after")
+        if after:
+            ids = [message["id"] for message in messages]
+            messages = messages[ids.index(after) + 1:] if after in ids else []
+        return jsonify(_page(messages[:int(request.args.get("limit", 20))]))
+
+    @app.route('/v1/threads/<thread_id>/runs', methods=['GET'])
+    def list_runs(thread_id):
+        with fake.lock:
+            runs = list(reversed(fake.runs.get(thread_id, [])))
+        return jsonify(_page(runs))
+
+    @app.route('/v1/threads/<thread_id>/runs/<run_id>/cancel', methods=['POST'])
+    def cancel_run(thread_id, run_id):
+        with fake.lock:
+            for run in fake.runs.get(thread_id, []):
+                if run["id"] == run_id:
+                    run["status"] = "cancelled"
+                    return jsonify(run)
+        return jsonify({"error": {"message": "No run found", "type": "invalid_request_error"}}), 404
+
+    @app.route('/v1/threads/<thread_id>/runs', methods=['POST'])
+    def create_run(thread_id):
+        body = request.get_json()
+        run = _run(thread_id, body.get("assistant_id"), "queued")
+        with fake.lock:
+            fake.runs.setdefault(thread_id, []).append(run)
+        fails = random.random() < fake.run_fail_rate
+
+        def events():
+            yield _sse("thread.run.created", run)
+            run["status"] = "in_progress"
+            yield _sse("thread.run.in_progress", run)
+            time.sleep(fake.first_token)
+            if fails:
+                run["status"] = "failed"
+                run["last_error"] = {"code": "server_error", "message": "Simulated failure"}
+                yield _sse("thread.run.failed", run)
+                yield "event: done\ndata: [DONE]\n\n"
+                return
+            words = [random.choice(REPLY_WORDS) for _ in range(fake.reply_tokens)]
+            message = _message(thread_id, "assistant", " ".join(words), run["id"], run["assistant_id"])
+            yield _sse("thread.message.created", {**message, "status": "in_progress", "content": []})
+            pause = max(0.0, fake.run_duration - fake.first_token) / max(1, len(words))
+            for i, word in enumerate(words):
+                if run["status"] == "cancelled":
+                    yield _sse("thread.run.cancelled", run)
+                    yield "event: done\ndata: [DONE]\n\n"
+                    return
+                delta = {"id": message["id"], "object": "thread.message.delta", "delta": {"content": [
+                    {"index": 0, "type": "text", "text": {"value": word if i == 0 else f" {word}", "annotations": []}}
+                ]}}
+                yield _sse("thread.message.delta", delta)
+                time.sleep(pause)
+            with fake.lock:
+                fake.threads.setdefault(thread_id, []).append(message)
+            yield _sse("thread.message.completed", message)
+            run["status"] = "completed"
+            yield _sse("thread.run.completed", run)
+            yield "event: done\ndata: [DONE]\n\n"
+
+        return Response(events(), mimetype='text/event-stream')
+
+    @app.route('/v1/assistants', methods=['POST'])
+    def create_assistant():
+        assistant = _assistant(_id("asst"), request.get_json())
+        with fake.lock:
+            fake.assistants[assistant["id"]] = assistant
+        return jsonify(assistant)
+
+    @app.route('/v1/assistants/<assistant_id>', methods=['GET'])
+    def retrieve_assistant(assistant_id):
+        with fake.lock:
+            assistant = fake.assistants.get(assistant_id)
+        return jsonify(assistant or _assistant(assistant_id, {}))
+
+    @app.route('/v1/assistants/<assistant_id>', methods=['POST'])
+    def update_assistant(assistant_id):
+        assistant = _assistant(assistant_id, request.get_json())
+        with fake.lock:
+            fake.assistants[assistant_id] = assistant
+        return jsonify(assistant)
+
+    @app.route('/v1/chat/completions', methods=['POST'])
+    def chat_completions():
+        body = request.get_json()
+        time.sleep(fake.chat_latency)
+        return jsonify({
+            "id": _id("chatcmpl"), "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "gpt-4"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "A short description of the picture."}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 8, "total_tokens": 18},
+        })
+
+    @app.route('/v1/audio/speech', methods=['POST'])
+    def speech():
+        body = request.get_json()
+        time.sleep(fake.tts_latency)
+        # Roughly the size of a 64 kbps mp3 at normal speaking pace
+        return Response(os.urandom(600 * max(1, len(body.get("input", "")) // 15)), mimetype='audio/mpeg')
+
+    @app.route('/v1/audio/transcriptions', methods=['POST'])
+    def transcriptions():
+        request.files.get("file")
+        time.sleep(fake.whisper_latency)
+        return jsonify({"text": "How can I sleep better after night shifts?"})
+
+    @app.route('/_stats', methods=['GET'])
+    def stats():
+        with fake.lock:
+            return jsonify(dict(fake.calls))
+
+    return app
+
+def serve(fake, host="127.0.0.1", port=8765):
+    # Returns a started threaded server; call .shutdown() to stop it
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server(host, port, create_app(fake), threaded=True)
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake OpenAI API for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="Added to every request (seconds)")
+    parser.add_argument("--first-token", type=float, default=0.5, help="Run start to first token")
+    parser.add_argument("--run-duration", type=float, default=2.0, help="Run start to completion")
+    parser.add_argument("--run-fail-rate", type=float, default=0.0)
+    parser.add_argument("--tts-latency", type=float, default=0.4)
+    parser.add_argument("--whisper-latency", type=float, default=0.6)
+    parser.add_argument("--chat-latency", type=float, default=0.8)
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(args.latency, args.first_token, args.run_duration, args.run_fail_rate,
+                      args.tts_latency, args.whisper_latency, args.chat_latency, args.reply_tokens)
+    print(f"Fake OpenAI API on http://{args.host}:{args.port}/v1")
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    make_server(args.host, args.port, create_app(fake), threaded=True).serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+# load_test.py:
+# Scripted load scenarios against the backend with the OpenAI API replaced by the local fake in
+# benchmarks/fake_openai.py. By default it starts the fake API and the app (flask run, threaded,
+# SQLite) as subprocesses in a scratch directory; --target points it at an already running app
+# (e.g. under gunicorn against Postgres), which must then be configured with
+# OPENAI_BASE_URL_HEALTHAPP itself.
+#
+# Each scenario runs --requests requests from --concurrency virtual users and reports throughput,
+# p50/p95/p99 latency and error rate. --json saves the results; --baseline compares against a
+# saved run and exits non-zero on a regression, for use as a check on every change.
+#
+# Usage (from backend/): python -m benchmarks.load_test [--scenarios login,thread_continue,...]
+#   [--requests 100] [--concurrency 20] [--json out.json] [--baseline previous.json]
+import io
+import os
+import sys
+import json
+import time
+import wave
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import statistics
+import httpx
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETUP_CONCURRENCY = 10
+SCENARIOS = ("login", "create_thread", "thread_continue", "thread_continue_stream", "image", "tts", "transcribe")
+
+
+### Processes ###
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+def start_fake_openai(args, workdir):
+    port = free_port()
+    command = [sys.executable, "-m", "benchmarks.fake_openai", "--port", str(port),
+               "--latency", str(args.upstream_latency), "--first-token", str(args.first_token),
+               "--run-duration", str(args.run_duration), "--run-fail-rate", str(args.run_fail_rate)]
+    log = open(os.path.join(workdir, "fake_openai.log"), "w")
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, stdout=log, stderr=subprocess.STDOUT)
+    wait_for(f"http://127.0.0.1:{port}/_stats", process)
+    return process, f"http://127.0.0.1:{port}/v1"
+
+def start_app(args, workdir, openai_base_url):
+    port = free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": BACKEND_DIR,
+        "DATABASE_URL_HEALTHAPP": args.database_url or f"sqlite:///{os.path.join(workdir, 'load_test.db')}",
+        "OPENAI_BASE_URL_HEALTHAPP": openai_base_url,
+        "OPENAI_API_KEY_HEALTHAPP": "fake",
+        "SECRET_TOKEN_KEY_HEALTHAPP": "load-test",
+        "JOB_WORKERS_HEALTHAPP": "0",
+        "METRICS_LOG_REQUESTS_HEALTHAPP": "0",
+        # Every virtual user is on the free plan; measure the backend, not the per-user rate limits
+        "RATE_LIMIT_FREE_HEALTHAPP": "",
+        "RATE_LIMIT_FREE_TIER_HEALTHAPP": "",
+    }
+    log = open(os.path.join(workdir, "app.log"), "w")
+    # Schema changes are a deploy step, not part of app startup
+    subprocess.run([sys.executable, "-m", "modules.migrations", "upgrade"], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT, check=True)
+    # Run from the scratch directory so cached audio lands there, not in the working tree
+    command = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port), "--with-threads", "--no-reload"]
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    wait_for(f"http://127.0.0.1:{port}/metrics", process)
+    return process, f"http://127.0.0.1:{port}"
+
+
+### Fixtures ###
+
+def make_wav(seconds=2, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(os.urandom(seconds * rate * 2))
+    return buffer.getvalue()
+
+def make_jpeg(width=1280, height=960):
+    # Noise, so every image is distinct and misses the image description cache
+    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+class VirtualUser:
+    def __init__(self, index, run_id):
+        self.email = f"load{run_id}_{index}@example.com"
+        self.password = "load-test"
+        self.user_id = None
+        self.thread_id = None
+        self.headers = {}
+
+async def setup_user(client, user):
+    response = await client.post("/create_user", json={"name": "Load", "surname": "Test", "email": user.email, "password": user.password})
+    response.raise_for_status()
+    response = await client.post("/login", json={"email": user.email, "password": user.password})
+    response.raise_for_status()
+    user.user_id = response.json()["user_id"]
+    user.headers = {"Authorization": f"Bearer {response.json()['token']}"}
+    response = await client.post("/update_user_settings", headers=user.headers, json={
+        "user_id": user.user_id, "language": "en", "display_setting": "dark", "voice_setting": 1,
+        "voice_speed_setting": 1.0, "autoplaybackaudio_setting": False,
+    })
+    response.raise_for_status()
+    user.headers = {"Authorization": f"Bearer {response.json()['token']}"}
+    response = await client.post("/create_new_thread", headers=user.headers, json={"user_id": user.user_id})
+    response.raise_for_status()
+    user.thread_id = response.json()["thread_id"]
+
+
+### Scenarios: each sends one request for a virtual user and returns the response ###
+
+async def scenario_login(client, user, i, fixtures):
+    return await client.post("/login", json={"email": user.email, "password": user.password})
+
+async def scenario_create_thread(client, user, i, fixtures):
+    return await client.post("/create_new_thread", headers=user.headers, json={"user_id": user.user_id})
+
+async def scenario_thread_continue(client, user, i, fixtures):
+    return await client.post("/thread_continue", headers=user.headers, json={
+        "user_id": user.user_id, "thread_id": user.thread_id, "user_input": f"How can I sleep better? ({i})",
+    })
+
+async def scenario_thread_continue_stream(client, user, i, fixtures):
+    async with client.stream("POST", "/thread_continue_stream", headers=user.headers, json={
+        "user_id": user.user_id, "thread_id": user.thread_id, "user_input": f"How can I sleep better? ({i})",
+    }) as response:
+        body = (await response.aread()).decode()
+    if "event: error" in body:
+        response.status_code = 599  # The run failed after the stream started
+    return response
+
+async def scenario_image(client, user, i, fixtures):
+    images = fixtures["images"]
+    return await client.post("/thread_continue_with_image", headers=user.headers,
+        data={"user_id": str(user.user_id), "thread_id": user.thread_id, "user_input": "What is on my plate?"},
+        files={"image": ("photo.jpg", images[i % len(images)], "image/jpeg")})
+
+async def scenario_tts(client, user, i, fixtures):
+    # Unique text, so every request misses the TTS cache
+    return await client.post("/text_to_speech", headers=user.headers, json={
+        "user_id": user.user_id, "text": f"Try to keep a consistent bedtime and avoid screens late at night. ({i})",
+    })
+
+async def scenario_transcribe(client, user, i, fixtures):
+    return await client.post("/voice_memo", headers={**user.headers, "Content-Type": "audio/wav"},
+                             params={"user_id": user.user_id}, content=fixtures["audio"])
+
+
+### Runner and report ###
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))] if values else 0.0
+
+async def run_scenario(client, name, users, fixtures, requests):
+    scenario = globals()[f"scenario_{name}"]
+    latencies, errors = [], {}
+    next_index = iter(range(requests))
+
+    async def virtual_user(user):
+        for i in next_index:
+            started = time.perf_counter()
+            try:
+                response = await scenario(client, user, i, fixtures)
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - started) * 1000)
+            if not isinstance(status, int) or status >= 400:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(user) for user in users))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": sum(errors.values()),
+        "error_rate": sum(errors.values()) / requests,
+        "error_statuses": errors,
+        "throughput": requests / elapsed,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "mean_ms": statistics.mean(latencies),
+    }
+
+def compare(results, baseline, max_regression):
+    # Returns a list of regressions against a saved run
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        if result["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {previous['p95_ms']:.0f}ms -> {result['p95_ms']:.0f}ms")
+        if result["throughput"] < previous["throughput"] * (1 - max_regression):
+            regressions.append(f"{name}: throughput {previous['throughput']:.1f} -> {result['throughput']:.1f} req/s")
+        if result["error_rate"] > previous["error_rate"] + 0.01:
+            regressions.append(f"{name}: error rate {previous['error_rate']:.1%} -> {result['error_rate']:.1%}")
+    return regressions
+
+async def run(args, base_url):
+    run_id = int(time.time() * 1000)
+    users = [VirtualUser(i, run_id) for i in range(args.concurrency)]
+    fixtures = {"audio": make_wav(), "images": [make_jpeg() for _ in range(min(args.requests, 20))]}
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        # Sign-ups are writes; SQLite (the default database) times out on hundreds at once
+        setup_slots = asyncio.Semaphore(SETUP_CONCURRENCY)
+        async def setup(user):
+            async with setup_slots:
+                await setup_user(client, user)
+        await asyncio.gather(*(setup(user) for user in users))
+        results = {}
+        for name in args.scenarios:
+            results[name] = await run_scenario(client, name, users, fixtures, args.requests)
+            result = results[name]
+            print(f"{name:<24} {result['throughput']:>8.1f} req/s  p50 {result['p50_ms']:>7.0f}ms  "
+                  f"p95 {result['p95_ms']:>7.0f}ms  p99 {result['p99_ms']:>7.0f}ms  "
+                  f"errors {result['error_rate']:>6.1%} {result['error_statuses'] or ''}")
+        return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the backend against a fake OpenAI API")
+    parser.add_argument("--target", help="Base URL of a running app (default: start one)")
+    parser.add_argument("--database-url", help="Database for the started app (default: scratch SQLite)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="Virtual users")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--upstream-latency", type=float, default=0.05)
+    parser.add_argument("--first-token", type=float, default=0.5)
+    parser.add_argument("--run-duration", type=float, default=2.0)
+    parser.add_argument("--run-fail-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Compare with results saved by an earlier --json run")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative p95/throughput change")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="healthapp-load-")
+    try:
+        base_url = args.target
+        if not base_url:
+            fake, openai_base_url = start_fake_openai(args, workdir)
+            processes.append(fake)
+            app, base_url = start_app(args, workdir, openai_base_url)
+            processes.append(app)
+            print(f"App at {base_url}, fake OpenAI at {openai_base_url} (logs in {workdir})\n")
+        results = asyncio.run(run(args, base_url))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")},
+                       "scenarios": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions against the baseline")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# 0001_initial_schema.py:
+# Baseline: the schema previously created by db.create_all(). Tables are frozen here rather than
+# taken from models.py, so later migrations always start from the same point. checkfirst keeps this
+# a no-op on databases that create_all() already built.
+from sqlalchemy import (MetaData, Table, Column, Integer, String, Text, Float, Boolean, DateTime,
+                        ForeignKey, Index, UniqueConstraint)
+
+metadata = MetaData()
+
+Table('user', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(80), nullable=False),
+    Column('surname', String(80), nullable=False),
+    Column('email', String(120), unique=True, nullable=False),
+    Column('password', String(260), nullable=False),
+    Column('user_version', String(10)),
+    Column('language', String(5)),
+    Column('display_setting', String(5)),
+    Column('voice_setting', Integer),
+    Column('voice_speed_setting', Float),
+    Column('autoplaybackaudio_setting', Boolean),
+)
+
+Table('user_threads', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id')),
+    Column('thread_id', String(100)),
+    Column('title', String(255)),
+    Column('date_created', DateTime),
+)
+
+Table('user_profile', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id')),
+    Column('age', Integer),
+    Column('height', Integer),
+    Column('fitness_level', Integer),
+    Column('dietary_restrictions', Text),
+    Column('health_conditions', Text),
+    Column('goals', Text),
+    Column('height_unit', String(10)),
+)
+
+Table('thread_message', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('thread_id', String(100), nullable=False),
+    Column('message_id', String(100), unique=True, nullable=False),
+    Column('role', String(20), nullable=False),
+    Column('content', Text, nullable=False),
+    Column('created_at', Integer, nullable=False),
+    Index('ix_thread_message_thread_created', 'thread_id', 'created_at', 'id'),
+)
+
+Table('thread_message_sync', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('thread_id', String(100), unique=True, nullable=False),
+    Column('last_message_id', String(100)),
+    Column('in_sync', Boolean, nullable=False),
+    Column('date_synced', DateTime),
+)
+
+Table('image_description', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('content_hash', String(64), unique=True, nullable=False),
+    Column('phash', String(16)),
+    Column('phash_band0', Integer, index=True),
+    Column('phash_band1', Integer, index=True),
+    Column('phash_band2', Integer, index=True),
+    Column('phash_band3', Integer, index=True),
+    Column('description', Text, nullable=False),
+    Column('date_created', DateTime, index=True),
+)
+
+Table('bot_assistant', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('bot_id', Integer, nullable=False),
+    Column('language', String(5), nullable=False),
+    Column('assistant_id', String(100), nullable=False),
+    Column('config_hash', String(64), nullable=False),
+    Column('date_updated', DateTime),
+    UniqueConstraint('bot_id', 'language'),
+)
+
+Table('job', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('kind', String(50), nullable=False),
+    Column('payload', Text, nullable=False),
+    Column('status', String(20), nullable=False),
+    Column('priority', Integer, nullable=False),
+    Column('attempts', Integer, nullable=False),
+    Column('max_attempts', Integer, nullable=False),
+    Column('run_after', DateTime, nullable=False),
+    Column('locked_by', String(100)),
+    Column('result', Text),
+    Column('error', Text),
+    Column('date_created', DateTime),
+    Column('date_updated', DateTime),
+    Index('ix_job_claim', 'status', 'priority', 'run_after'),
+)
+
+Table('admin', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('username', String(80), unique=True, nullable=False),
+    Column('password', String(260), nullable=False),
+)
+
+def upgrade(conn):
+    metadata.create_all(conn, checkfirst=True)
+
+def downgrade(conn):
+    metadata.drop_all(conn, checkfirst=True)
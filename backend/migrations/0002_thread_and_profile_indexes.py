@@ -0,0 +1,25 @@
+# 0002_thread_and_profile_indexes.py:
+# Indexes for the hot lookups: threads by thread_id (continue_thread, update_thread_title,
+# delete_thread, generate_thread_title), a user's threads newest first (get_user_threads), and a
+# user's profile (get_user_profile). thread_id and the profile's user_id become unique; existing
+# duplicates are removed first, keeping the oldest thread row and the newest profile row.
+# The composite (user_id, date_created) index also serves plain user_id filters.
+from sqlalchemy import text
+
+def upgrade(conn):
+    conn.execute(text(
+        "DELETE FROM user_threads WHERE thread_id IS NOT NULL AND id NOT IN "
+        "(SELECT MIN(id) FROM user_threads WHERE thread_id IS NOT NULL GROUP BY thread_id)"
+    ))
+    conn.execute(text(
+        "DELETE FROM user_profile WHERE user_id IS NOT NULL AND id NOT IN "
+        "(SELECT MAX(id) FROM user_profile WHERE user_id IS NOT NULL GROUP BY user_id)"
+    ))
+    conn.execute(text("CREATE UNIQUE INDEX ix_user_threads_thread_id ON user_threads (thread_id)"))
+    conn.execute(text("CREATE INDEX ix_user_threads_user_id_date_created ON user_threads (user_id, date_created)"))
+    conn.execute(text("CREATE UNIQUE INDEX ix_user_profile_user_id ON user_profile (user_id)"))
+
+def downgrade(conn):
+    conn.execute(text("DROP INDEX ix_user_profile_user_id"))
+    conn.execute(text("DROP INDEX ix_user_threads_user_id_date_created"))
+    conn.execute(text("DROP INDEX ix_user_threads_thread_id"))
@@ -0,0 +1,19 @@
+# 0003_thread_run_state.py:
+# Run state per thread (see modules/run_state.py): the id and status of the thread's latest
+# assistant run and when it started and last changed.
+from sqlalchemy import text
+
+COLUMNS = (
+    ("active_run_id", "VARCHAR(100)"),
+    ("run_status", "VARCHAR(20)"),
+    ("run_started_at", "TIMESTAMP"),
+    ("run_updated_at", "TIMESTAMP"),
+)
+
+def upgrade(conn):
+    for name, column_type in COLUMNS:
+        conn.execute(text(f"ALTER TABLE user_threads ADD COLUMN {name} {column_type}"))
+
+def downgrade(conn):
+    for name, _ in reversed(COLUMNS):
+        conn.execute(text(f"ALTER TABLE user_threads DROP COLUMN {name}"))
@@ -0,0 +1,24 @@
+# 0004_idempotency_keys.py:
+# Client idempotency keys for chat submissions (see modules/submissions.py). One row per
+# (thread_id, key) holds the submission's state and, once finished, its stored response.
+from sqlalchemy import MetaData, Table, Column, Integer, String, Text, DateTime, UniqueConstraint, Index
+
+metadata = MetaData()
+
+idempotency_key = Table('idempotency_key', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('thread_id', String(100), nullable=False),
+    Column('key', String(100), nullable=False),
+    Column('status', String(20), nullable=False),
+    Column('response_status', Integer),
+    Column('response_body', Text),
+    Column('date_created', DateTime),
+    UniqueConstraint('thread_id', 'key', name='uq_idempotency_key_thread_id_key'),
+    Index('ix_idempotency_key_date_created', 'date_created'),
+)
+
+def upgrade(conn):
+    idempotency_key.create(conn)
+
+def downgrade(conn):
+    idempotency_key.drop(conn)
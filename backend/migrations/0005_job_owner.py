@@ -0,0 +1,14 @@
+# 0005_job_owner.py:
+# Owner of each background job, so /job_status only answers the user who enqueued it, and an index
+# for the retention sweep of finished jobs (see modules/jobs.py).
+from sqlalchemy import text
+
+def upgrade(conn):
+    conn.execute(text("ALTER TABLE job ADD COLUMN user_id INTEGER"))
+    conn.execute(text("CREATE INDEX ix_job_user_id ON job (user_id)"))
+    conn.execute(text("CREATE INDEX ix_job_status_date_updated ON job (status, date_updated)"))
+
+def downgrade(conn):
+    conn.execute(text("DROP INDEX ix_job_status_date_updated"))
+    conn.execute(text("DROP INDEX ix_job_user_id"))
+    conn.execute(text("ALTER TABLE job DROP COLUMN user_id"))
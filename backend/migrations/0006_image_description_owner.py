@@ -0,0 +1,12 @@
+# 0006_image_description_owner.py:
+# Owner of each cached image description, so near-duplicate matches (IMAGE_CACHE_NEAR_MATCH_HEALTHAPP)
+# only return descriptions of the same user's images (see modules/image_cache.py).
+from sqlalchemy import text
+
+def upgrade(conn):
+    conn.execute(text("ALTER TABLE image_description ADD COLUMN user_id INTEGER"))
+    conn.execute(text("CREATE INDEX ix_image_description_user_id ON image_description (user_id)"))
+
+def downgrade(conn):
+    conn.execute(text("DROP INDEX ix_image_description_user_id"))
+    conn.execute(text("ALTER TABLE image_description DROP COLUMN user_id"))
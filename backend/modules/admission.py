@@ -0,0 +1,252 @@
+# admission.py:
+# Admission control in front of the OpenAI-backed routes, so a traffic spike degrades into fast,
+# explicit rejections instead of every request queueing until it times out.
+# - Rate limits: token buckets per user, sized by user_version tier (free, standard, premium),
+#   plus one bucket per tier so free traffic cannot crowd out paying users. A user over their
+#   limit gets a 429, a tier over its limit a 503; both with Retry-After. Requests that turn out
+#   to start no new work (idempotent replays, a busy thread) are refunded with refund().
+# - Adaptive concurrency: one AIMD limiter per upstream operation (threads.runs.stream,
+#   audio.speech.create, ...). The limit grows by one per limit's worth of healthy calls and is
+#   halved on an upstream 429 or a call much slower than the operation's usual latency. Calls
+#   over the limit queue for a slot; when the queue is full or the wait exceeds QUEUE_TIMEOUT the
+#   call is shed with Overloaded, which is answered with a 503 instead of reaching OpenAI.
+# - Retries: upstream 429s (and connection errors or 5xx for operations that are safe to repeat)
+#   are retried with jittered exponential backoff, honouring Retry-After.
+# Buckets and limiters are per process; with N workers, the effective limits are N times higher.
+import os
+import math
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from flask import g, jsonify
+from .models import TTLCache
+from . import metrics, auth
+
+def _limit(name, default):
+    # "requests per minute,burst"; an empty value disables the limit
+    value = os.environ.get(name, default)
+    if not value:
+        return None
+    per_minute, burst = value.split(',')
+    return float(per_minute) / 60, float(burst)
+
+# user_version -> (per-user limit, whole-tier limit); users without a plan count as free.
+# Opening a conversation costs three requests (create_new_thread, thread_initial and the TTS of the
+# greeting) and every spoken exchange two or three (transcription, submission, TTS), so the free
+# burst covers a new conversation plus a few quick exchanges, and its rate about ten exchanges a
+# minute. The limits are there to stop scripted abuse, not normal use.
+TIER_LIMITS = {
+    'f': (_limit("RATE_LIMIT_FREE_HEALTHAPP", "30,15"), _limit("RATE_LIMIT_FREE_TIER_HEALTHAPP", "1200,200")),
+    's': (_limit("RATE_LIMIT_STANDARD_HEALTHAPP", "60,30"), _limit("RATE_LIMIT_STANDARD_TIER_HEALTHAPP", "")),
+    'p': (_limit("RATE_LIMIT_PREMIUM_HEALTHAPP", "120,60"), _limit("RATE_LIMIT_PREMIUM_TIER_HEALTHAPP", "")),
+}
+
+# Routes that call OpenAI; everything else is served from the database (or locally, like
+# generate_thread_title) and is not limited
+LIMITED_ENDPOINTS = {
+    'create_new_thread', 'handle_initial', 'handle_continue',
+    'handle_continue_stream', 'handle_continue_with_image', 'text_to_speech', 'text_to_speech_stream',
+    'transcribe_voice_memo', 'voice_memo',
+}
+
+MIN_CONCURRENCY = int(os.environ.get("OPENAI_MIN_CONCURRENCY_HEALTHAPP", 2))
+INITIAL_CONCURRENCY = int(os.environ.get("OPENAI_INITIAL_CONCURRENCY_HEALTHAPP", 20))
+MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY_HEALTHAPP", 100))  # Per operation
+MAX_QUEUE = int(os.environ.get("OPENAI_MAX_QUEUE_HEALTHAPP", 50))  # Waiting calls per operation
+QUEUE_TIMEOUT = float(os.environ.get("OPENAI_QUEUE_TIMEOUT_HEALTHAPP", 10))  # Seconds
+SLOW_FACTOR = 2.5  # A call this many times slower than the smoothed latency counts as congestion
+
+MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES_HEALTHAPP", 3))
+BACKOFF_BASE = 0.5  # Seconds
+BACKOFF_CAP = 8.0
+SHED_RETRY_AFTER = 2  # Seconds suggested to clients that were shed
+
+class Overloaded(Exception):
+    def __init__(self, message, retry_after=SHED_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+### Token buckets ###
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate  # Tokens per second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        # Returns 0 if a token was taken, otherwise the seconds until one is available
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+# Idle buckets are dropped after an hour, by which time any bucket has refilled anyway
+_user_buckets = TTLCache(maxsize=100000, ttl=3600)
+_tier_buckets = {tier: TokenBucket(*limits[1]) for tier, limits in TIER_LIMITS.items() if limits[1]}
+_bucket_lock = threading.Lock()
+rate_limited = metrics.Counter("rate_limited_total", "Requests rejected by the per-user or per-tier rate limits")
+
+def _user_bucket(user_id, tier):
+    key = f"{user_id}:{tier}"  # A plan change starts a bucket of the new size
+    with _bucket_lock:
+        bucket = _user_buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(*TIER_LIMITS[tier][0])
+            _user_buckets.set(key, bucket)
+    return bucket
+
+def check_rate_limit(user_id, user_version):
+    # Returns None if the request is admitted, otherwise the error response
+    tier = user_version if user_version in TIER_LIMITS else 'f'
+    g.rate_charged = []
+    if TIER_LIMITS[tier][0]:
+        user_bucket = _user_bucket(user_id, tier)
+        wait = user_bucket.take()
+        if wait:
+            rate_limited.inc(scope="user", tier=tier)
+            return _rejection("Too many requests, please slow down", 429, wait)
+        g.rate_charged.append(user_bucket)
+    else:
+        user_bucket = None
+    tier_bucket = _tier_buckets.get(tier)
+    if tier_bucket:
+        wait = tier_bucket.take()
+        if wait:
+            refund()
+            rate_limited.inc(scope="tier", tier=tier)
+            return _rejection("The service is busy, please try again shortly", 503, wait)
+        g.rate_charged.append(tier_bucket)
+    return None
+
+def refund():
+    # Gives the current request's tokens back, for requests that start no new work
+    for bucket in g.pop('rate_charged', []):
+        bucket.refund()
+
+def _rejection(message, status, retry_after):
+    response = jsonify({"error": message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+### Adaptive concurrency (AIMD) ###
+# All limiter state lives on the openai_service event loop, so it needs no locks.
+
+class AdaptiveLimiter:
+    def __init__(self, operation, initial=INITIAL_CONCURRENCY, minimum=MIN_CONCURRENCY,
+                 maximum=MAX_CONCURRENCY, max_queue=MAX_QUEUE, queue_timeout=QUEUE_TIMEOUT):
+        self.operation = operation
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.latency = None  # Smoothed latency of healthy calls (seconds)
+        self.last_decrease = 0.0
+        self.stats = {"admitted": 0, "shed": 0, "decreases": 0}
+        self._waiters = deque()
+
+    async def acquire(self):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.stats["shed"] += 1
+            raise Overloaded(f"Too many queued {self.operation} calls")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["shed"] += 1
+            raise Overloaded(f"Timed out waiting for a {self.operation} slot")
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self.stats["admitted"] += 1  # The slot was handed over by release()
+
+    def release(self, latency, congested=False):
+        if congested or (self.latency is not None and latency > SLOW_FACTOR * self.latency):
+            self._decrease()
+        else:
+            self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self.in_flight -= 1
+        self._wake()
+
+    def _decrease(self):
+        # Halve at most once per smoothed latency (at least a second), so a burst of 429s from
+        # calls that were already in flight counts as one congestion signal
+        now = time.monotonic()
+        if now - self.last_decrease >= max(1.0, self.latency or 0):
+            self.limit = max(self.minimum, self.limit / 2)
+            self.last_decrease = now
+            self.stats["decreases"] += 1
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+_limiters = {}
+
+def limiter(operation):
+    if operation not in _limiters:
+        _limiters[operation] = AdaptiveLimiter(operation)
+    return _limiters[operation]
+
+def backoff(attempt, retry_after=None):
+    # Full jitter: a random delay up to the exponential bound, so retries from many requests spread out
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(BACKOFF_CAP, retry_after))
+    return delay
+
+def _collect():
+    limiters = list(_limiters.values())
+    families = [
+        ("openai_concurrency_limit", "gauge", "Current adaptive concurrency limit per OpenAI operation",
+         [({"operation": l.operation}, round(l.limit, 2)) for l in limiters]),
+        ("openai_in_flight", "gauge", "OpenAI calls in flight per operation",
+         [({"operation": l.operation}, l.in_flight) for l in limiters]),
+        ("openai_queued", "gauge", "OpenAI calls waiting for a slot per operation",
+         [({"operation": l.operation}, len(l._waiters)) for l in limiters]),
+    ]
+    for key in ("admitted", "shed", "decreases"):
+        families.append((f"openai_limiter_{key}_total", "counter", f"OpenAI limiter {key} per operation",
+                         [({"operation": l.operation}, l.stats[key]) for l in limiters]))
+    return families
+
+metrics.register_collector(_collect)
+
+
+def init_app(app):
+    # Registered after auth.init_app, so the verified claims are available
+    @app.before_request
+    def limit_rate():
+        if auth.endpoint_name() not in LIMITED_ENDPOINTS or 'claims' not in g:
+            return None
+        return check_rate_limit(g.user_id, g.claims.get('user_version'))
+
+    @app.errorhandler(Overloaded)
+    def handle_overloaded(e):
+        return _rejection("The service is busy, please try again shortly", 503, e.retry_after)
@@ -0,0 +1,112 @@
+# assistant_registry.py:
+# Maps (bot id, language) to an OpenAI assistant id. Assistants are synced from assistant_configs
+# in the background after startup (or with `flask --app app sync-assistants`) and only updated
+# remotely when their config text changes, so requests resolve the assistant from memory instead of
+# rewriting a shared assistant on every call. Until a sync has run, the first lookup loads the ids
+# of the last sync from the database.
+import hashlib
+import json
+import threading
+from sqlalchemy.exc import IntegrityError
+from .models import db, BotAssistant
+from .assistant_config import assistant_ids, assistant_configs
+from . import openai_service, metrics
+
+DEFAULT_LANGUAGE = 'en'  # The language the base assistants in assistant_ids are configured for
+
+_registry = {}
+_loaded = False
+_lock = threading.Lock()
+
+def config_hash(config):
+    payload = json.dumps({
+        "name": config.get("name", "AI Assistant"),
+        "instructions": config.get("instructions", ""),
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def is_configured(config):
+    return config.get("instructions", "TBD") != "TBD"
+
+async def _create_language_assistant(base_id, config):
+    # Clones the base assistant (model, tools, files) with the language-specific name and instructions
+    base = await openai_service.retrieve_assistant(base_id)
+    assistant = await openai_service.create_assistant(
+        model=base.model,
+        tools=[tool.model_dump(exclude_none=True) for tool in base.tools],
+        tool_resources=base.tool_resources.model_dump(exclude_none=True) if base.tool_resources else None,
+        name=config.get("name", "AI Assistant"),
+        instructions=config.get("instructions", ""),
+    )
+    metrics.log_event("assistant_created", assistant_id=assistant.id, base_id=base_id)
+    return assistant.id
+
+async def _sync_one(bot_id, language, config):
+    digest = config_hash(config)
+    row = BotAssistant.query.filter_by(bot_id=bot_id, language=language).first()
+    if row and row.config_hash == digest:
+        return row.assistant_id
+
+    if row:
+        assistant_id = row.assistant_id
+    elif language == DEFAULT_LANGUAGE:
+        assistant_id = assistant_ids[bot_id]
+    else:
+        assistant_id = None
+
+    if assistant_id:
+        await openai_service.update_assistant(
+            assistant_id=assistant_id,
+            instructions=config.get("instructions", ""),
+            name=config.get("name", "AI Assistant"),
+        )
+        metrics.log_event("assistant_updated", assistant_id=assistant_id, bot_id=bot_id, language=language)
+    else:
+        assistant_id = await _create_language_assistant(assistant_ids[bot_id], config)
+
+    if row:
+        row.config_hash = digest
+    else:
+        db.session.add(BotAssistant(bot_id=bot_id, language=language, assistant_id=assistant_id, config_hash=digest))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker synced the same assistant concurrently; use its row
+        db.session.rollback()
+        row = BotAssistant.query.filter_by(bot_id=bot_id, language=language).first()
+        assistant_id = row.assistant_id
+    return assistant_id
+
+async def sync_assistants():
+    # Must run inside an app context. Falls back to the base assistant ids if OpenAI is unreachable.
+    for bot_id, configs in assistant_configs.items():
+        if not assistant_ids.get(bot_id):
+            continue
+        for language, config in configs.items():
+            if not is_configured(config):
+                continue
+            try:
+                _registry[(bot_id, language)] = await _sync_one(bot_id, language, config)
+            except Exception as e:
+                db.session.rollback()
+                metrics.log_event("assistant_sync_failed", bot_id=bot_id, language=language, error=type(e).__name__, detail=str(e)[:200])
+
+def _load_registry():
+    # Ids from the last sync; a row may still carry an older config, which beats falling back to
+    # another language's assistant
+    global _loaded
+    with _lock:
+        if _loaded:
+            return
+        for row in BotAssistant.query.all():
+            _registry.setdefault((row.bot_id, row.language), row.assistant_id)
+        _loaded = True
+
+def resolve_assistant_id(bot_id, language):
+    # Must run inside an app context
+    if not _loaded:
+        _load_registry()
+    assistant_id = _registry.get((bot_id, language))
+    if assistant_id:
+        return assistant_id
+    return _registry.get((bot_id, DEFAULT_LANGUAGE)) or assistant_ids.get(bot_id) or None
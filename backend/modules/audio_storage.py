@@ -0,0 +1,214 @@
+# audio_storage.py:
+# On-disk store for generated speech (written by tts_cache and tts_stream, served at /audio/<filename>).
+# - Files are content addressed (speech_<sha256>.mp3) and sharded two levels deep by their hash
+#   (audio/ab/cd/speech_abcd...mp3), so no directory grows past a few thousand entries.
+# - A background sweeper deletes files not used for TTL and then, while the store is over MAX_BYTES,
+#   the least recently used ones. Reads and downloads touch the file, so its mtime is its last use.
+#   Every worker process runs its own sweeper; deletions by several of them are harmless.
+# - serve() answers with the content hash as a strong ETag, Range support (seek and resume in
+#   mobile players) and immutable caching, or hands the file to the front proxy with
+#   X-Accel-Redirect (nginx) or X-Sendfile, so Python workers do not push the bytes.
+# - Files from before content addressing (speech_<uuid4>.mp3, flat in AUDIO_DIR) stay where they
+#   are: they are still served, and expire through the same TTL and size sweeps.
+# - Audio URLs use AUDIO_BASE_URL_HEALTHAPP (e.g. a CDN), defaulting to the host of the request.
+import os
+import re
+import time
+import uuid
+import threading
+from datetime import timedelta
+from flask import abort, current_app, has_request_context, request, send_file
+from . import metrics
+
+AUDIO_DIR = os.path.abspath(os.environ.get("AUDIO_DIR_HEALTHAPP", 'audio'))  # Relative to the working directory
+BASE_URL = os.environ.get("AUDIO_BASE_URL_HEALTHAPP")
+TTL = timedelta(days=int(os.environ.get("AUDIO_TTL_DAYS_HEALTHAPP", 30)))
+MAX_BYTES = int(os.environ.get("AUDIO_CACHE_MAX_BYTES_HEALTHAPP", 500 * 1024 * 1024))
+GC_INTERVAL = float(os.environ.get("AUDIO_GC_INTERVAL_HEALTHAPP", 600))  # Seconds between sweeps
+# nginx: an internal location aliased to AUDIO_DIR, e.g. "/internal_audio/"
+ACCEL_REDIRECT_PREFIX = os.environ.get("AUDIO_ACCEL_REDIRECT_HEALTHAPP")
+USE_SENDFILE = os.environ.get("AUDIO_SENDFILE_HEALTHAPP") == "1"  # Apache mod_xsendfile, lighttpd
+MAX_AGE = 365 * 24 * 3600  # Content addressed, so a URL always has the same bytes
+TMP_MAX_AGE = 3600  # Leftovers of interrupted writes
+
+_NAME = re.compile(r'^speech_([0-9a-f]{64})\.mp3$')
+_LEGACY_NAME = re.compile(r'^speech_[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.mp3$')
+
+_sweep_now = threading.Event()
+_sweeper = None
+_lock = threading.Lock()
+_stats = {"files": 0, "bytes": 0, "written_bytes": 0, "deleted": 0, "sweeps": 0, "last_sweep_seconds": 0.0}
+
+
+### Paths ###
+
+def relative_path(filename):
+    # Shard path of an audio file, or None if the name is not one of ours (rejects path tricks)
+    match = _NAME.match(filename)
+    if not match:
+        return filename if _LEGACY_NAME.match(filename) else None
+    digest = match.group(1)
+    return os.path.join(digest[:2], digest[2:4], filename)
+
+def path_for(filename):
+    relative = relative_path(filename)
+    return os.path.join(AUDIO_DIR, relative) if relative else None
+
+
+### Reads and writes ###
+
+def touch(filename):
+    # Marks the file as used; returns its size, or None if it does not exist
+    path = path_for(filename)
+    try:
+        os.utime(path)
+        return os.path.getsize(path)
+    except (FileNotFoundError, TypeError):
+        return None
+
+def read(filename):
+    with open(path_for(filename), 'rb') as f:
+        return f.read()
+
+def write(filename, data):
+    # Writes atomically, so readers never see a partial file
+    path = path_for(filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    with _lock:
+        _stats["written_bytes"] += len(data)
+        over_budget = _stats["bytes"] + _stats["written_bytes"] > MAX_BYTES
+    if over_budget:
+        _sweep_now.set()  # Don't wait for the next interval
+
+
+### Garbage collection ###
+
+def _migrate_flat_files():
+    # Moves files from the old flat layout (audio/speech_*.mp3) into their shards
+    if not os.path.isdir(AUDIO_DIR):
+        return
+    for entry in os.scandir(AUDIO_DIR):
+        if entry.is_file() and _NAME.match(entry.name):
+            target = path_for(entry.name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.replace(entry.path, target)
+            except FileNotFoundError:
+                pass  # Moved by another worker
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False  # Already deleted by another worker
+
+def sweep():
+    # One GC pass; returns the number of files deleted
+    started = time.perf_counter()
+    now = time.time()
+    expires_before = now - TTL.total_seconds()
+    files = []  # (mtime, path, size)
+    deleted = 0
+    for root, _, names in os.walk(AUDIO_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.endswith('.tmp'):
+                if stat.st_mtime < now - TMP_MAX_AGE:
+                    deleted += _remove(path)
+            elif _NAME.match(name) or _LEGACY_NAME.match(name):
+                if stat.st_mtime < expires_before:
+                    deleted += _remove(path)
+                else:
+                    files.append((stat.st_mtime, path, stat.st_size))
+
+    total = sum(size for _, _, size in files)
+    count = len(files)
+    if total > MAX_BYTES:
+        # Least recently used first, down to 90% of the budget so the next writes don't trigger another pass
+        files.sort()
+        for _, path, size in files:
+            if total <= MAX_BYTES * 0.9:
+                break
+            deleted += _remove(path)
+            total -= size
+            count -= 1
+
+    with _lock:
+        _stats["files"] = count
+        _stats["bytes"] = total
+        _stats["written_bytes"] = 0
+        _stats["deleted"] += deleted
+        _stats["sweeps"] += 1
+        _stats["last_sweep_seconds"] = round(time.perf_counter() - started, 3)
+    return deleted
+
+def _sweep_loop():
+    _migrate_flat_files()
+    while True:
+        try:
+            deleted = sweep()
+            if deleted:
+                metrics.log_event("audio_gc", deleted=deleted, bytes=_stats["bytes"])
+        except Exception as e:
+            metrics.log_event("audio_gc_failed", error=type(e).__name__, detail=str(e)[:200])
+        _sweep_now.wait(GC_INTERVAL)
+        _sweep_now.clear()
+
+def start_sweeper():
+    global _sweeper
+    with _lock:
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=_sweep_loop, name="audio-gc", daemon=True)
+            _sweeper.start()
+
+
+### Serving ###
+
+def serve(filename):
+    # Response for /audio/<filename>; either name is unique per content, so it doubles as the ETag
+    if touch(filename) is None:  # Played audio counts as used for the GC
+        abort(404)
+    path = path_for(filename)
+    if ACCEL_REDIRECT_PREFIX:
+        # nginx sends the file (with Range and conditional request support) from its internal location
+        response = current_app.response_class(mimetype='audio/mpeg')
+        response.headers['X-Accel-Redirect'] = ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + relative_path(filename).replace(os.sep, '/')
+    else:
+        # send_file handles Range, If-Range and If-None-Match, or emits X-Sendfile if USE_X_SENDFILE is set.
+        # The ETag comes from the name (hash or legacy uuid), not the mtime, since touching the file must not change it.
+        response = send_file(path, mimetype='audio/mpeg', etag=filename[len('speech_'):-len('.mp3')],
+                             conditional=True, max_age=MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.max_age = MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+def base_url():
+    # Configured audio base URL, or the /audio route on the host of the current request
+    if BASE_URL:
+        return BASE_URL.rstrip('/')
+    if has_request_context():
+        return request.host_url.rstrip('/') + '/audio'
+    return '/audio'
+
+def url(filename, base=None):
+    return f"{base or base_url()}/{filename}"
+
+def stats():
+    with _lock:
+        return {**_stats, "max_bytes": MAX_BYTES}
+
+metrics.register_stats("audio_storage", stats, counters={"deleted", "sweeps"})
+
+def init_app(app):
+    # The sweeper is started separately (start_sweeper), once the worker process serves requests
+    app.config['USE_X_SENDFILE'] = USE_SENDFILE
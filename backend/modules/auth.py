@@ -0,0 +1,112 @@
+# auth.py:
+# Stateless token authentication. Login issues a signed token carrying the claims routes need
+# (user id, name, user_version, language), and a before_request hook verifies it on every
+# non-public endpoint. Verified tokens are kept in a small TTL/LRU cache, so most requests cost
+# neither a signature check nor a database query. When update_user_settings or update_user_version
+# change a user, their cached entries are dropped and the user's claims are reloaded once from the
+# database for tokens issued before the change (in this process; other workers pick up new claims
+# from the fresh token returned by the update routes). Tokens expire after TOKEN_LIFETIME; the
+# client swaps its token for a new one at /refresh_token before then, and logs in again on a 401.
+import time
+from flask import current_app, g, jsonify, request
+from itsdangerous import URLSafeTimedSerializer as Serializer, BadData
+from .models import User, UserThreads, TTLCache
+from .database import primary_reads
+
+TOKEN_LIFETIME = 3600  # Seconds
+PUBLIC_ENDPOINTS = {'create_user', 'login', 'verify_token', 'uploaded_file', 'static', 'metrics'}  # /metrics has its own token
+
+_tokens = TTLCache(maxsize=10000, ttl=300)  # token -> verified claims
+_invalidated_at = {}  # user_id -> time of the last settings/version change in this process
+
+def _serializer():
+    return Serializer(current_app.config['SECRET_KEY'])
+
+def user_claims(user):
+    return {
+        'user_id': user.id,
+        'name': user.name,
+        'user_version': user.user_version,
+        'language': user.language,
+    }
+
+def issue_token(user):
+    now = time.time()
+    return _serializer().dumps({**user_claims(user), 'iat': now, 'exp': now + TOKEN_LIFETIME})
+
+def token_response(user):
+    # Response fields for a new token; expires_in tells the client when to refresh it
+    return {"token": issue_token(user), "expires_in": TOKEN_LIFETIME}
+
+def verify(token):
+    # Returns the token's claims, or None if it is invalid or expired
+    if not token or not isinstance(token, str):
+        return None
+    claims = _tokens.get(token)
+    if claims is None:
+        try:
+            claims = _serializer().loads(token)
+        except (BadData, TypeError, ValueError):
+            return None
+        if not isinstance(claims, dict) or 'user_id' not in claims or time.time() > claims.get('exp', 0):
+            return None
+        if 'iat' not in claims or _invalidated_at.get(claims['user_id'], 0) > claims['iat']:
+            # Token from before claims were added, or the user changed settings after it was issued;
+            # refresh its claims once
+            with primary_reads():
+                user = User.query.get(claims['user_id'])
+            if not user:
+                return None
+            claims = {**claims, **user_claims(user), 'iat': time.time()}
+        _tokens.set(token, claims, ttl=min(_tokens.ttl, claims['exp'] - time.time()))
+    elif time.time() > claims['exp']:
+        return None
+    return claims
+
+def invalidate_user(user_id):
+    _invalidated_at[user_id] = time.time()
+    _tokens.delete_where(lambda token, claims: claims['user_id'] == user_id)
+
+def endpoint_name():
+    # The view's name without its blueprint prefix ('api.login' -> 'login')
+    return request.endpoint.rsplit('.', 1)[-1] if request.endpoint else None
+
+def owned_thread(thread_id, primary=False):
+    # The caller's thread with this id, or None. Another user's thread is also None, so routes
+    # answer 404 for it and thread ids cannot be probed. Routes that go on to write read it from
+    # the primary, so a thread created a moment ago is never missing on a lagging replica.
+    if not thread_id or 'user_id' not in g:
+        return None
+    if primary:
+        with primary_reads():
+            return UserThreads.query.filter_by(thread_id=thread_id, user_id=g.user_id).first()
+    return UserThreads.query.filter_by(thread_id=thread_id, user_id=g.user_id).first()
+
+def _request_token():
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return header[len('Bearer '):]
+    return None
+
+def _request_user_id():
+    # The user id a route will act on, wherever the client sent it
+    if request.is_json:
+        body = request.get_json(silent=True) or {}
+        if 'user_id' in body:
+            return body['user_id']
+    return request.form.get('user_id') or request.args.get('user_id')
+
+def init_app(app):
+    @app.before_request
+    def authenticate():
+        if request.method == 'OPTIONS' or request.endpoint is None or endpoint_name() in PUBLIC_ENDPOINTS:
+            return None
+        claims = verify(_request_token())
+        if not claims:
+            return jsonify({"error": "Invalid token"}), 401
+        user_id = _request_user_id()
+        if user_id is not None and str(user_id) != str(claims['user_id']):
+            return jsonify({"error": "Forbidden"}), 403
+        g.claims = claims
+        g.user_id = claims['user_id']
+        return None
@@ -0,0 +1,55 @@
+# batch.py:
+# Registry and runner for /batch, which lets the client fetch several read-only resources in one
+# round trip (e.g. settings, profile and the first page of threads at startup). Operations run in
+# order on the request's DB session, and the user is loaded once and shared between them.
+# Each operation is a function (user_id, user, args) -> (body, status) registered with @operation;
+# the matching single routes call the same functions.
+from . import metrics
+
+MAX_OPERATIONS = 10
+
+_operations = {}
+
+class BatchError(ValueError):
+    pass
+
+def operation(name):
+    def decorator(func):
+        _operations[name] = func
+        return func
+    return decorator
+
+def parse(operations):
+    # Accepts ["get_user_settings", {"op": "get_user_threads", "args": {"limit": 20}}, ...]
+    if not isinstance(operations, list) or not operations:
+        raise BatchError("operations must be a non-empty list")
+    if len(operations) > MAX_OPERATIONS:
+        raise BatchError(f"At most {MAX_OPERATIONS} operations per batch")
+    parsed = []
+    for index, entry in enumerate(operations):
+        if isinstance(entry, str):
+            name, args = entry, {}
+        elif isinstance(entry, dict):
+            name, args = entry.get('op'), entry.get('args') or {}
+        else:
+            raise BatchError(f"Operation {index} must be a name or an object with \"op\" and \"args\"")
+        if not isinstance(name, str) or name not in _operations:
+            raise BatchError(f"Unknown operation at index {index}: {name}")
+        if not isinstance(args, dict):
+            raise BatchError(f"args of operation {index} ({name}) must be an object")
+        if any(name == seen for seen, _ in parsed):
+            raise BatchError(f"Duplicate operation at index {index}: {name}")
+        parsed.append((name, args))
+    return parsed
+
+def run(user_id, user, operations):
+    # Returns {name: {"status": ..., "body": ...}}; one failing operation does not fail the others
+    results = {}
+    for name, args in operations:
+        try:
+            body, status = _operations[name](user_id, user, args)
+        except Exception as e:
+            metrics.log_event("batch_operation_failed", operation=name, error=type(e).__name__)
+            body, status = {"error": "An error occurred processing your request"}, 500
+        results[name] = {"status": status, "body": body}
+    return results
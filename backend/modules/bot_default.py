@@ -1,51 +1,37 @@
 # bot_default.py:
-import os
-import openai
 from flask import jsonify
-import time
 import re
-from .models import db, User, UserThreads
-from .assistant_config import assistant_ids, assistant_configs
-
-client = openai.OpenAI(
-  api_key = os.environ.get("OPENAI_API_KEY_HEALTHAPP")
-)
+from .models import db, UserThreads, get_cached_user
+from .database import primary_reads
+from .assistant_config import assistant_configs
+from .assistant_registry import resolve_assistant_id
+from . import openai_service, message_store, run_state, metrics
 
 class Teacher:
     def __init__(self, assistant_id):
         self.assistant_id = assistant_id
 
-def get_thread(user_id):
-    session = UserThreads.query.filter_by(user_id=user_id).first()
+async def get_thread(user_id):
+    with primary_reads():
+        session = UserThreads.query.filter_by(user_id=user_id).first()
 
     # Retrieve user language preference from the database
-    user = User.query.filter_by(id=user_id).first()
+    user = get_cached_user(user_id)
     if not user:
-        print(f"From get_thread: User with ID {user_id} not found")
+        metrics.log_event("user_not_found", where="get_thread", user_id=user_id)
         user_lang = 'en'  # default to English
     else:
-        user_lang = user.language
-        print(f"From get_thread: Fetched User Language: {user_lang}")
-
-    # Update assistant based on user's language
-    assistant_config = assistant_configs.get(user_lang, {})
-
-    if assistant_config:
-        # Update the assistant with the new configuration
-        client.beta.assistants.update(
-            assistant_id=assistant_ids[1], # Default Health Bot, but implement a way to change this later
-            instructions=assistant_config.get("instructions", ""),
-            name=assistant_config.get("name", "AI Assistant"),
-        )
+        user_lang = user["language"]
 
     if not session:
         # Create new session and thread
-        assistant_id = assistant_ids.get(1)
+        assistant_id = resolve_assistant_id(1, user_lang) # Default Health Bot, but implement a way to change this later
         teacher = Teacher(assistant_id)
-        new_thread = client.beta.threads.create()
+        new_thread = await openai_service.create_thread()
         new_session = UserThreads(user_id=user_id, thread_id=new_thread.id)
         db.session.add(new_session)
         db.session.commit()
+        message_store.start_thread(new_thread.id)
         return new_thread.id, True
     else:
         return session.thread_id, False
@@ -65,30 +51,17 @@ def process_annotations(message_content):
 
     return text
 
-def get_thread_messages(thread_id):
-    messages = client.beta.threads.messages.list(thread_id=thread_id)
-    messages_list = []
-    is_assistant = True  # Assuming the first message is always from the assistant
-    for msg in messages.data:
-        if msg.content:
-            role = "assistant" if is_assistant else "user"
-            messages_list.append({
-                "text": msg.content[0].text.value,
-                "role": role
-            })
-            is_assistant = not is_assistant
-    
-    return messages_list
-
-def get_initial_message(thread_id, user_id):
+async def get_thread_messages(thread_id):
+    return await message_store.get_messages(thread_id)
+
+async def get_initial_message(thread_id, user_id):
     # Retrieve user language preference from the database
-    user = User.query.filter_by(id=user_id).first()
+    user = get_cached_user(user_id)
     if not user:
-        print(f"From get_initial_message: User with ID {user_id} not found")
+        metrics.log_event("user_not_found", where="get_initial_message", user_id=user_id)
         user_lang = 'en'  # default to English
     else:
-        user_lang = user.language
-        print(f"From get_initial_message: Fetched User Language: {user_lang}")
+        user_lang = user["language"]
 
     assistant_config = assistant_configs.get(1).get(user_lang, {})
 
@@ -97,91 +70,108 @@ def get_initial_message(thread_id, user_id):
     if not thread_id:
         raise ValueError("No thread ID provided for initial message")
 
-    message_response = client.beta.threads.messages.create(
-        thread_id=thread_id,
-        role="user",
-        content=initial_content
-    )
-    print(f"Initial message sent to thread: {thread_id}")
+    message_response = await openai_service.create_message(thread_id, initial_content)
+    message_store.record_initial_message(thread_id, message_response)
+    metrics.log_event("initial_message", thread_id=thread_id, language=user_lang)
     initial_message = message_response.content[0].text.value if message_response.content else ""
     return jsonify({"message": initial_message, "thread_id": thread_id})
 
-def continue_thread(thread_id, user_input, image_description=None):
+# Run events that end a streamed run without an assistant reply
+RUN_FAILED_EVENTS = {
+    "thread.run.failed",
+    "thread.run.cancelled",
+    "thread.run.expired",
+    "thread.run.incomplete",
+    "thread.run.requires_action",
+}
+
+async def open_run_stream(thread_id, user_input, image_description=None):
+    # Sends the user input to the thread and starts a streamed run.
+    # Returns (events, None) on success, where events is a stream_run_events generator,
+    # or (None, (error_message, status_code)).
 
     # Modify the message based on the presence of an image description
     if image_description:
         user_input = f"User message: {user_input}. Brief description of the image the user has attached: {image_description}"
-        print(f"Received the following user_input to add to thread: {user_input}")
-    else:
-        print(f"Received the following user_input to add to thread: {user_input}")
-    
-    cancel_active_runs(thread_id)
 
-    # Fetch the thread ID from the UserThreads using the thread ID
-    session = UserThreads.query.filter_by(thread_id=thread_id).first()
+    # Fetch the thread ID from the UserThreads using the thread ID (from the primary, as the run
+    # state is written next)
+    with primary_reads():
+        session = UserThreads.query.filter_by(thread_id=thread_id).first()
     if not session:
-        return jsonify({"error": "Session not found"}), 404
+        return None, ("Session not found", 404)
+
+    # Cancel the thread's run if one is still open (no OpenAI call when there is none)
+    await run_state.cancel_active_run(session)
 
-    assistant_id = assistant_ids.get(1)
+    # Resolve the assistant configured for the thread owner's language
+    user = get_cached_user(session.user_id)
+    user_lang = user["language"] if user else 'en'
+    assistant_id = resolve_assistant_id(1, user_lang)
 
     if not assistant_id:
-        return jsonify({"error": "Assistant ID not found for the thread"}), 404
-    
+        return None, ("Assistant ID not found for the thread", 404)
+
     # Send user input to the thread
-    client.beta.threads.messages.create(
-        thread_id=thread_id,
-        role="user",
-        content=user_input
-    )
-    print("User input sent to thread")
-
-    # Create and wait for the run to complete
-    run = client.beta.threads.runs.create(
-        thread_id=thread_id,
-        assistant_id=assistant_id,
-    )
-    print(f"Run created: {run.id}")
-
-    if not wait_for_run_completion(thread_id, run.id):
-        print("Run did not complete.")
-        return jsonify({"error": "Run did not complete. Please try again later.", "thread_id": thread_id})
-
-    # Fetch the latest assistant's message after the run
-    messages = client.beta.threads.messages.list(
-        thread_id=thread_id
-    )
-    assistant_message = find_assistant_message(messages.data)
-    print(f"Assistant message: {assistant_message}")
-    
-    return jsonify({"message": assistant_message, "thread_id": thread_id})
+    user_message = await openai_service.create_message(thread_id, user_input)
+    message_store.record_user_message(thread_id, user_message, user_input)
+    # Sizes only; message contents are health data and stay out of the logs
+    metrics.log_event("user_message", thread_id=thread_id, chars=len(user_input or ""), image=bool(image_description))
+
+    # Create the run as an event stream instead of polling for its status
+    stream = openai_service.stream_run(thread_id, assistant_id)
+    return stream_run_events(stream, thread_id, user_message.id), None
+
+async def stream_run_events(stream, thread_id, reply_to):
+    # Yields ("delta", text) for every token chunk of the assistant reply as it is produced,
+    # then either ("done", full_message) or ("error", reason). The completed reply is stored locally.
+    parts = []
+    message = None
+    try:
+        async for event in stream:
+            if event.event == "thread.run.created":
+                metrics.log_event("run_created", thread_id=thread_id, run_id=event.data.id)
+                run_state.run_started(thread_id, event.data.id, event.data.status)
+            elif event.event == "thread.message.delta":
+                for content in event.data.delta.content or []:
+                    if content.type == "text" and content.text and content.text.value:
+                        parts.append(content.text.value)
+                        yield "delta", content.text.value
+            elif event.event == "thread.message.completed":
+                if event.data.role == "assistant" and event.data.content:
+                    message = event.data.content[0].text.value
+                    message_store.record_assistant_message(thread_id, event.data, reply_to)
+            elif event.event == "thread.run.completed":
+                run_state.run_updated(thread_id, event.data.id, "completed")
+            elif event.event in RUN_FAILED_EVENTS:
+                metrics.log_event("run_failed", thread_id=thread_id, run_id=event.data.id, run_event=event.event)
+                run_state.run_updated(thread_id, event.data.id, event.data.status)
+                yield "error", event.event
+                return
+            elif event.event == "error":
+                metrics.log_event("run_stream_error", thread_id=thread_id, code=getattr(event.data, "code", None))
+                yield "error", "error"
+                return
+    finally:
+        await stream.aclose()
+
+    if message is None:
+        message = "".join(parts) or "No response from assistant"
+    metrics.log_event("assistant_message", thread_id=thread_id, chars=len(message))
+    yield "done", message
+
+async def continue_thread(thread_id, user_input, image_description=None):
+    # Non-streaming wrapper: drains the run stream and returns the full reply at once
+    events, error = await open_run_stream(thread_id, user_input, image_description)
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    assistant_message = None
+    async for event, data in events:
+        if event == "error":
+            metrics.log_event("run_incomplete", thread_id=thread_id)
+            return jsonify({"error": "Run did not complete. Please try again later.", "thread_id": thread_id})
+        if event == "done":
+            assistant_message = data
 
-def cancel_active_runs(thread_id):
-    active_runs = client.beta.threads.runs.list(thread_id=thread_id)
-    for run in active_runs.data:
-        print(run.status)
-        # Only attempt to cancel runs that are not completed or expired
-        if run.status not in ["completed", "expired"]:
-            try:
-                client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
-            except openai.Error as e:
-                # Handle specific OpenAI API errors here, if needed
-                print(f"Error canceling run {run.id}: {e}")
-
-def wait_for_run_completion(thread_id, run_id):
-    max_retries = 100
-    retries = 0
-    while retries < max_retries:
-        run_status = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
-        print(run_status.status)
-        if run_status.status == "completed":
-            return True
-        time.sleep(2)
-        retries += 1
-    return False
-
-def find_assistant_message(messages):
-    # Looking for the latest assistant message
-    for message in messages:
-        if message.role == "assistant" and message.content:
-            return message.content[0].text.value
-    return "No response from assistant"
+    return jsonify({"message": assistant_message, "thread_id": thread_id})
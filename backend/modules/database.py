@@ -0,0 +1,196 @@
+# database.py:
+# Database connection settings: explicit pool sizing, pre-ping and recycle for the primary, an
+# optional PgBouncer mode, and a routing session that sends plain reads to read replicas.
+#
+# Routing rules (RoutingSession.get_bind):
+# - SELECTs go to a random replica, unless they lock rows (FOR UPDATE), the session has already
+#   written, or the current user committed a write within the last DB_STICKY_SECONDS_HEALTHAPP
+#   seconds (read-your-writes). The time of the last write is tracked per process and also sent
+#   to the client (db_last_write cookie and X-Last-Write header), which sends it back, so the next
+#   request is sticky in whichever worker process it lands.
+# - Reads inside `with primary_reads():` always use the primary. Cache fills use this, since a
+#   lagging replica would otherwise put stale data in the cache for its whole TTL.
+# - Everything else (flushes, bulk update/delete, raw text() statements) goes to the primary.
+# Without DB_REPLICA_URLS_HEALTHAPP every query goes to the primary, as before.
+import os
+import time
+import random
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import g, has_app_context, has_request_context, request
+from sqlalchemy import Select
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool, NullPool
+from flask_sqlalchemy.session import Session
+from . import metrics
+
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE_HEALTHAPP", 5))
+MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW_HEALTHAPP", 10))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT_HEALTHAPP", 10))  # Seconds to wait for a free connection
+POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE_HEALTHAPP", 1800))  # Below DigitalOcean's idle timeout
+PGBOUNCER = os.environ.get("DB_PGBOUNCER_HEALTHAPP") == "1"
+REPLICA_URLS = [url.strip() for url in os.environ.get("DB_REPLICA_URLS_HEALTHAPP", "").split(",") if url.strip()]
+STICKY_SECONDS = float(os.environ.get("DB_STICKY_SECONDS_HEALTHAPP", 5))
+REPLICA_PREFIX = 'replica_'
+STICKY_COOKIE = 'db_last_write'
+STICKY_HEADER = 'X-Last-Write'
+
+def database_uri():
+    # DATABASE_URL_HEALTHAPP points the app at another server, e.g. a local Postgres
+    if os.environ.get("DATABASE_URL_HEALTHAPP"):
+        return os.environ["DATABASE_URL_HEALTHAPP"]
+    # Database configuration (DigitalOcean hosting)
+    postgres_user = os.environ.get("POSTGRES_USER_HEALTHAPP")
+    postgres_pw = os.environ.get("POSTGRES_PW_HEALTHAPP")
+    postgres_host = os.environ.get("POSTGRES_HOST_HEALTHAPP")
+    postgres_port = os.environ.get("POSTGRES_PORT_HEALTHAPP")
+    postgres_db = os.environ.get("POSTGRES_DB_HEALTHAPP")
+    return f'postgresql://{postgres_user}:{postgres_pw}@{postgres_host}:{postgres_port}/{postgres_db}?sslmode=require'
+
+def replica_binds():
+    # SQLALCHEMY_BINDS entries for the replicas; RoutingSession picks among them
+    return {f"{REPLICA_PREFIX}{i}": url for i, url in enumerate(REPLICA_URLS)}
+
+# Pool instrumentation: time spent waiting for a connection (including opening a new one) and
+# checkout counts, per pool
+class _TimedPool:
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            stats = self.__dict__.setdefault('_checkout_stats', {"checkouts": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0})
+            stats["checkouts"] += 1
+            stats["wait_seconds_total"] += waited
+            stats["wait_seconds_max"] = max(stats["wait_seconds_max"], waited)
+
+class TimedQueuePool(_TimedPool, QueuePool):
+    pass
+
+class TimedNullPool(_TimedPool, NullPool):
+    pass
+
+def engine_options():
+    if PGBOUNCER:
+        # PgBouncer in transaction mode does the pooling; holding idle connections here would only
+        # pin its server connections. psycopg2 uses no server-side prepared statements, so
+        # transaction pooling is safe.
+        return {"poolclass": TimedNullPool, "pool_pre_ping": True}
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+def pool_stats(engines):
+    stats = {}
+    for key, engine in engines.items():
+        pool = engine.pool
+        entry = {"checked_out": pool.checkedout() if hasattr(pool, 'checkedout') else None}
+        if isinstance(pool, QueuePool):
+            entry.update(size=pool.size(), overflow=pool.overflow(), checked_in=pool.checkedin())
+        entry.update(pool.__dict__.get('_checkout_stats', {"checkouts": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}))
+        stats[key or 'primary'] = entry
+    return stats
+
+_sticky_until = {}  # user_id -> monotonic time until which their reads stay on the primary
+_sticky_lock = threading.Lock()
+_force_primary = ContextVar('force_primary', default=False)
+_routing_stats = {"primary_reads": 0, "replica_reads": 0, "writes": 0}
+
+@contextmanager
+def primary_reads():
+    token = _force_primary.set(True)
+    try:
+        yield
+    finally:
+        _force_primary.reset(token)
+
+def _current_user_id():
+    return g.get('user_id') if has_app_context() else None
+
+def _client_wrote_recently():
+    # The last-write time the client sent back; bounded, so a forged value cannot pin it to the primary
+    if not has_request_context():
+        return False
+    try:
+        wrote_at = float(request.cookies.get(STICKY_COOKIE) or request.headers.get(STICKY_HEADER) or 0)
+    except ValueError:
+        return False
+    now = time.time()
+    return now - STICKY_SECONDS < wrote_at <= now + 1
+
+def _user_is_sticky():
+    if _client_wrote_recently():
+        return True
+    user_id = _current_user_id()
+    if user_id is None:
+        return False
+    with _sticky_lock:
+        until = _sticky_until.get(user_id)
+        if until is not None and until < time.monotonic():
+            del _sticky_until[user_id]
+            return False
+        return until is not None
+
+class RoutingSession(Session):
+    def __init__(self, db, **kwargs):
+        super().__init__(db, **kwargs)
+        self._wrote = False
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is not None:
+            return bind
+        is_read = isinstance(clause, Select) and clause._for_update_arg is None
+        if not is_read:
+            self._wrote = True
+            _routing_stats["writes"] += 1
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        replicas = [engine for key, engine in self._db.engines.items() if key and key.startswith(REPLICA_PREFIX)]
+        if not replicas or self._wrote or _force_primary.get() or _user_is_sticky():
+            _routing_stats["primary_reads"] += 1
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        _routing_stats["replica_reads"] += 1
+        return random.choice(replicas)
+
+    def commit(self):
+        super().commit()
+        if not self._wrote or STICKY_SECONDS <= 0 or not has_app_context():
+            return
+        g.db_last_write = time.time()
+        user_id = _current_user_id()
+        if user_id is not None:
+            with _sticky_lock:
+                _sticky_until[user_id] = time.monotonic() + STICKY_SECONDS
+
+def init_app(app):
+    # Hands the time of a committed write to the client, only needed when reads can go to replicas
+    @app.after_request
+    def send_last_write(response):
+        if REPLICA_URLS and 'db_last_write' in g:
+            value = f"{g.db_last_write:.3f}"
+            response.set_cookie(STICKY_COOKIE, value, max_age=int(STICKY_SECONDS) + 1, httponly=True, samesite='Lax')
+            response.headers[STICKY_HEADER] = value
+        return response
+
+def routing_stats():
+    return dict(_routing_stats)
+
+def pool_metric_families(engines):
+    # pool_stats() as Prometheus families, labelled by pool (primary, replica_0, ...)
+    stats = pool_stats(engines)
+    families = []
+    for key, kind in (("checked_out", "gauge"), ("size", "gauge"), ("overflow", "gauge"),
+                      ("checkouts", "counter"), ("wait_seconds_total", "counter"), ("wait_seconds_max", "gauge")):
+        samples = [({"pool": pool}, entry[key]) for pool, entry in stats.items() if entry.get(key) is not None]
+        name = f"db_pool_{key}_total" if kind == "counter" and not key.endswith("_total") else f"db_pool_{key}"
+        families.append((name, kind, f"Connection pool {key.replace('_', ' ')}", samples))
+    return families
+
+metrics.instrument_engine(Engine)
+metrics.register_stats("db_routing", routing_stats, counters={"primary_reads", "replica_reads", "writes"})
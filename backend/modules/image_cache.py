@@ -0,0 +1,85 @@
+# image_cache.py:
+# Postgres cache of vision descriptions, so a re-sent screenshot or meal photo skips the vision call.
+# Exact matches use the hash of the normalized image bytes and are shared between users, since the
+# bytes are identical. Near duplicates (re-saved or slightly recompressed copies) match on perceptual
+# hash within MAX_HAMMING_DISTANCE, only when IMAGE_CACHE_NEAR_MATCH_HEALTHAPP=1 and only among the
+# same user's images: screenshots with the same layout but different values (lab results) can hash
+# identically, so a shared near match could return another user's health data. Since any two hashes
+# that close share at least one of their four 16-bit bands, candidates come from indexed band lookups.
+import os
+import threading
+from datetime import datetime, timedelta
+from .models import db, ImageDescription
+from . import metrics
+
+TTL = timedelta(days=int(os.environ.get("IMAGE_CACHE_TTL_DAYS_HEALTHAPP", 30)))
+MAX_HAMMING_DISTANCE = 3
+NEAR_MATCH = os.environ.get("IMAGE_CACHE_NEAR_MATCH_HEALTHAPP") == "1"
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "near_hits": 0, "misses": 0}
+
+def _bands(phash):
+    return [(phash >> shift) & 0xFFFF for shift in (48, 32, 16, 0)]
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+def lookup(prepared, user_id):
+    # Returns the cached description for the image, or None
+    cutoff = datetime.utcnow() - TTL
+    entry = ImageDescription.query.filter(
+        ImageDescription.content_hash == prepared.content_hash,
+        ImageDescription.date_created >= cutoff
+    ).first()
+    if entry:
+        _count("hits")
+        return entry.description
+
+    if NEAR_MATCH and prepared.phash is not None and user_id is not None:
+        bands = _bands(prepared.phash)
+        candidates = ImageDescription.query.filter(
+            ImageDescription.user_id == user_id,
+            ImageDescription.date_created >= cutoff,
+            db.or_(
+                ImageDescription.phash_band0 == bands[0],
+                ImageDescription.phash_band1 == bands[1],
+                ImageDescription.phash_band2 == bands[2],
+                ImageDescription.phash_band3 == bands[3],
+            )
+        ).limit(50).all()
+        for candidate in candidates:
+            if bin(int(candidate.phash, 16) ^ prepared.phash).count("1") <= MAX_HAMMING_DISTANCE:
+                _count("near_hits")
+                return candidate.description
+
+    _count("misses")
+    return None
+
+def store(prepared, description, user_id):
+    # Inserts the description and drops entries past their TTL
+    ImageDescription.query.filter(ImageDescription.date_created < datetime.utcnow() - TTL).delete()
+    entry = ImageDescription.query.filter_by(content_hash=prepared.content_hash).first()
+    if not entry:
+        entry = ImageDescription(content_hash=prepared.content_hash, user_id=user_id)
+        db.session.add(entry)
+    if prepared.phash is not None:
+        entry.phash = f"{prepared.phash:016x}"
+        entry.phash_band0, entry.phash_band1, entry.phash_band2, entry.phash_band3 = _bands(prepared.phash)
+    entry.description = description
+    entry.date_created = datetime.utcnow()
+    try:
+        db.session.commit()
+    except Exception as e:
+        # Most likely a concurrent insert of the same image; the cache is best effort
+        db.session.rollback()
+        metrics.log_event("image_cache_store_failed", error=type(e).__name__)
+
+def stats():
+    with _lock:
+        lookups = _stats["hits"] + _stats["near_hits"] + _stats["misses"]
+        hits = _stats["hits"] + _stats["near_hits"]
+        return {**_stats, "hit_rate": hits / lookups if lookups else 0.0}
+
+metrics.register_stats("image_cache", stats, counters={"hits", "near_hits", "misses"})
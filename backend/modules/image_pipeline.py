@@ -0,0 +1,82 @@
+# image_pipeline.py:
+# In-memory preparation of uploaded images for the vision model. The upload is decoded, rotated
+# upright, downscaled to the largest size the model actually looks at, and re-encoded as a
+# metadata-free JPEG, so phone photos are not written to disk or sent at full resolution.
+import io
+import time
+import base64
+import hashlib
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow not installed: images are passed through unchanged
+    Image = None
+
+# High-detail vision inputs are scaled to fit 2048x2048 and then to 768px on the shortest side
+MAX_LONG_SIDE = 2048
+MAX_SHORT_SIDE = 768
+JPEG_QUALITY = 85
+
+class PreparedImage:
+    def __init__(self, base64_data, mime_type, report, content_hash, phash=None):
+        self.base64_data = base64_data
+        self.mime_type = mime_type
+        self.report = report  # Per-stage timings (ms) and byte counts
+        self.content_hash = content_hash  # sha256 of the normalized image bytes
+        self.phash = phash  # 64-bit difference hash for near-duplicate matching, if Pillow is available
+
+def _target_size(width, height):
+    scale = min(1.0, MAX_LONG_SIDE / max(width, height), MAX_SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def difference_hash(image):
+    # dHash: compares neighbouring pixels of a 9x8 grayscale thumbnail, robust to re-encoding and rescaling
+    pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+def prepare_image(data):
+    report = {"bytes_in": len(data)}
+    started = time.perf_counter()
+
+    def lap(stage):
+        nonlocal started
+        now = time.perf_counter()
+        report[f"{stage}_ms"] = round((now - started) * 1000, 2)
+        started = now
+
+    if Image is None:
+        encoded = base64.b64encode(data).decode('utf-8')
+        lap("encode")
+        report["bytes_out"] = len(data)
+        return PreparedImage(encoded, "image/jpeg", report, hashlib.sha256(data).hexdigest())
+
+    image = Image.open(io.BytesIO(data))
+    report["size_in"] = f"{image.width}x{image.height}"
+    image.draft("RGB", _target_size(*image.size))  # JPEGs decode straight at a reduced scale when possible
+    image = ImageOps.exif_transpose(image)  # Apply the camera orientation before the EXIF data is dropped
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    lap("decode")
+
+    size = _target_size(image.width, image.height)
+    if size != image.size:
+        image = image.resize(size, Image.LANCZOS)
+    report["size_out"] = f"{image.width}x{image.height}"
+    lap("resize")
+
+    # A fresh save without exif/icc arguments writes no metadata
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    jpeg = buffer.getvalue()
+    encoded = base64.b64encode(jpeg).decode('utf-8')
+    lap("encode")
+
+    phash = difference_hash(image)
+    lap("hash")
+
+    report["bytes_out"] = len(jpeg)
+    return PreparedImage(encoded, "image/jpeg", report, hashlib.sha256(jpeg).hexdigest(), phash)
@@ -0,0 +1,180 @@
+# jobs.py:
+# Durable background job queue stored in the Job table, so slow OpenAI side work (title generation,
+# TTS pre-rendering, transcription) runs off the request path. Workers claim jobs with
+# SELECT ... FOR UPDATE SKIP LOCKED, so any number of threads and processes can share the queue.
+# Failed jobs are retried with exponential backoff; jobs left running by a crashed worker are
+# reclaimed once their lease expires. Clients poll /job_status for the result of their own jobs.
+# Payloads (which may hold base64 audio) are emptied when a job finishes, and finished jobs are
+# deleted after RETENTION.
+import os
+import json
+import time
+import socket
+import base64
+import threading
+from datetime import datetime, timedelta
+from .models import db, Job
+from . import openai_service, titles, tts_cache, metrics
+
+WORKER_COUNT = int(os.environ.get("JOB_WORKERS_HEALTHAPP", 2))
+POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL_HEALTHAPP", 0.5))
+LEASE = timedelta(minutes=5)  # A running job not updated for this long is assumed abandoned
+RETENTION = timedelta(hours=int(os.environ.get("JOB_RETENTION_HOURS_HEALTHAPP", 24)))
+PRUNE_INTERVAL = 600  # Seconds between retention sweeps (per process)
+
+PRIORITY_HIGH = 10  # User is waiting on the result (e.g. transcription)
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10  # Speculative work (e.g. pre-rendering audio)
+
+_handlers = {}
+
+def handler(kind):
+    # Registers fn(payload) -> result for a job kind. Handlers run inside an app context.
+    def decorator(fn):
+        _handlers[kind] = fn
+        return fn
+    return decorator
+
+def enqueue(kind, payload, user_id=None, priority=PRIORITY_NORMAL, max_attempts=3):
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = Job(kind=kind, payload=json.dumps(payload), user_id=user_id, priority=priority, max_attempts=max_attempts)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+def get_status(job_id, user_id):
+    # None if the job does not exist or belongs to another user
+    try:
+        job = db.session.get(Job, int(job_id))
+    except (TypeError, ValueError):
+        return None
+    if not job or job.user_id is None or job.user_id != user_id:
+        return None
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+    }
+
+def claim(worker_id):
+    # Locks the next runnable job for this worker, or returns None
+    now = datetime.utcnow()
+    job = Job.query.filter(
+        db.or_(
+            db.and_(Job.status == 'queued', Job.run_after <= now),
+            db.and_(Job.status == 'running', Job.date_updated < now - LEASE),
+        )
+    ).order_by(Job.priority.desc(), Job.id).with_for_update(skip_locked=True).first()
+    if not job:
+        db.session.rollback()
+        return None
+    job.status = 'running'
+    job.locked_by = worker_id
+    job.attempts += 1
+    db.session.commit()
+    return job
+
+def _finish(job, result=None, error=None):
+    if error is None:
+        job.status = 'succeeded'
+        job.result = json.dumps(result)
+        job.error = None
+        job.payload = '{}'
+    elif job.attempts < job.max_attempts:
+        job.status = 'queued'
+        job.run_after = datetime.utcnow() + timedelta(seconds=2 ** job.attempts)
+        job.error = error
+    else:
+        job.status = 'failed'
+        job.error = error
+        job.payload = '{}'
+    job.locked_by = None
+    db.session.commit()
+
+def run_one(worker_id):
+    # Runs a single job if one is available; returns whether one was run
+    job = claim(worker_id)
+    if not job:
+        return False
+    try:
+        result = _handlers[job.kind](json.loads(job.payload))
+    except Exception as e:
+        db.session.rollback()
+        # The message is kept on the job row; the log only carries its type
+        metrics.log_event("job_failed", job_id=job.id, kind=job.kind, attempt=job.attempts, error=type(e).__name__)
+        _finish(job, error=str(e))
+    else:
+        _finish(job, result=result)
+    return True
+
+def prune():
+    # Deletes finished jobs older than RETENTION; returns how many
+    deleted = Job.query.filter(
+        Job.status.in_(('succeeded', 'failed')),
+        Job.date_updated < datetime.utcnow() - RETENTION
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+
+def _prune_due():
+    global _last_prune
+    with _prune_lock:
+        if time.time() - _last_prune < PRUNE_INTERVAL:
+            return False
+        _last_prune = time.time()
+        return True
+
+def _worker_loop(app, worker_id, stop_event):
+    while not stop_event.is_set():
+        with app.app_context():
+            try:
+                if _prune_due():
+                    prune()
+                ran = run_one(worker_id)
+            except Exception as e:
+                db.session.rollback()
+                metrics.log_event("job_worker_error", worker_id=worker_id, error=type(e).__name__, detail=str(e)[:200])
+                ran = False
+            finally:
+                db.session.remove()
+        if not ran:
+            stop_event.wait(POLL_INTERVAL)
+
+def start_workers(app, count=WORKER_COUNT):
+    # Starts count daemon worker threads; set the returned event to stop them
+    stop_event = threading.Event()
+    for i in range(count):
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{i}"
+        threading.Thread(target=_worker_loop, args=(app, worker_id, stop_event), name=f"job-worker-{i}", daemon=True).start()
+    return stop_event
+
+
+### Handlers ###
+
+@handler('generate_thread_title')
+def _generate_thread_title(payload):
+    language = titles.thread_language(payload['thread_id'])
+    title = openai_service.run_sync(titles.generate_title(payload['user_input'], language))
+    if not titles.save_thread_title(payload['thread_id'], title):
+        raise ValueError("Thread not found")
+    return {"title": title}
+
+@handler('tts_prerender')
+def _tts_prerender(payload):
+    filename = openai_service.run_sync(tts_cache.get_or_synthesize(payload['text'], payload['voice'], payload['speed']))
+    # Workers have no request to take the host from, so the enqueuing route passes its audio base URL
+    return {"audio_url": tts_cache.audio_url(filename, payload.get('audio_base_url'))}
+
+@handler('transcribe')
+def _transcribe(payload):
+    # Audio travels base64-encoded in the payload so the job survives restarts without a file on disk
+    started = time.perf_counter()
+    text = openai_service.run_sync(openai_service.transcribe((payload['filename'], base64.b64decode(payload['audio']))))
+    return {"transcript": text, "transcribe_ms": round((time.perf_counter() - started) * 1000, 2)}
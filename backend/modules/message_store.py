@@ -0,0 +1,108 @@
+# message_store.py:
+# Postgres copy of thread messages. Messages are written locally when they are sent and received,
+# so opening a thread is a single indexed query; OpenAI is only listed (with an after-cursor) for
+# threads whose local copy may be incomplete.
+from .models import db, ThreadMessage, ThreadMessageSync
+from .assistant_config import assistant_configs
+from . import openai_service
+
+# The initial greeting is posted to the thread as a user message but shown as the assistant's
+INITIAL_MESSAGES = {
+    config.get("initial_message")
+    for configs in assistant_configs.values()
+    for config in configs.values()
+}
+
+def _message_text(message):
+    for content in message.content or []:
+        if content.type == "text":
+            return content.text.value
+    return None
+
+def _get_state(thread_id):
+    return ThreadMessageSync.query.filter_by(thread_id=thread_id).first()
+
+def _store(thread_id, message, role, content=None):
+    content = content if content is not None else _message_text(message)
+    if content is None or ThreadMessage.query.filter_by(message_id=message.id).first():
+        return
+    db.session.add(ThreadMessage(
+        thread_id=thread_id,
+        message_id=message.id,
+        role=role,
+        content=content,
+        created_at=message.created_at
+    ))
+
+def start_thread(thread_id):
+    # A freshly created thread has no remote history, so it starts out in sync
+    db.session.add(ThreadMessageSync(thread_id=thread_id, in_sync=True))
+    db.session.commit()
+
+def record_initial_message(thread_id, message):
+    _store(thread_id, message, "assistant")
+    state = _get_state(thread_id)
+    if state and state.in_sync:
+        state.last_message_id = message.id
+    db.session.commit()
+
+def record_user_message(thread_id, message, content):
+    # Stores the user input and marks the thread as awaiting the assistant reply
+    _store(thread_id, message, "user", content)
+    state = _get_state(thread_id)
+    if state and state.in_sync:
+        state.last_message_id = message.id
+        state.in_sync = False
+    db.session.commit()
+
+def record_assistant_message(thread_id, message, reply_to):
+    # reply_to is the user message the run answered; the cursor only moves if nothing was missed before it
+    _store(thread_id, message, "assistant")
+    state = _get_state(thread_id)
+    if state and state.last_message_id == reply_to:
+        state.last_message_id = message.id
+        state.in_sync = True
+    db.session.commit()
+
+async def sync_thread_messages(thread_id, state=None):
+    # Pages through messages newer than the cursor (oldest first) and stores the ones we have not seen
+    if state is None:
+        state = ThreadMessageSync(thread_id=thread_id, in_sync=False)
+        db.session.add(state)
+
+    after = state.last_message_id
+    complete = True
+    while complete:
+        kwargs = {"order": "asc", "limit": 100}
+        if after:
+            kwargs["after"] = after
+        page = await openai_service.list_messages(thread_id, **kwargs)
+        for message in page.data:
+            if message.status == "in_progress":
+                # A run is still writing this reply; pick it up on the next sync
+                complete = False
+                break
+            text = _message_text(message)
+            role = "assistant" if message.role == "assistant" or text in INITIAL_MESSAGES else "user"
+            _store(thread_id, message, role, text)
+            after = message.id
+        if not page.has_more:
+            break
+
+    state.last_message_id = after
+    state.in_sync = complete
+    db.session.commit()
+
+async def get_messages(thread_id):
+    # Newest first, as the app expects
+    state = _get_state(thread_id)
+    if state is None or not state.in_sync:
+        await sync_thread_messages(thread_id, state)
+
+    messages = ThreadMessage.query.filter_by(thread_id=thread_id) \
+        .order_by(ThreadMessage.created_at.desc(), ThreadMessage.id.desc()).all()
+    return [{"text": message.content, "role": message.role} for message in messages]
+
+def delete_messages(thread_ids):
+    ThreadMessage.query.filter(ThreadMessage.thread_id.in_(thread_ids)).delete(synchronize_session=False)
+    ThreadMessageSync.query.filter(ThreadMessageSync.thread_id.in_(thread_ids)).delete(synchronize_session=False)
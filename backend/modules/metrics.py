@@ -0,0 +1,225 @@
+# metrics.py:
+# In-process instrumentation exported in the Prometheus text format at /metrics: latency
+# histograms per Flask route, per OpenAI operation and per DB statement, counters for run stream
+# events and errors, and gauges/counters collected from the caches and connection pools.
+# Each request also writes one structured (JSON) timing log line that breaks its time down into
+# OpenAI calls and DB queries, so a slow chat reply shows where it spent its time.
+# Metrics are per process; with several workers, scrape each one (or sum in Prometheus).
+import os
+import re
+import json
+import time
+import threading
+from contextlib import contextmanager
+from flask import Response, g, has_app_context, request
+
+PREFIX = "healthapp_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LOG_REQUESTS = os.environ.get("METRICS_LOG_REQUESTS_HEALTHAPP", "1") == "1"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN_HEALTHAPP")  # If set, /metrics requires it as a Bearer token
+
+_registry = []
+_collectors = []
+_lock = threading.Lock()
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = PREFIX + name
+        self.help = help_text
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with _lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.buckets = buckets
+        self._values = {}  # label key -> [bucket counts..., sum, count]
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            for key, entry in self._values.items():
+                for bound, count in zip(self.buckets, entry):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {entry[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {entry[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {entry[-1]}")
+        return lines
+
+http_request_seconds = Histogram("http_request_duration_seconds", "Flask request latency, including streamed bodies")
+http_requests = Counter("http_requests_total", "Flask requests by route and status")
+openai_seconds = Histogram("openai_request_duration_seconds", "Latency of OpenAI API operations")
+openai_errors = Counter("openai_errors_total", "Failed OpenAI API operations")
+openai_retries = Counter("openai_retries_total", "Retried OpenAI API calls (rate limited or transient errors)")
+run_events = Counter("openai_run_events_total", "Assistant run stream events by type")
+db_seconds = Histogram("db_query_duration_seconds", "Latency of SQL statements by verb and table")
+db_errors = Counter("db_errors_total", "Failed SQL statements")
+
+
+### Collected metrics (caches, pools) ###
+
+def register_collector(collect):
+    # collect() returns [(name, type, help, [(labels dict, value), ...]), ...]
+    _collectors.append(collect)
+
+def register_stats(name, stats, counters=()):
+    # Exports a module's stats() dict: keys in counters as counters, other numeric keys as gauges
+    def collect():
+        families = []
+        for key, value in stats().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            kind = "counter" if key in counters else "gauge"
+            metric = f"{name}_{key}_total" if kind == "counter" else f"{name}_{key}"
+            families.append((metric, kind, f"{name} {key}", [({}, value)]))
+        return families
+    register_collector(collect)
+
+def _render_collected():
+    lines = []
+    for collect in _collectors:
+        try:
+            families = collect()
+        except Exception as e:
+            print(f"Metrics collector failed: {e}")
+            continue
+        for name, kind, help_text, samples in families:
+            lines += [f"# HELP {PREFIX}{name} {help_text}", f"# TYPE {PREFIX}{name} {kind}"]
+            lines += [f"{PREFIX}{name}{_format_labels(_label_key(labels))} {value}" for labels, value in samples]
+    return lines
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    lines += _render_collected()
+    return "\n".join(lines) + "\n"
+
+
+### Per-request timing breakdown ###
+
+def _add_timing(kind, seconds):
+    if has_app_context() and 'timings' in g:
+        g.timings[f"{kind}_ms"] = g.timings.get(f"{kind}_ms", 0.0) + seconds * 1000
+        g.timings[f"{kind}_calls"] = g.timings.get(f"{kind}_calls", 0) + 1
+
+def log_event(event, **fields):
+    # One JSON line per event, for log search instead of free-form prints
+    print(json.dumps({"event": event, **fields}, default=str))
+
+@contextmanager
+def time_openai(operation):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        openai_errors.inc(operation=operation, error=type(e).__name__)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        openai_seconds.observe(elapsed, operation=operation)
+        _add_timing("openai", elapsed)
+
+_SQL_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+(?:NOT\s+)?EXISTS)?)\s+"?(\w+)', re.IGNORECASE)
+
+def _statement_label(statement):
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+    match = _SQL_TABLE.search(statement)
+    return verb, match.group(1) if match else ""
+
+def instrument_engine(engine_class):
+    # Times every statement on every engine (primary and replicas)
+    from sqlalchemy import event
+
+    @event.listens_for(engine_class, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine_class, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        verb, table = _statement_label(statement)
+        db_seconds.observe(elapsed, verb=verb, table=table)
+        _add_timing("db", elapsed)
+
+    @event.listens_for(engine_class, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get('query_started') if context.connection is not None else None
+        if started:
+            started.pop()
+        db_errors.inc(error=type(context.original_exception).__name__)
+
+def _record_request(route, method, status, started, timings):
+    elapsed = time.perf_counter() - started
+    http_request_seconds.observe(elapsed, route=route, method=method)
+    http_requests.inc(route=route, method=method, status=status)
+    if LOG_REQUESTS:
+        log_event("request", route=route, method=method, status=status, duration_ms=round(elapsed * 1000, 1),
+                  **{key: round(value, 1) if isinstance(value, float) else value for key, value in timings.items()})
+
+def init_app(app):
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        g.timings = {}
+
+    @app.after_request
+    def record_request(response):
+        # Recorded when the response is closed, i.e. after a streamed (SSE) body has been sent, so
+        # streamed replies are timed end to end. Also runs for requests rejected by auth.
+        if 'request_started' in g:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            args = (route, request.method, response.status_code, g.request_started, g.timings)
+            response.call_on_close(lambda: _record_request(*args))
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+            return Response("Forbidden\n", status=403, mimetype='text/plain')
+        return Response(render(), mimetype='text/plain; version=0.0.4')
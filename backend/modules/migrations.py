@@ -0,0 +1,110 @@
+# migrations.py:
+# Versioned schema migrations. Each file in backend/migrations is named NNNN_description.py and
+# defines upgrade(conn) and downgrade(conn). Applied versions are recorded in schema_migrations.
+# Migrations run in one transaction under a Postgres advisory lock, so concurrent workers cannot
+# apply the same migration twice.
+#
+# Usage (from backend/): python -m modules.migrations [status | upgrade [VERSION] | downgrade VERSION]
+# MIGRATIONS_DATABASE_URL_HEALTHAPP overrides the POSTGRES_*_HEALTHAPP connection settings.
+import os
+import re
+import sys
+import importlib.util
+from datetime import datetime
+from sqlalchemy import create_engine, text
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+ADVISORY_LOCK_KEY = 724190  # Arbitrary, shared by every process that runs migrations
+
+_FILENAME = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    def load(self):
+        spec = importlib.util.spec_from_file_location(f"migration_{self.version:04d}", self.path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+def discover():
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = _FILENAME.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return migrations
+
+def _prepare(conn):
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL, applied_at TIMESTAMP NOT NULL)"
+    ))
+
+def applied_versions(conn):
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+def upgrade(engine, target=None):
+    # Applies pending migrations up to target (default: latest); returns the versions applied
+    applied = []
+    with engine.begin() as conn:
+        _prepare(conn)
+        done = applied_versions(conn)
+        for migration in discover():
+            if migration.version in done or (target is not None and migration.version > target):
+                continue
+            print(f"Applying migration {migration.version:04d}_{migration.name}")
+            migration.load().upgrade(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                {"version": migration.version, "name": migration.name, "applied_at": datetime.utcnow()}
+            )
+            applied.append(migration.version)
+    return applied
+
+def downgrade(engine, target):
+    # Reverts applied migrations newer than target; returns the versions reverted
+    reverted = []
+    with engine.begin() as conn:
+        _prepare(conn)
+        done = applied_versions(conn)
+        for migration in reversed(discover()):
+            if migration.version not in done or migration.version <= target:
+                continue
+            print(f"Reverting migration {migration.version:04d}_{migration.name}")
+            migration.load().downgrade(conn)
+            conn.execute(text("DELETE FROM schema_migrations WHERE version = :version"), {"version": migration.version})
+            reverted.append(migration.version)
+    return reverted
+
+def status(engine):
+    with engine.begin() as conn:
+        _prepare(conn)
+        done = applied_versions(conn)
+    return [(migration.version, migration.name, migration.version in done) for migration in discover()]
+
+def main(argv):
+    from .database import database_uri
+    engine = create_engine(os.environ.get("MIGRATIONS_DATABASE_URL_HEALTHAPP") or database_uri())
+    command = argv[0] if argv else 'status'
+    if command == 'upgrade':
+        applied = upgrade(engine, int(argv[1]) if len(argv) > 1 else None)
+        print(f"Applied {len(applied)} migration(s)")
+    elif command == 'downgrade' and len(argv) > 1:
+        reverted = downgrade(engine, int(argv[1]))
+        print(f"Reverted {len(reverted)} migration(s)")
+    elif command == 'status':
+        for version, name, is_applied in status(engine):
+            print(f"{version:04d}_{name}: {'applied' if is_applied else 'pending'}")
+    else:
+        print("Usage: python -m modules.migrations [status | upgrade [VERSION] | downgrade VERSION]")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
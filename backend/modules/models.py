@@ -1,8 +1,15 @@
 # models.py
 from flask_sqlalchemy import SQLAlchemy
+from .database import RoutingSession, engine_options, primary_reads
+from . import metrics
 from datetime import datetime
+from collections import OrderedDict
+import os
+import json
+import time
+import threading
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession}, engine_options=engine_options())
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -18,15 +25,21 @@ class User(db.Model):
     autoplaybackaudio_setting = db.Column(db.Boolean, default=False)
 
 class UserThreads(db.Model):
+    __table_args__ = (db.Index('ix_user_threads_user_id_date_created', 'user_id', 'date_created'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    thread_id = db.Column(db.String(100))
+    thread_id = db.Column(db.String(100), index=True, unique=True)
     title = db.Column(db.String(255))
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
+    # Latest assistant run (modules/run_state.py)
+    active_run_id = db.Column(db.String(100))
+    run_status = db.Column(db.String(20))
+    run_started_at = db.Column(db.DateTime)
+    run_updated_at = db.Column(db.DateTime)
 
 class UserProfile(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True, unique=True)
     age = db.Column(db.Integer)
     height = db.Column(db.Integer)  # Store height in cm
     fitness_level = db.Column(db.Integer)
@@ -35,7 +48,250 @@ class UserProfile(db.Model):
     goals = db.Column(db.Text)  # Store as a comma-separated string for different goals
     height_unit = db.Column(db.String(10), default="cm")  # "cm" or "inches"
     
+class ThreadMessage(db.Model):
+    # Local copy of thread messages, written through on send/receive and synced incrementally from OpenAI
+    __table_args__ = (db.Index('ix_thread_message_thread_created', 'thread_id', 'created_at', 'id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    thread_id = db.Column(db.String(100), nullable=False)
+    message_id = db.Column(db.String(100), unique=True, nullable=False)  # OpenAI message id
+    role = db.Column(db.String(20), nullable=False)  # "user" or "assistant" as displayed in the app
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.Integer, nullable=False)  # Unix timestamp from OpenAI
+
+class ThreadMessageSync(db.Model):
+    # Sync cursor per thread: every message up to last_message_id is stored locally.
+    # in_sync is False while a reply is pending or a write-through may have been missed.
+    id = db.Column(db.Integer, primary_key=True)
+    thread_id = db.Column(db.String(100), unique=True, nullable=False)
+    last_message_id = db.Column(db.String(100))
+    in_sync = db.Column(db.Boolean, default=True, nullable=False)
+    date_synced = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ImageDescription(db.Model):
+    # Cached vision descriptions keyed by the hash of the normalized image bytes.
+    # The 64-bit perceptual hash is also split into four indexed 16-bit bands for near-duplicate lookups,
+    # which only match images of the same user (user_id).
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, index=True)
+    phash = db.Column(db.String(16))
+    phash_band0 = db.Column(db.Integer, index=True)
+    phash_band1 = db.Column(db.Integer, index=True)
+    phash_band2 = db.Column(db.Integer, index=True)
+    phash_band3 = db.Column(db.Integer, index=True)
+    description = db.Column(db.Text, nullable=False)
+    date_created = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class BotAssistant(db.Model):
+    # One OpenAI assistant per (bot, language), synced from assistant_configs at startup
+    __table_args__ = (db.UniqueConstraint('bot_id', 'language'),)
+    id = db.Column(db.Integer, primary_key=True)
+    bot_id = db.Column(db.Integer, nullable=False)
+    language = db.Column(db.String(5), nullable=False)
+    assistant_id = db.Column(db.String(100), nullable=False)
+    config_hash = db.Column(db.String(64), nullable=False)  # sha256 of the synced name + instructions
+    date_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Job(db.Model):
+    # Durable background job queue (see modules/jobs.py)
+    __table_args__ = (
+        db.Index('ix_job_claim', 'status', 'priority', 'run_after'),
+        db.Index('ix_job_status_date_updated', 'status', 'date_updated'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, index=True)  # Who enqueued it; only they can read its status
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON; emptied once the job has finished
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, succeeded, failed
+    priority = db.Column(db.Integer, default=0, nullable=False)  # Higher runs first
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=3, nullable=False)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_by = db.Column(db.String(100))
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    date_created = db.Column(db.DateTime, default=datetime.utcnow)
+    date_updated = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class IdempotencyKey(db.Model):
+    # Stored responses of chat submissions by client idempotency key (see modules/submissions.py)
+    __table_args__ = (db.UniqueConstraint('thread_id', 'key', name='uq_idempotency_key_thread_id_key'),)
+    id = db.Column(db.Integer, primary_key=True)
+    thread_id = db.Column(db.String(100), nullable=False)
+    key = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.String(20), nullable=False)  # "in_progress" or "completed"
+    response_status = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    date_created = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
 class Admin(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
-    password = db.Column(db.String(260), nullable=False)
\ No newline at end of file
+    password = db.Column(db.String(260), nullable=False)
+
+
+### Read-through cache for user settings and profiles ###
+# Rows are cached as plain dicts, so they can live in-process or in a Redis-compatible store.
+# Set CACHE_URL_HEALTHAPP=redis://host:port/db to share the cache between workers; any client with
+# Redis get/set/delete semantics works, including a local stand-in such as fakeredis.
+
+class TTLCache:
+    # Thread-safe in-process LRU cache whose entries also expire after ttl seconds
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + (ttl if ttl is not None else self.ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self._lock:
+            for key in [key for key, (value, _) in self._data.items() if predicate(key, value)]:
+                del self._data[key]
+
+class RedisCache:
+    # Stores JSON values in any Redis-compatible client
+    def __init__(self, client, ttl, prefix='healthapp:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(ttl if ttl is not None else self.ttl))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+class ReadThroughCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "errors": 0}
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def get(self, key, loader):
+        # Returns the cached value, or calls loader() and caches its result (None is not cached)
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            # A cache outage must not take the app down; fall through to the database
+            metrics.log_event("cache_failed", action="get", key=key, error=type(e).__name__)
+            self._count("errors")
+            value = None
+        if value is not None:
+            self._count("hits")
+            return value
+        self._count("misses")
+        value = loader()
+        if value is not None:
+            try:
+                self.backend.set(key, value)
+            except Exception as e:
+                metrics.log_event("cache_failed", action="set", key=key, error=type(e).__name__)
+                self._count("errors")
+        return value
+
+    def invalidate(self, *keys):
+        try:
+            self.backend.delete(*keys)
+            self._count("invalidations", len(keys))
+        except Exception as e:
+            metrics.log_event("cache_failed", action="invalidate", keys=list(keys), error=type(e).__name__)
+            self._count("errors")
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {**self._stats, "hit_rate": self._stats["hits"] / lookups if lookups else 0.0}
+
+CACHE_TTL = int(os.environ.get("CACHE_TTL_HEALTHAPP", 300))
+
+def make_cache_backend():
+    url = os.environ.get("CACHE_URL_HEALTHAPP")
+    if url:
+        import redis  # Only needed when a shared cache is configured
+        return RedisCache(redis.Redis.from_url(url), ttl=CACHE_TTL)
+    return TTLCache(maxsize=10000, ttl=CACHE_TTL)
+
+cache = ReadThroughCache(make_cache_backend())
+metrics.register_stats("user_cache", cache.stats, counters={"hits", "misses", "invalidations", "errors"})
+
+def _load_user(user_id):
+    with primary_reads():
+        user = db.session.get(User, user_id)
+    if not user:
+        return None
+    return {
+        "id": user.id,
+        "name": user.name,
+        "user_version": user.user_version,
+        "language": user.language,
+        "display_setting": user.display_setting,
+        "voice_setting": user.voice_setting,
+        "voice_speed_setting": user.voice_speed_setting,
+        "autoplaybackaudio_setting": user.autoplaybackaudio_setting,
+    }
+
+def _load_profile(user_id):
+    with primary_reads():
+        user_profile = UserProfile.query.filter_by(user_id=user_id).first()
+    if not user_profile:
+        return None
+    return {
+        "age": user_profile.age,
+        "height": user_profile.height,
+        "fitness_level": user_profile.fitness_level,
+        "dietary_restrictions": user_profile.dietary_restrictions or "None",
+        "health_conditions": user_profile.health_conditions or "None",
+        "goals": json.loads(user_profile.goals) if user_profile.goals else {},
+        "height_unit": user_profile.height_unit,
+    }
+
+def get_cached_user(user_id):
+    # User settings as a dict, or None if the user does not exist
+    if user_id is None:
+        return None
+    return cache.get(f"user:{user_id}", lambda: _load_user(user_id))
+
+def get_cached_profile(user_id):
+    # Profile with goals already parsed, or None if the user has no profile
+    if user_id is None:
+        return None
+    return cache.get(f"profile:{user_id}", lambda: _load_profile(user_id))
+
+def invalidate_cached_user(user_id):
+    cache.invalidate(f"user:{user_id}")
+
+def invalidate_cached_profile(user_id):
+    cache.invalidate(f"profile:{user_id}")
@@ -0,0 +1,266 @@
+# openai_service.py:
+# Async OpenAI I/O layer. One event loop thread per process owns a single AsyncOpenAI client
+# with a pooled keep-alive HTTP transport, so hundreds of in-flight runs share one worker
+# instead of each holding a blocking thread. Coroutines started on any other loop (Flask
+# async views, the SSE bridge) are hopped onto the service loop transparently.
+import os
+import time
+import asyncio
+import threading
+import httpx
+import openai
+from . import metrics, admission
+
+MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS_HEALTHAPP", 200))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENAI_MAX_KEEPALIVE_HEALTHAPP", 50))
+REQUEST_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT_HEALTHAPP", 120))
+BASE_URL = os.environ.get("OPENAI_BASE_URL_HEALTHAPP")  # e.g. the local fake API in benchmarks/fake_openai.py
+
+VISION_MODEL = "gpt-4-vision-preview"
+TTS_MODEL = "tts-1"
+TRANSCRIPTION_MODEL = "whisper-1"
+
+_loop = None
+_client = None
+_lock = threading.Lock()
+
+
+### Event loop and client ###
+
+def get_loop():
+    # Starts the service loop thread on first use
+    global _loop
+    if _loop is None:
+        with _lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="openai-service", daemon=True)
+                thread.start()
+                _loop = loop
+    return _loop
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                http_client = openai.DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=MAX_CONNECTIONS,
+                        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    ),
+                    timeout=REQUEST_TIMEOUT,
+                )
+                _client = openai.AsyncOpenAI(
+                    api_key=os.environ.get("OPENAI_API_KEY_HEALTHAPP"),
+                    base_url=BASE_URL,
+                    http_client=http_client,
+                    max_retries=0,  # Retried in _limited, where the limiter sees every 429
+                )
+    return _client
+
+async def _await(awaitable):
+    return await awaitable
+
+async def _dispatch(awaitable):
+    # Runs the awaitable on the service loop and awaits its result from the caller's loop
+    loop = get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        return await awaitable
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(_await(awaitable), loop))
+
+# Operations that may be repeated after a connection error or 5xx without creating duplicates
+RETRY_SAFE = {
+    "threads.messages.list", "threads.runs.list", "threads.runs.cancel", "assistants.retrieve",
+    "chat.completions", "chat.completions.vision", "chat.completions.title",
+    "audio.speech.create", "audio.transcriptions.create",
+}
+
+def _retry_after(e):
+    try:
+        return float(e.response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+async def _limited(operation, make_call):
+    # Runs on the service loop: one call under the operation's adaptive concurrency limit, retried
+    # with jittered backoff on upstream 429s (and transient errors if the operation is retry safe)
+    limiter = admission.limiter(operation)
+    attempt = 0
+    while True:
+        await limiter.acquire()
+        started = time.perf_counter()
+        try:
+            result = await make_call()
+        except openai.RateLimitError as e:
+            limiter.release(time.perf_counter() - started, congested=True)
+            if attempt >= admission.MAX_RETRIES:
+                raise admission.Overloaded(f"OpenAI rate limit for {operation}", retry_after=_retry_after(e) or admission.SHED_RETRY_AFTER)
+            delay = admission.backoff(attempt, _retry_after(e))
+        except (openai.APIConnectionError, openai.InternalServerError) as e:
+            limiter.release(time.perf_counter() - started, congested=True)
+            if operation not in RETRY_SAFE or attempt >= admission.MAX_RETRIES:
+                raise
+            delay = admission.backoff(attempt, _retry_after(e))
+        except BaseException:
+            limiter.release(time.perf_counter() - started)
+            raise
+        else:
+            limiter.release(time.perf_counter() - started)
+            return result
+        metrics.openai_retries.inc(operation=operation)
+        attempt += 1
+        await asyncio.sleep(delay)
+
+async def _call(operation, make_call):
+    # Runs make_call() (which returns the SDK coroutine, created anew for each retry) on the service
+    # loop under admission control, timed as one OpenAI operation (latency histogram, error counter,
+    # request log). Queueing and retries count towards its latency.
+    with metrics.time_openai(operation):
+        return await _dispatch(_limited(operation, make_call))
+
+def run_sync(coro):
+    # Runs a coroutine to completion from synchronous code (e.g. a plain Flask view)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+def iterate(agen):
+    # Drives an async generator from synchronous code, one item at a time (used for SSE responses)
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.close()
+
+
+### Threads, messages and runs ###
+
+async def create_thread():
+    return await _call("threads.create", lambda: get_client().beta.threads.create())
+
+async def create_message(thread_id, content, role="user"):
+    return await _call("threads.messages.create", lambda: get_client().beta.threads.messages.create(
+        thread_id=thread_id,
+        role=role,
+        content=content
+    ))
+
+async def list_messages(thread_id, **kwargs):
+    return await _call("threads.messages.list", lambda: get_client().beta.threads.messages.list(thread_id=thread_id, **kwargs))
+
+async def list_runs(thread_id):
+    return await _call("threads.runs.list", lambda: get_client().beta.threads.runs.list(thread_id=thread_id))
+
+async def cancel_run(thread_id, run_id):
+    return await _call("threads.runs.cancel", lambda: get_client().beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id))
+
+async def retrieve_assistant(assistant_id):
+    return await _call("assistants.retrieve", lambda: get_client().beta.assistants.retrieve(assistant_id))
+
+async def create_assistant(**kwargs):
+    return await _call("assistants.create", lambda: get_client().beta.assistants.create(**kwargs))
+
+async def update_assistant(assistant_id, **kwargs):
+    return await _call("assistants.update", lambda: get_client().beta.assistants.update(assistant_id=assistant_id, **kwargs))
+
+async def _open_run_events(thread_id, assistant_id):
+    stream = await get_client().beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+        stream=True
+    )
+    async with stream:
+        async for event in stream:
+            yield event
+
+async def _start_run(thread_id, assistant_id):
+    # Creates the run and waits for its first event; returns (events, first event or None)
+    agen = _open_run_events(thread_id, assistant_id)
+    try:
+        return agen, await agen.__anext__()
+    except StopAsyncIteration:
+        return agen, None
+    except BaseException:
+        await agen.aclose()
+        raise
+
+async def stream_run(thread_id, assistant_id):
+    # Yields the run's stream events (message deltas, status changes) as they arrive. Timed as
+    # threads.runs.stream.first_event (time to first event) and threads.runs.stream (whole run).
+    # Run starts go through admission control (a 429 on create is retried before anything is
+    # yielded); the rest of the stream is not limited.
+    agen = None
+    try:
+        with metrics.time_openai("threads.runs.stream"):
+            agen, event = await _call("threads.runs.stream.first_event", lambda: _start_run(thread_id, assistant_id))
+            while event is not None:
+                metrics.run_events.inc(event=event.event)
+                yield event
+                try:
+                    event = await _dispatch(agen.__anext__())
+                except StopAsyncIteration:
+                    return
+    finally:
+        if agen is not None:
+            await _dispatch(agen.aclose())
+
+
+### Chat completions and vision ###
+
+async def complete_chat(messages, model="gpt-4", operation="chat.completions", **kwargs):
+    response = await _call(operation, lambda: get_client().chat.completions.create(
+        model=model,
+        messages=messages,
+        **kwargs
+    ))
+    return response.choices[0].message.content
+
+async def describe_image(base64_image, prompt="Describe this image very briefly.", mime_type="image/jpeg"):
+    return await complete_chat(
+        model=VISION_MODEL,
+        operation="chat.completions.vision",
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}}
+                ]
+            }
+        ],
+        max_tokens=300
+    )
+
+
+### Audio ###
+
+async def synthesize_speech(text, voice, speed, model=TTS_MODEL):
+    # Returns the synthesized mp3 as bytes
+    response = await _call("audio.speech.create", lambda: get_client().audio.speech.create(
+        model=model,
+        voice=voice,
+        input=text,
+        speed=speed
+    ))
+    return response.content
+
+async def transcribe(file, model=TRANSCRIPTION_MODEL):
+    # file is anything the SDK accepts: a file object or a (filename, bytes) tuple
+    def make_call():
+        if hasattr(file, 'seek'):
+            file.seek(0)  # A retry has to upload the file from the start again
+        return get_client().audio.transcriptions.create(model=model, file=file)
+    transcript = await _call("audio.transcriptions.create", make_call)
+    return transcript.text
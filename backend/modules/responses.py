@@ -0,0 +1,131 @@
+# responses.py:
+# Response layer: a faster JSON provider for jsonify (orjson when installed, otherwise Flask's
+# stdlib encoder), streaming of large JSON lists, and gzip/brotli compression negotiated from
+# Accept-Encoding for compressible responses above a size threshold. Audio, files and SSE streams
+# are left alone.
+import os
+import json
+import zlib
+from flask import Response, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES_HEALTHAPP", 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # About as fast as gzip level 6, and smaller
+STREAM_MIN_ITEMS = 200  # Lists at least this long are streamed rather than serialized in one piece
+STREAM_BATCH = 100  # Items per streamed chunk
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/plain', 'text/html', 'text/css', 'application/javascript'}
+
+if orjson is not None:
+    # Datetimes go through Flask's default (HTTP date format), as with the stdlib encoder
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+def dumps_bytes(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=DefaultJSONProvider.default, option=ORJSON_OPTIONS)
+    return json.dumps(obj, default=DefaultJSONProvider.default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+class FastJSONProvider(DefaultJSONProvider):
+    # Keys keep insertion order instead of being sorted, so output (and ETags) stay deterministic
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
+
+def json_list_response(key, items, extra=None):
+    # {key: items, **extra}; long lists are streamed in chunks so the whole body is never held as
+    # one string
+    extra = extra or {}
+    if len(items) < STREAM_MIN_ITEMS:
+        return jsonify({key: items, **extra})
+
+    def generate():
+        yield b'{' + dumps_bytes(key) + b':['
+        for start in range(0, len(items), STREAM_BATCH):
+            chunk = b','.join(dumps_bytes(item) for item in items[start:start + STREAM_BATCH])
+            yield (b',' + chunk) if start else chunk
+        yield b']'
+        for name, value in extra.items():
+            yield b',' + dumps_bytes(name) + b':' + dumps_bytes(value)
+        yield b'}'
+
+    return Response(generate(), mimetype='application/json')
+
+def _choose_encoding():
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def _compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+    try:
+        for chunk in chunks:
+            out = process(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            if out:
+                yield out
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def compress_response(response):
+    if (response.status_code < 200 or response.status_code in (204, 304) or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding()
+    if not encoding:
+        return response
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # The ETag was computed over the uncompressed body; it still identifies the content, but only weakly
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def init_app(app):
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
@@ -0,0 +1,76 @@
+# run_state.py:
+# Run state machine per thread, persisted on UserThreads (active_run_id, run_status,
+# run_started_at, run_updated_at). The run stream updates it as runs start and finish, so before a
+# new message only the known active run is cancelled, and threads without one cost no OpenAI call.
+# The runs.list call is kept for reconciliation when the state looks stale (e.g. a worker died
+# mid-run, so the final status was never recorded) or a targeted cancel fails.
+#
+#   (none) --run created--> queued/in_progress --completed/failed/cancelled/expired/incomplete--> terminal
+#                                      \--requires_action (run stays open upstream, cancelled next time)
+import os
+import openai
+from datetime import datetime, timedelta
+from .models import db, UserThreads
+from . import openai_service, metrics
+
+ACTIVE_STATUSES = {"queued", "in_progress", "requires_action", "cancelling"}
+TERMINAL_STATUSES = {"completed", "failed", "cancelled", "expired", "incomplete"}
+STALE_AFTER = timedelta(seconds=int(os.environ.get("RUN_STALE_SECONDS_HEALTHAPP", 600)))
+
+def _thread(thread_id):
+    return UserThreads.query.filter_by(thread_id=thread_id).first()
+
+def run_started(thread_id, run_id, status="queued"):
+    session = _thread(thread_id)
+    if session:
+        now = datetime.utcnow()
+        session.active_run_id = run_id
+        session.run_status = status
+        session.run_started_at = now
+        session.run_updated_at = now
+        db.session.commit()
+
+def run_updated(thread_id, run_id, status):
+    # Ignores updates for a run that is no longer the thread's active one
+    session = _thread(thread_id)
+    if session and session.active_run_id == run_id:
+        session.run_status = status
+        session.run_updated_at = datetime.utcnow()
+        if status in TERMINAL_STATUSES:
+            session.active_run_id = None
+        db.session.commit()
+
+def has_active_run(session):
+    return bool(session.active_run_id) and session.run_status in ACTIVE_STATUSES
+
+def is_stale(session):
+    return session.run_updated_at is None or datetime.utcnow() - session.run_updated_at > STALE_AFTER
+
+async def reconcile(thread_id):
+    # The old list-and-cancel: cancels every open run in the thread's history
+    runs = await openai_service.list_runs(thread_id)
+    for run in runs.data:
+        if run.status in ACTIVE_STATUSES - {"cancelling"}:
+            try:
+                await openai_service.cancel_run(thread_id, run.id)
+            except openai.OpenAIError as e:
+                metrics.log_event("run_cancel_failed", thread_id=thread_id, run_id=run.id, error=type(e).__name__)
+
+async def cancel_active_run(session):
+    # Makes sure the thread has no open run before a new message is added
+    if not has_active_run(session):
+        return
+    thread_id, run_id = session.thread_id, session.active_run_id
+    if is_stale(session):
+        metrics.log_event("run_state_stale", thread_id=thread_id, run_id=run_id, run_status=session.run_status)
+        await reconcile(thread_id)
+    else:
+        try:
+            await openai_service.cancel_run(thread_id, run_id)
+        except openai.BadRequestError:
+            # Usually the run already finished upstream; nothing to cancel
+            pass
+        except openai.OpenAIError as e:
+            metrics.log_event("run_cancel_failed", thread_id=thread_id, run_id=run_id, error=type(e).__name__, reconciling=True)
+            await reconcile(thread_id)
+    run_updated(thread_id, run_id, "cancelled")
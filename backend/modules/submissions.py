@@ -0,0 +1,202 @@
+# submissions.py:
+# Serialization and deduplication of chat submissions (/thread_continue and its stream and image
+# variants). Mobile retries and double taps used to cancel each other's runs and start new paid
+# ones.
+# - ThreadLock: one submission per thread at a time, across worker processes. On Postgres it is a
+#   session advisory lock held for the length of the run on a connection of its own, opened through
+#   an unpooled engine so long runs never hold connections of the app's pool; elsewhere (SQLite in
+#   development) it falls back to in-process striped locks.
+# - Idempotency keys: a submission carrying an Idempotency-Key header (or idempotency_key field)
+#   is recorded per thread. A repeat with the same key waits for the first to finish and gets its
+#   stored response instead of creating new work. Keys expire after IDEMPOTENCY_TTL. A key still in
+#   progress after LOCK_TIMEOUT belongs to a worker that died mid-run; the next repeat takes it over
+#   and does the work again.
+# Replays and submissions rejected because the thread is busy get their rate-limit tokens back.
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from flask import current_app, request
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+from sqlalchemy.exc import IntegrityError
+from .models import db, IdempotencyKey
+from .database import primary_reads
+from . import admission
+
+LOCK_TIMEOUT = float(os.environ.get("THREAD_LOCK_TIMEOUT_HEALTHAPP", 90))  # Seconds to wait for the thread
+IDEMPOTENCY_TTL = timedelta(hours=24)
+POLL_INTERVAL = 0.25
+LOCK_NAMESPACE = 22  # First key of the two-key advisory lock form; the second is the thread hash
+LOCAL_STRIPES = 256
+
+_local_locks = [threading.Lock() for _ in range(LOCAL_STRIPES)]
+_lock_engines = {}  # Primary URL -> unpooled engine for advisory lock connections
+_lock_engines_lock = threading.Lock()
+
+def _lock_engine():
+    url = db.engine.url
+    with _lock_engines_lock:
+        engine = _lock_engines.get(url)
+        if engine is None:
+            engine = _lock_engines[url] = create_engine(url, poolclass=NullPool)
+    return engine
+
+def _thread_hash(thread_id):
+    # Signed 32-bit, as pg_try_advisory_lock(int, int) expects
+    return int.from_bytes(hashlib.sha256(thread_id.encode('utf-8')).digest()[:4], 'big', signed=True)
+
+
+### Per-thread lock ###
+
+class ThreadLock:
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.key = _thread_hash(thread_id)
+        self._conn = None
+        self._local = None
+
+    def _try_acquire(self):
+        if db.engine.dialect.name == 'postgresql':
+            if self._conn is None:
+                self._conn = _lock_engine().connect()
+            acquired = self._conn.execute(
+                text("SELECT pg_try_advisory_lock(:namespace, :key)"),
+                {"namespace": LOCK_NAMESPACE, "key": self.key}
+            ).scalar()
+            self._conn.commit()
+            return acquired
+        self._local = _local_locks[self.key % LOCAL_STRIPES]
+        return self._local.acquire(blocking=False)
+
+    async def acquire(self, timeout=LOCK_TIMEOUT):
+        # Returns False if the thread is still busy after timeout seconds
+        deadline = time.monotonic() + timeout
+        while not self._try_acquire():
+            if time.monotonic() >= deadline:
+                self._close()
+                return False
+            await asyncio.sleep(POLL_INTERVAL)
+        return True
+
+    def release(self):
+        if self._conn is not None:
+            try:
+                self._conn.execute(
+                    text("SELECT pg_advisory_unlock(:namespace, :key)"),
+                    {"namespace": LOCK_NAMESPACE, "key": self.key}
+                )
+                self._conn.commit()
+            finally:
+                self._close()
+        elif self._local is not None:
+            self._local.release()
+            self._local = None
+
+    def _close(self):
+        # Closing the connection also drops a session advisory lock still held on it
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+### Idempotency keys ###
+
+def request_key():
+    key = request.headers.get('Idempotency-Key')
+    if not key:
+        body = request.get_json(silent=True) if request.is_json else request.form
+        key = (body or {}).get('idempotency_key')
+    return key[:100] if key else None
+
+def _stale_before():
+    return datetime.utcnow() - timedelta(seconds=LOCK_TIMEOUT)
+
+def claim(thread_id, key):
+    # Records the key as in progress; returns False if it was already there (a repeat)
+    IdempotencyKey.query.filter(IdempotencyKey.date_created < datetime.utcnow() - IDEMPOTENCY_TTL).delete()
+    db.session.add(IdempotencyKey(thread_id=thread_id, key=key, status="in_progress"))
+    try:
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+    # Take over an abandoned entry; the conditional update lets only one repeat win
+    taken = IdempotencyKey.query.filter(
+        IdempotencyKey.thread_id == thread_id,
+        IdempotencyKey.key == key,
+        IdempotencyKey.status == "in_progress",
+        IdempotencyKey.date_created < _stale_before()
+    ).update({"date_created": datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return taken == 1
+
+def complete(thread_id, key, body, status):
+    entry = IdempotencyKey.query.filter_by(thread_id=thread_id, key=key).first()
+    if entry:
+        entry.status = "completed"
+        entry.response_status = status
+        entry.response_body = body
+        db.session.commit()
+
+def abandon(thread_id, key):
+    # The first attempt failed without a response worth replaying; let a retry do the work again
+    IdempotencyKey.query.filter_by(thread_id=thread_id, key=key, status="in_progress").delete()
+    db.session.commit()
+
+async def wait_for(thread_id, key, timeout=LOCK_TIMEOUT):
+    # Returns the completed entry for a repeated key, or None if it is still in progress after
+    # timeout seconds, was abandoned, or went stale (its worker died; claim() can take it over)
+    deadline = time.monotonic() + timeout
+    while True:
+        db.session.rollback()  # End the transaction so each poll sees the latest commit
+        with primary_reads():
+            entry = IdempotencyKey.query.filter_by(thread_id=thread_id, key=key).first()
+        if (entry is None or entry.status == "completed" or entry.date_created < _stale_before()
+                or time.monotonic() >= deadline):
+            return entry if entry is not None and entry.status == "completed" else None
+        await asyncio.sleep(POLL_INTERVAL)
+
+async def run_once(thread_id, key, work):
+    # Runs work() (an async view body) while holding the thread's lock, at most once per
+    # idempotency key. Returns a Flask response.
+    if key and not claim(thread_id, key):
+        entry = await wait_for(thread_id, key)
+        if entry is not None:
+            admission.refund()
+            return current_app.response_class(entry.response_body, status=entry.response_status, mimetype='application/json')
+        if not claim(thread_id, key):  # Abandoned or stale entries can be claimed again
+            admission.refund()
+            return current_app.make_response(({"error": "A request with this idempotency key is still in progress"}, 409))
+
+    lock = ThreadLock(thread_id)
+    if not await lock.acquire():
+        admission.refund()
+        if key:
+            abandon(thread_id, key)
+        return current_app.make_response(({"error": "Another message is still being processed for this thread"}, 409))
+    try:
+        response = current_app.make_response(await work())
+    except Exception:
+        if key:
+            abandon(thread_id, key)
+        raise
+    finally:
+        lock.release()
+
+    if key:
+        if replayable(response):
+            complete(thread_id, key, response.get_data(as_text=True), response.status_code)
+        else:
+            abandon(thread_id, key)
+    return response
+
+def replayable(response):
+    # Only successful replies are stored; after an error (including a run that did not complete,
+    # which is reported with a 200) a retry with the same key does the work again
+    if response.status_code != 200 or not response.is_json:
+        return False
+    body = response.get_json(silent=True)
+    return isinstance(body, dict) and "error" not in body
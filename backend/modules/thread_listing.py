@@ -0,0 +1,68 @@
+# thread_listing.py:
+# Keyset pagination for a user's threads, newest first. The cursor encodes the (date_created, id) of
+# the last row on a page, so every page is one bounded range scan on the (user_id, date_created)
+# index however many threads the user has. Pages carry an ETag over their content; a client that
+# sends it back in If-None-Match gets an empty 304 when the page has not changed.
+import json
+import base64
+from datetime import datetime
+from flask import request, jsonify
+from .models import db, UserThreads
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(thread):
+    payload = json.dumps([thread.date_created.isoformat(), thread.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date_created, thread_row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(date_created), int(thread_row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+def page_size(value):
+    try:
+        return max(1, min(MAX_PAGE_SIZE, int(value)))
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+
+def page_user_threads(user_id, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    # Returns (threads, next_cursor); next_cursor is None on the last page
+    query = UserThreads.query.filter(UserThreads.user_id == user_id)
+    if cursor:
+        date_created, thread_row_id = decode_cursor(cursor)
+        query = query.filter(db.tuple_(UserThreads.date_created, UserThreads.id) < (date_created, thread_row_id))
+    threads = query.order_by(UserThreads.date_created.desc(), UserThreads.id.desc()).limit(limit + 1).all()
+    if len(threads) > limit:
+        threads = threads[:limit]
+        return threads, encode_cursor(threads[-1])
+    return threads, None
+
+def listing_params(params=None):
+    # Listing routes accept their parameters as a JSON body (POST) or a query string (GET)
+    if params is None:
+        params = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+    return params.get('user_id'), params.get('cursor') or None, page_size(params.get('limit', DEFAULT_PAGE_SIZE))
+
+def conditional_json(payload, headers=None):
+    # jsonify with an ETag; answers 304 Not Modified when the client already has this payload
+    response = jsonify(payload)
+    for name, value in (headers or {}).items():
+        if value is not None:
+            response.headers[name] = value
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    etag, _ = response.get_etag()
+    # contains_weak: compressed responses carry the weak form of the ETag (see responses.py)
+    if request.if_none_match.contains_weak(etag):
+        response.status_code = 304
+        response.set_data(b'')
+        response.headers.pop('Content-Length', None)
+    return response
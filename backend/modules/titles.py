@@ -0,0 +1,148 @@
+# titles.py:
+# Thread title generation from the first user message. A local keyphrase extractor (RAKE-style,
+# with English and Danish stopwords) produces the title in microseconds; GPT-4 is only asked when
+# the local title scores as low quality, e.g. for greetings or very short messages.
+import re
+from .models import db, UserThreads, get_cached_user
+from .database import primary_reads
+from . import openai_service, metrics
+
+MAX_TITLE_LENGTH = 255  # UserThreads.title column size
+MAX_TITLE_WORDS = 5
+MAX_PHRASES = 2
+MIN_QUALITY = 0.5  # Local titles scoring below this fall back to the LLM
+
+STOPWORDS = {
+    "en": frozenset("""
+        a about above after again against all also am an and any are as at be because been before being below
+        between both but by can cannot could did do does doing down during each either few for from further get
+        gets getting give got had has have having he her here hers herself him himself his how however i if in
+        into is it its itself just let me more most much must my myself no nor not now of off often on once only
+        or other ought our ours ourselves out over own same she should so some such than that the their theirs
+        them themselves then there these they this those through to too under until up upon us very was we were
+        what when where whether which while who whom why will with within without would you your yours yourself
+        yourselves im ive id dont doesnt cant wont isnt arent whats hows thats theres lets
+        hi hello hey thanks thank please help want wanted need needs know tell explain give recommend suggest
+        advice tips question questions wondering think like really best good better way ways thing things something
+        anything lot bit kind sort maybe currently recently day days week weeks time make makes making
+        many every take takes taking feel feeling
+    """.split()),
+    "dk": frozenset("""
+        og i jeg det at en den til er som på de med han af for ikke der var mig sig men et har om vi min havde
+        ham hun nu over da fra du ud sin dem os op man hans hvor eller hvad skal selv her alle vil blev kunne ind
+        når være dog noget ville jo deres efter ned skulle denne end dette mit også under have dig anden hende
+        mine alt meget sit sine vor mod disse hvis din dit nogle hos blive mange ad bliver hendes været jer sådan
+        hvordan hvorfor hvilke hvilken kan bør godt bedre gerne lidt mere mest få fordi så bare helt lige
+        hej hejsa tak venligst hjælp hjælpe vil vide fortælle forklare anbefale anbefaler råd tips spørgsmål spørge tænker
+        gør gøre får ting noget nogen måde måder bedst bedste god gode dag dage uge uger tid
+    """.split()),
+}
+
+_WORD = re.compile(r"[^\W_]+(?:[-'][^\W_]+)*", re.UNICODE)
+_PHRASE_BREAK = re.compile(r"[.,;:!?()\[\]\"“”\n]+")
+
+def _phrases(text, stopwords):
+    # Splits text into candidate keyphrases: runs of non-stopwords between punctuation and stopwords
+    phrases = []
+    for chunk in _PHRASE_BREAK.split(text):
+        current = []
+        for word in _WORD.findall(chunk):
+            if word.lower().replace("'", "") in stopwords:
+                if current:
+                    phrases.append(current)
+                current = []
+            else:
+                current.append(word)
+        if current:
+            phrases.append(current)
+    return phrases
+
+def _capitalize(phrase, language):
+    words = [word if word.isupper() else word.lower() for word in phrase]
+    if language == "en":
+        return " ".join(word[:1].upper() + word[1:] for word in words)
+    return " ".join(words)
+
+def local_title(user_input, language="en"):
+    # Returns (title, quality) where quality is in [0, 1]
+    stopwords = STOPWORDS.get(language, STOPWORDS["en"])
+    phrases = _phrases(user_input or "", stopwords)
+    if not phrases:
+        return "", 0.0
+
+    # RAKE word score: degree / frequency, which favours words that appear in longer phrases
+    frequency = {}
+    degree = {}
+    for phrase in phrases:
+        for word in phrase:
+            key = word.lower()
+            frequency[key] = frequency.get(key, 0) + 1
+            degree[key] = degree.get(key, 0) + len(phrase)
+
+    scored = []
+    for position, phrase in enumerate(phrases):
+        phrase = phrase[:MAX_TITLE_WORDS]
+        # Longer words break ties between equally scored phrases ("knæet" over "ondt")
+        score = sum(degree[word.lower()] / frequency[word.lower()] + len(word) / 100 for word in phrase)
+        scored.append((score, position, phrase))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+
+    chosen = []
+    words = 0
+    for score, position, phrase in scored:
+        if len(chosen) == MAX_PHRASES or words + len(phrase) > MAX_TITLE_WORDS:
+            break
+        chosen.append((position, phrase))
+        words += len(phrase)
+    chosen.sort()
+
+    title = " & ".join(_capitalize(phrase, language) for _, phrase in chosen)
+    if language != "en":
+        title = title[:1].upper() + title[1:]
+
+    # Quality: enough content words, mostly real words (not numbers or fragments), and a compact title
+    content_words = [word for _, phrase in chosen for word in phrase]
+    substantial = sum(1 for word in content_words if len(word) >= 4 and not word[0].isdigit())
+    quality = min(1.0, substantial / 2) * (1.0 if words >= 2 else 0.6)
+    return title[:MAX_TITLE_LENGTH], round(quality, 2)
+
+def thread_language(thread_id):
+    user_thread = UserThreads.query.filter_by(thread_id=thread_id).first()
+    user = get_cached_user(user_thread.user_id) if user_thread else None
+    return user["language"] if user else "en"
+
+async def generate_title(user_input, language="en"):
+    # Local fast path first; the LLM is only a fallback for low quality local titles
+    title, quality = local_title(user_input, language)
+    if quality >= MIN_QUALITY:
+        metrics.log_event("thread_title", source="local", quality=quality)
+        return title
+    return await generate_llm_title(user_input)
+
+async def generate_llm_title(user_input):
+    prompt = f"Generate a very short/concise thread title (for out Health AI chatbot app) based on the following user input: {user_input}"
+
+    # Call OpenAI API to generate a title based on user input
+    title = await openai_service.complete_chat(
+        model="gpt-4",
+        operation="chat.completions.title",
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=150,
+        temperature=0.7
+    )
+    title = title.strip().strip('"')
+
+    # Truncate the title if it exceeds 255 characters
+    title = title[:MAX_TITLE_LENGTH]
+    metrics.log_event("thread_title", source="llm")
+    return title
+
+def save_thread_title(thread_id, title):
+    # Returns False if the thread does not exist
+    with primary_reads():
+        user_thread = UserThreads.query.filter_by(thread_id=thread_id).first()
+    if not user_thread:
+        return False
+    user_thread.title = title
+    db.session.commit()
+    return True
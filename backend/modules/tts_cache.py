@@ -0,0 +1,51 @@
+# tts_cache.py:
+# Content-addressed cache for synthesized speech. Files are named after a hash of
+# (text, voice, speed, model), so replaying an answer or an assistant initial message is served
+# from disk without calling the TTS API. The files live in audio_storage, whose background sweeper
+# expires unused files and keeps the store within its byte budget.
+import hashlib
+import threading
+from . import openai_service, metrics, audio_storage
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+def cache_key(text, voice, speed, model):
+    payload = "\x1f".join([model, voice, f"{float(speed):.2f}", text])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def filename_for(key):
+    return f"speech_{key}.mp3"
+
+def get(key):
+    # Returns the cached filename, or None on a miss
+    name = filename_for(key)
+    hit = audio_storage.touch(name) is not None
+    with _lock:
+        _stats["hits" if hit else "misses"] += 1
+    return name if hit else None
+
+def put(key, audio):
+    # Writes the audio atomically and returns its filename
+    name = filename_for(key)
+    audio_storage.write(name, audio)
+    return name
+
+def audio_url(filename, base=None):
+    return audio_storage.url(filename, base)
+
+async def get_or_synthesize(text, voice, speed):
+    # Returns the filename of the speech audio, calling the TTS API only on a cache miss
+    key = cache_key(text, voice, speed, openai_service.TTS_MODEL)
+    filename = get(key)
+    if not filename:
+        audio = await openai_service.synthesize_speech(text, voice, speed)
+        filename = put(key, audio)
+    return filename
+
+def stats():
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {**_stats, "hit_rate": _stats["hits"] / lookups if lookups else 0.0}
+
+metrics.register_stats("tts_cache", stats, counters={"hits", "misses"})
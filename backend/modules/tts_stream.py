@@ -0,0 +1,61 @@
+# tts_stream.py:
+# Sentence-pipelined speech synthesis. The reply is split into sentences which are synthesized
+# concurrently (bounded) and yielded in order, so playback can start as soon as the first
+# sentence is ready instead of after the whole reply. MP3 frames concatenate cleanly, so the
+# chunks can be streamed back to back as one audio/mpeg response.
+import os
+import re
+import asyncio
+from . import openai_service, tts_cache, audio_storage
+
+MAX_PARALLEL = int(os.environ.get("TTS_STREAM_PARALLEL_HEALTHAPP", 3))
+MIN_SENTENCE_LENGTH = 40  # Shorter fragments are merged into the next one to avoid tiny requests
+
+_SENTENCE_END = re.compile(r'(?<=[.!?…])\s+|\n+')
+
+def split_sentences(text):
+    sentences = []
+    pending = ""
+    for part in _SENTENCE_END.split(text.strip()):
+        part = part.strip()
+        if not part:
+            continue
+        pending = f"{pending} {part}" if pending else part
+        if len(pending) >= MIN_SENTENCE_LENGTH:
+            sentences.append(pending)
+            pending = ""
+    if pending:
+        sentences.append(pending)
+    return sentences
+
+async def _render(sentence, voice, speed, semaphore):
+    key = tts_cache.cache_key(sentence, voice, speed, openai_service.TTS_MODEL)
+    filename = tts_cache.get(key)
+    if filename:
+        try:
+            return audio_storage.read(filename)
+        except FileNotFoundError:
+            pass  # Swept since the lookup; synthesize it again
+    async with semaphore:
+        audio = await openai_service.synthesize_speech(sentence, voice, speed)
+    tts_cache.put(key, audio)
+    return audio
+
+async def stream_speech(text, voice, speed, max_parallel=MAX_PARALLEL):
+    # Yields mp3 chunks in sentence order; at most max_parallel sentences are synthesized at once
+    semaphore = asyncio.Semaphore(max_parallel)
+    tasks = [asyncio.ensure_future(_render(sentence, voice, speed, semaphore)) for sentence in split_sentences(text)]
+    chunks = []
+    try:
+        for task in tasks:
+            chunk = await task
+            chunks.append(chunk)
+            yield chunk
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    # Store the full reply too, so a later /text_to_speech for the same text is a cache hit (only
+    # reached when every sentence was rendered; a failed sentence raises out of the loop above)
+    if len(chunks) == len(tasks):
+        tts_cache.put(tts_cache.cache_key(text, voice, speed, openai_service.TTS_MODEL), b"".join(chunks))
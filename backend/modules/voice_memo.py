@@ -0,0 +1,54 @@
+# voice_memo.py:
+# Optional compaction of voice memos before they are sent to Whisper. With ffmpeg available the
+# memo is piped through it entirely in memory: leading/trailing and long internal silences are
+# trimmed and the audio is transcoded to 16 kHz mono Opus, which is far smaller than the phone's
+# recording. Without ffmpeg, or if it cannot read the input, the original bytes are used.
+import os
+import time
+import shutil
+import subprocess
+from . import metrics
+
+FFMPEG = shutil.which("ffmpeg")
+COMPACT_BY_DEFAULT = os.environ.get("VOICE_MEMO_COMPACT_HEALTHAPP", "1") == "1"
+FFMPEG_TIMEOUT = 30
+
+SILENCE_FILTER = (
+    "silenceremove=start_periods=1:start_threshold=-50dB:"
+    "stop_periods=-1:stop_duration=1:stop_threshold=-50dB"
+)
+
+def compact_audio(data, filename):
+    # Returns (data, filename, report); the filename extension tells Whisper the format
+    report = {"bytes_in": len(data), "compacted": False}
+    if not FFMPEG:
+        report["bytes_out"] = len(data)
+        return data, filename, report
+
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(
+            [FFMPEG, "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+             "-af", SILENCE_FILTER, "-ac", "1", "-ar", "16000",
+             "-c:a", "libopus", "-b:a", "24k", "-f", "ogg", "pipe:1"],
+            input=data,
+            capture_output=True,
+            timeout=FFMPEG_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        metrics.log_event("voice_memo_compact_failed", reason="timeout", bytes_in=len(data))
+        report["bytes_out"] = len(data)
+        return data, filename, report
+    report["transcode_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    # Some containers (e.g. m4a with the index at the end) cannot be read from a pipe
+    if result.returncode != 0 or not result.stdout or len(result.stdout) >= len(data):
+        if result.returncode != 0:
+            metrics.log_event("voice_memo_compact_failed", reason="ffmpeg", returncode=result.returncode,
+                              detail=result.stderr.decode(errors="replace").strip()[-200:])
+        report["bytes_out"] = len(data)
+        return data, filename, report
+
+    report["compacted"] = True
+    report["bytes_out"] = len(result.stdout)
+    return result.stdout, f"{os.path.splitext(filename)[0] or 'voice-memo'}.ogg", report
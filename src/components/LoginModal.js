@@ -16,6 +16,7 @@ const LoginModal = ({ isVisible, onCancel }) => {
       const response = await axios.post(`${apiBaseUrl}/login`, loginData);
       console.log("Login response data:", response.data);
       if (response.status === 200) {
+        // The session interceptors (store/session.js) have stored the token; it is sent and refreshed from there
         setUser({
           name: response.data.user,
           id: response.data.user_id,
@@ -16,6 +16,31 @@ import { translate } from '../components/translate';
 import { useDynamicStyles } from '../hooks/useDynamicStyles';
 import { useTheme } from '../context/ThemeContext';
 
+// One key per user send, reused for every retry of that send, so the server runs it only once
+const newIdempotencyKey = () =>
+  `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+
+const SEND_ATTEMPTS = 3;
+const RETRY_STATUSES = [502, 503, 504];
+
+const postWithRetry = async (url, data, config) => {
+  // Retries network errors and overload responses with the same Idempotency-Key; a retry of a send
+  // the server already finished gets the stored reply instead of starting another run
+  for (let attempt = 1; ; attempt++) {
+    try {
+      return await axios.post(url, data, config);
+    } catch (error) {
+      const status = error.response?.status;
+      const retryable = !error.response || RETRY_STATUSES.includes(status);
+      if (!retryable || attempt >= SEND_ATTEMPTS) {
+        throw error;
+      }
+      const retryAfter = Number(error.response?.headers?.['retry-after']) || attempt;
+      await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+    }
+  }
+};
+
 const BotScreen = ({ isActive, route }) => {
   const user = useStore(state => state.user);
   const { language } = useAppSettings();
@@ -25,6 +50,7 @@ const BotScreen = ({ isActive, route }) => {
   const iconColor = theme === 'dark' ? "#FFF" : "#05445E";
   
   const scrollViewRef = useRef();
+  const sendingRef = useRef(false); // Ignores a second tap while a send is in flight
   const [messages, setMessages] = useState([]);
   const [userMessage, setUserMessage] = useState("");
   const [threadId, setThreadId] = useState(null);
@@ -111,6 +137,9 @@ const BotScreen = ({ isActive, route }) => {
   // Handle sending new message
   const handleSendMessage = async (messageText) => {
     if (!messageText.trim() && !imageAttachment) return;
+    if (sendingRef.current) return;
+    sendingRef.current = true;
+    const idempotencyKey = newIdempotencyKey();
   
     const newUserMessage = { text: messageText, role: 'user' };
     setMessages([...messages, newUserMessage]);
@@ -136,9 +165,10 @@ const BotScreen = ({ isActive, route }) => {
 
     setIsLoading(true);
     try {
-      const response = await axios.post(`${apiBaseUrl}/thread_continue_with_image`, formData, {
+      const response = await postWithRetry(`${apiBaseUrl}/thread_continue_with_image`, formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
+          'Idempotency-Key': idempotencyKey,
         },
       });
       const newAssistantMessage = { text: response.data.message, role: 'assistant' };
@@ -146,6 +176,7 @@ const BotScreen = ({ isActive, route }) => {
     } catch (error) {
       console.error('Error sending message:', error);
     } finally {
+      sendingRef.current = false;
       setIsLoading(false);
       setUserMessage("");
       setImageAttachment(null);
@@ -279,10 +310,8 @@ const BotScreen = ({ isActive, route }) => {
     });
 
     try {
-      const uploadResponse = await axios.post(`${apiBaseUrl}/upload_voice_memo`, formData);
-      const fileUrl = uploadResponse.data.file_url;
-
-      const transcribeResponse = await axios.post(`${apiBaseUrl}/transcribe_voice_memo`, { file_url: fileUrl });
+      // Upload and transcribe in a single request
+      const transcribeResponse = await axios.post(`${apiBaseUrl}/voice_memo`, formData);
       const transcript = transcribeResponse.data.transcript;
 
       // Send the transcript as a message
@@ -1,5 +1,5 @@
 // src/screens/ThreadsScreen.js
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { View, Text, TouchableOpacity, FlatList, ActivityIndicator, TextInput, Modal } from 'react-native';
 import { AntDesign } from '@expo/vector-icons';
 import axios from 'axios';
@@ -16,6 +16,9 @@ const ThreadsScreen = ({ isActive, navigateToScreen }) => {
   const [modalVisible, setModalVisible] = useState(false);
   const [currentThread, setCurrentThread] = useState(null);
   const [newTitle, setNewTitle] = useState("");
+  const [nextCursor, setNextCursor] = useState(null);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
+  const firstPageEtag = useRef(null);
 
   const user = useStore(state => state.user);
   const { language } = useAppSettings();
@@ -37,17 +40,42 @@ const ThreadsScreen = ({ isActive, navigateToScreen }) => {
     }
   }, [isActive, user?.id]);
 
-  // Function to fetch threads
-  const fetchThreads = async () => {
+  // Function to fetch the first page of threads (newest first); 304 means our list is current
+  // (force skips the ETag check, e.g. after an edit to a thread that may be on a later page)
+  const fetchThreads = async ({ force = false } = {}) => {
     try {
-      const response = await axios.post(`${apiBaseUrl}/get_user_threads`, { user_id: user.id });
-      console.log('Fetched threads:', response.data.threads);
+      const response = await axios.post(`${apiBaseUrl}/get_user_threads`, { user_id: user.id }, {
+        headers: firstPageEtag.current && !force ? { 'If-None-Match': firstPageEtag.current } : {},
+        validateStatus: status => status === 200 || status === 304,
+      });
+      if (response.status === 304) {
+        return;
+      }
+      firstPageEtag.current = response.headers.etag || null;
       setThreads(response.data.threads || []);
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Error fetching threads:', error);
     }
   };
 
+  // Function to fetch the next page when the list is scrolled to the end
+  const fetchMoreThreads = async () => {
+    if (!nextCursor || isLoadingMore) {
+      return;
+    }
+    setIsLoadingMore(true);
+    try {
+      const response = await axios.post(`${apiBaseUrl}/get_user_threads`, { user_id: user.id, cursor: nextCursor });
+      setThreads(current => [...current, ...(response.data.threads || [])]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error fetching more threads:', error);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
   useEffect(() => {
     if (isActive && user?.id) {
       fetchThreads();
@@ -72,7 +100,7 @@ const ThreadsScreen = ({ isActive, navigateToScreen }) => {
 
     try {
       await axios.post(`${apiBaseUrl}/update_thread_title`, { thread_id: currentThread.thread_id, title: newTitle });
-      fetchThreads();
+      fetchThreads({ force: true });
       setModalVisible(false);
     } catch (error) {
       console.error('Error updating thread title:', error);
@@ -82,7 +110,7 @@ const ThreadsScreen = ({ isActive, navigateToScreen }) => {
   const handleDeleteThread = async () => {
     try {
       await axios.post(`${apiBaseUrl}/delete_thread`, { thread_id: currentThread.thread_id });
-      fetchThreads();
+      fetchThreads({ force: true });
       setModalVisible(false);
     } catch (error) {
       console.error('Error deleting thread:', error);
@@ -141,6 +169,9 @@ const ThreadsScreen = ({ isActive, navigateToScreen }) => {
       <FlatList
         data={threads}
         keyExtractor={item => item.thread_id}
+        onEndReached={fetchMoreThreads}
+        onEndReachedThreshold={0.5}
+        ListFooterComponent={isLoadingMore ? <ActivityIndicator /> : null}
         renderItem={({ item }) => (
           <View style={dynamicStyles.threadItem}>
             <TouchableOpacity onPress={() => handleThreadClick(item.thread_id)}>
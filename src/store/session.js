@@ -0,0 +1,71 @@
+// /src/store/session.js
+// Keeps the API token on every axios request. Tokens expire after an hour, so the token is swapped
+// for a new one shortly before that, new tokens returned by the update routes are picked up, and a
+// 401 (token expired or revoked) logs the user out so they can log in again. The time of the last
+// database write (X-Last-Write) is sent back, so reads right after a write skip the read replicas.
+import { Alert } from 'react-native';
+import axios from 'axios';
+import useStore from './store';
+
+const apiBaseUrl = 'http://enormous-mallard-noted.ngrok-free.app';
+const REFRESH_MARGIN = 5 * 60 * 1000; // Refresh when less than 5 minutes are left
+const NO_TOKEN_PATHS = ['/login', '/create_user', '/refresh_token'];
+
+let refreshing = null;
+let lastWrite = null;
+
+const refreshToken = () => {
+  // One refresh at a time; concurrent requests wait for the same one
+  if (!refreshing) {
+    const { token } = useStore.getState();
+    refreshing = axios.post(`${apiBaseUrl}/refresh_token`, {}, { headers: { Authorization: `Bearer ${token}` } })
+      .finally(() => { refreshing = null; });
+  }
+  return refreshing;
+};
+
+export const installSessionInterceptors = () => {
+  axios.interceptors.request.use(async config => {
+    const url = config.url || '';
+    if (NO_TOKEN_PATHS.some(path => url.endsWith(path))) {
+      return config;
+    }
+    const { token, tokenExpiresAt } = useStore.getState();
+    if (token && tokenExpiresAt && tokenExpiresAt - Date.now() < REFRESH_MARGIN) {
+      try {
+        await refreshToken();
+      } catch (error) {
+        console.error('Token refresh failed:', error);
+      }
+    }
+    const current = useStore.getState().token;
+    if (current) {
+      config.headers = { ...config.headers, Authorization: `Bearer ${current}` };
+    }
+    if (lastWrite) {
+      config.headers = { ...config.headers, 'X-Last-Write': lastWrite };
+    }
+    return config;
+  });
+
+  axios.interceptors.response.use(
+    response => {
+      if (response.headers?.['x-last-write']) {
+        lastWrite = response.headers['x-last-write'];
+      }
+      // Login, refresh and the settings/version updates return a new token
+      if (response.data && typeof response.data.token === 'string') {
+        useStore.getState().setToken(response.data.token, response.data.expires_in);
+      }
+      return response;
+    },
+    error => {
+      const url = error.config?.url || '';
+      if (error.response?.status === 401 && !url.endsWith('/login') && useStore.getState().user) {
+        useStore.getState().clearUser();
+        Alert.alert("Session Expired", "Please log in again.");
+      }
+      return Promise.reject(error);
+    }
+  );
+};
@@ -3,8 +3,11 @@ import { create } from 'zustand';
 
 const useStore = create(set => ({
   user: null,
+  token: null,
+  tokenExpiresAt: null, // ms timestamp; the session refreshes the token before this
   setUser: user => set({ user }),
-  clearUser: () => set({ user: null })
+  setToken: (token, expiresIn) => set({ token, tokenExpiresAt: expiresIn ? Date.now() + expiresIn * 1000 : null }),
+  clearUser: () => set({ user: null, token: null, tokenExpiresAt: null })
 }));
 
-export default useStore;
\ No newline at end of file
+export default useStore;